@@ -1,511 +1,369 @@
-from fastapi import APIRouter, Depends, UploadFile, File, HTTPException, status, BackgroundTasks, Body
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Depends, UploadFile, File, HTTPException, status, Body, Query, Header
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 import uuid
-import json
+import hashlib
+import asyncio
+import time
+from pathlib import Path
 import redis.asyncio as redis
-from pydantic import ValidationError, BaseModel
-import re  # Global import for regular expressions
+from pydantic import BaseModel
 import logging
-import base64
 
 # Set up logger for this module
 logger = logging.getLogger(__name__)
 
 from app.schemas.auth import User
-from app.schemas.processing import ProcessingResult, ProcessedPage
 from app.auth.service import get_current_active_user
 from app.core.redis_client import get_redis_client
-from app.services.text_refiner import refine_markdown, summarize_text, explain_like_im_five, remove_jargon
-from app.services.image_storage import ImageStorageService
+from app.services.text_refiner import summarize_text, explain_like_im_five, remove_jargon, stream_rephrase
+from app.services.document_processing import PIPELINE_VERSION
+from app.services.job_store import (
+    create_job,
+    update_job,
+    get_job,
+    save_pages,
+    get_pages,
+    get_page_manifest,
+    get_stored_pages,
+    get_stored_page_range,
+    get_stored_page,
+    events_channel,
+    request_cancellation,
+    is_cancellation_requested,
+    attach_job,
+    release_job_run,
+    TERMINAL_STATUSES,
+)
+from app.services.job_queue import build_job_fields, spool_path_for_job
+from app.services.job_scheduler import choose_priority, schedule_job, unschedule_job, get_queue_position
+from app.services.pdf import count_pdf_pages
+from app.services.result_codec import MARKER_ENCODINGS, stored_encoding, decode_stored, encoded_body, accepts_encoding
+from app.services.rephrase_cache import cached_rephrase, rephrase_cache_key, load_cached_rephrase, save_rephrase
+from app.services.rephrase_batch import run_rephrase_batch
+from app.core import metrics, json_codec
+from app.services.result_cache import (
+    document_fingerprint,
+    get_fingerprint_job,
+    claim_fingerprint,
+    release_fingerprint,
+    load_cached_result,
+)
 from app.core.config import settings
 
-# Import Mistral specific parts
-from mistralai import Mistral
-from mistralai.models import OCRPageObject
-
 router = APIRouter()
 
-PROCESSING_DB_PREFIX = "processing_job:"
-
-# Initialize Mistral Client (Consider injecting if app structure grows)
-# Ensure API key is loaded via settings
-if not settings.MISTRAL_API_KEY:
-    print("WARNING: MISTRAL_API_KEY not found in environment/config.")
-    # Optionally raise an error or handle appropriately
-mistral_client = Mistral(api_key=settings.MISTRAL_API_KEY)
-
-# Initialize image storage service
-image_service = ImageStorageService(storage_dir="static/temp_images")
-
-# Base URL for constructing image URLs, should be configured if not localhost
-BACKEND_BASE_URL = settings.BACKEND_URL or "http://localhost:8001"
-IMAGE_API_ENDPOINT_PREFIX = "/api/v1/images" # Path to your image serving endpoint
-
-# --- Helper function from user script (adapted) ---
-# This function seems redundant now given the new replace_images_in_markdown logic.
-# Consider removing if it's not used elsewhere or has a different specific purpose.
-# def normalize_image_references(markdown_str: str) -> str:
-#     ...
+# Upper bound on pages returned by one page-range request
+MAX_PAGES_PER_REQUEST = 50
 
-def replace_images_in_markdown(markdown_content: str, ocr_images_data: list[dict], page_index: int) -> str:
-    """Replaces image references in markdown with backend URLs pointing to uniquely named, saved image files."""
-    if not markdown_content:
-        return ""
+# Uploads are copied to the spool in pieces of this size
+UPLOAD_CHUNK_SIZE = 1024 * 1024
 
-    # This map will store {original_mistral_id: unique_backend_filename}
-    image_id_to_unique_filename = {}
-
-    # 1. Save all images from OCR data for this page and create the mapping
-    for img_data in ocr_images_data:
-        original_mistral_id = img_data.get("id")
-        base64_str = img_data.get("image_base64")
-
-        if not original_mistral_id or not base64_str:
-            logger.warning(f"Page {page_index + 1}: Skipping image due to missing id or base64 data. ID: {original_mistral_id}")
-            continue
+async def spool_upload(file: UploadFile, spool_path: Path) -> str:
+    """
+    Streams an upload to spool_path in fixed-size chunks, enforcing MAX_UPLOAD_BYTES,
+    and returns the SHA-256 of its content. The whole PDF is never held in memory.
+    """
+    content_hash = hashlib.sha256()
+    total_bytes = 0
+    with open(spool_path, "wb") as spool_file:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            total_bytes += len(chunk)
+            if total_bytes > settings.MAX_UPLOAD_BYTES:
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"File too large. Maximum size is {settings.MAX_UPLOAD_BYTES // (1024 * 1024)} MB."
+                )
+            content_hash.update(chunk)
+            await asyncio.to_thread(spool_file.write, chunk)
+    return content_hash.hexdigest()
+
+async def find_reusable_job(r: redis.Redis, fingerprint: str) -> str | None:
+    """Returns the ID of a queued, running or completed job for the same document fingerprint."""
+    source_job_id = await get_fingerprint_job(r, fingerprint)
+    if not source_job_id:
+        return None
+
+    source_data = await get_job(r, source_job_id)
+    if (source_data and source_data.get("status") not in ("error", "cancelled")
+            and not await is_cancellation_requested(r, source_job_id)):
+        return source_job_id
+
+    # The job expired, failed or is being cancelled; let this upload produce the result instead
+    await release_fingerprint(r, fingerprint, source_job_id)
+    return None
+
+async def load_user_job(r: redis.Redis, job_id: str, current_user: User, follow_source: bool = True) -> tuple[str, dict]:
+    """
+    Loads a job's status record after checking it belongs to the current user.
 
-        processed_base64 = preprocess_base64(base64_str)
-        if not processed_base64:
-            logger.warning(f"Page {page_index + 1}: Invalid base64 for image {original_mistral_id}. Skipping.")
-            continue
+    Jobs attached to another job for the same document are followed to that job (unless
+    follow_source is False), so the returned ID is the one whose pages should be read.
+    A job its owner cancelled while other uploads were attached keeps running for them,
+    but is reported to the owner as cancelled.
+    """
+    job_data = await get_job(r, job_id)
+    if not job_data:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Processing job not found or expired.")
 
-        mime_type = determine_mime_type(processed_base64) 
-        name_hint = original_mistral_id.split('.')[0] # e.g., "img-0"
-        
-        # Save image using the service, which now returns a unique filename
-        unique_filename = image_service.save_image(
-            processed_base64,
-            mime_type=mime_type,
-            name_hint=name_hint
-        )
+    # Check if the job belongs to the current user (if user_id is stored)
+    if "user_id" in job_data and job_data["user_id"] != current_user.id:
+        logger.warning(f"User {current_user.id} attempted to access job {job_id} belonging to user {job_data['user_id']}")
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You don't have permission to access this job.")
 
-        if unique_filename:
-            image_id_to_unique_filename[original_mistral_id] = unique_filename
-            logger.info(f"Page {page_index + 1}: Saved image {original_mistral_id} as {unique_filename}")
-        else:
-            logger.error(f"Page {page_index + 1}: Failed to save image {original_mistral_id}.")
+    if (job_data.get("owner_cancelled") == "1" and job_data.get("status") not in TERMINAL_STATUSES
+            and not await is_cancellation_requested(r, job_id)):
+        return job_id, {**job_data, "status": "cancelled", "detail": "Processing was cancelled."}
 
-    # 2. Replace image references in markdown
-    # Regex to find markdown image tags: ![alt text](image_id_from_mistral)
-    # It should correctly handle cases where image_id_from_mistral might have an extension.
-    pattern = re.compile(r"(!\[(.*?)\]\((.*?\.(?:jpeg|jpg|png|gif))\))") # Matches ![alt](id.ext)
+    source_job_id = job_data.get("source_job_id")
+    if not source_job_id or not follow_source or job_data.get("status") == "cancelled":
+        return job_id, job_data
 
-    def replace_match(match):
-        full_tag, alt_text, original_img_ref = match.groups()
-        
-        # original_img_ref is like "img-0.jpeg"
-        unique_filename = image_id_to_unique_filename.get(original_img_ref)
-        
-        if unique_filename:
-            # Construct the full URL to the backend image endpoint
-            backend_image_url = f"{BACKEND_BASE_URL}{IMAGE_API_ENDPOINT_PREFIX}/{unique_filename}"
-            new_tag = f"![{alt_text}]({backend_image_url})"
-            logger.debug(f"Page {page_index + 1}: Replaced '{original_img_ref}' with '{backend_image_url}'")
-            return new_tag
-        else:
-            # If the image wasn't in ocr_images_data or failed to save, keep original or use placeholder
-            logger.warning(f"Page {page_index + 1}: Image ref '{original_img_ref}' not found in saved images. Original tag kept.")
-            # Optionally, replace with a specific placeholder for missing backend images
-            # return f"![{alt_text}](http://image-placeholder.internal/image_not_found_on_backend.jpg)"
-            return full_tag # Keep original if not found
+    source_data = await get_job(r, source_job_id)
+    if not source_data:
+        logger.warning(f"Job {job_id}: Source job {source_job_id} not found or expired")
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Processing job not found or expired.")
 
-    processed_markdown = pattern.sub(replace_match, markdown_content)
-    
-    # After replacements, call table fixing
-    processed_markdown = fix_markdown_tables(processed_markdown)
-    
-    logger.info(f"Page {page_index + 1}: Markdown processing complete. Images mapped: {len(image_id_to_unique_filename)}")
-    return processed_markdown
+    # Report the file name this user uploaded, not the one used by the source job
+    source_data["file_name"] = job_data.get("file_name")
+    return source_job_id, source_data
 
-def fix_markdown_tables(markdown_str: str) -> str:
+async def stop_job_run(r: redis.Redis, job_id: str) -> bool:
     """
-    Enhanced function to robustly fix and format markdown tables.
-    
-    This function:
-    1. Properly detects table boundaries in markdown text
-    2. Normalizes table structure with consistent column counts
-    3. Handles header rows and separator rows correctly
-    4. Ensures proper formatting and alignment of all cells
-    5. Adds visual spacing around tables for better readability
+    Stops a job nothing depends on any more (see release_job_run). Returns True if it was
+    still queued and is cancelled already, False if the worker running it was told to stop.
     """
-    if not markdown_str:
-        return ""
-
-    lines = markdown_str.split('\n')
-    result_lines = []
-    i = 0
-    
-    while i < len(lines):
-        line = lines[i].strip()
-
-        # Detect potential table start (line with multiple pipe characters that looks like a table row)
-        if line.count('|') >= 2 and line.strip().startswith('|') and line.strip().endswith('|'):
-            # Found potential table start, collect all table lines
-            table_lines = [line]
-            table_start_idx = i
-            i += 1
-            
-            # Collect all subsequent lines that look like table rows
-            while i < len(lines) and lines[i].strip().count('|') >= 2 and lines[i].strip().startswith('|') and lines[i].strip().endswith('|'):
-                table_lines.append(lines[i].strip())
-                i += 1
-            
-            # Only process as table if we have at least 2 rows (header + data)
-            if len(table_lines) >= 2:
-                # Process and fix the table
-                fixed_table = process_table(table_lines)
-                
-                # Add a blank line before the table if there isn't one already
-                if result_lines and result_lines[-1].strip():
-                    result_lines.append('')
-                
-                # Add the fixed table
-                result_lines.extend(fixed_table)
-                
-                # Add a blank line after the table
-                result_lines.append('')
-            else:
-                # Not a valid table, preserve original lines
-                result_lines.extend(lines[table_start_idx:i])
-        else:
-            # Not a table line, keep as is
-            result_lines.append(line)
-            i += 1
-    
-    return '\n'.join(result_lines)
-
-def process_table(table_lines: list) -> list:
-    """Process and fix a markdown table section."""
-    
-    # Clean up each line
-    cleaned_lines = []
-    for line in table_lines:
-        # Remove problematic tokens and normalize
-        cleaned = line.strip()
-        cleaned = cleaned.replace('[UNK]:', '').replace('[PAD]', '').replace('<unk>', '').replace('<pad>', '')
-        cleaned = re.sub(r'→\s*T\s*→', '→', cleaned)  # Fix arrow symbols
-        
-        # Normalize spacing around pipes for consistent cell detection
-        # First, ensure the line has leading and trailing pipes
-        if not cleaned.startswith('|'):
-            cleaned = '| ' + cleaned
-        if not cleaned.endswith('|'):
-            cleaned = cleaned + ' |'
-            
-        # Then normalize internal spacing
-        cleaned = re.sub(r'\|\s*', '| ', cleaned)
-        cleaned = re.sub(r'\s*\|', ' |', cleaned)
-        
-        # Skip completely empty rows
-        if re.match(r'^\s*\|(\s*\|)+\s*$', cleaned):
-            continue
-
-        cleaned_lines.append(cleaned)
-    
-    if not cleaned_lines:
-        return []  # No valid lines found
-    
-    # Analyze the first row to determine number of columns
-    header_cells = extract_cells(cleaned_lines[0])
-    num_cols = max(len(header_cells), 1)  # Ensure at least one column
-    
-    # Check if second row is a separator row
-    has_separator = False
-    if len(cleaned_lines) > 1:
-        second_row_cells = extract_cells(cleaned_lines[1])
-        has_separator = all(
-            cell.strip().replace('-', '').replace(':', '') == '' 
-            for cell in second_row_cells
-        )
-
-    # Rebuild the table with proper structure
-    fixed_table = []
-    
-    # 1. Properly format header row
-    header_cells = pad_or_truncate_cells(header_cells, num_cols)
-    fixed_table.append(format_row(header_cells))
-
-    # 2. Always include a proper separator row with alignment
-    alignments = determine_alignments(cleaned_lines[1] if has_separator and len(cleaned_lines) > 1 else None, num_cols)
-    separator_row = format_separator_row(alignments)
-    fixed_table.append(separator_row)
-    
-    # 3. Process data rows (skip header and separator if present)
-    start_idx = 1
-    if has_separator:
-        start_idx = 2
-        
-    for i in range(start_idx, len(cleaned_lines)):
-        row_cells = extract_cells(cleaned_lines[i])
-        row_cells = pad_or_truncate_cells(row_cells, num_cols)
-        row_cells = process_cell_content(row_cells)
-        fixed_table.append(format_row(row_cells))
-    
-    return fixed_table
-
-def extract_cells(row: str) -> list:
-    """Extract cell content from a table row."""
-    # Split by pipe and remove empty first/last elements
-    parts = row.split('|')
-    return [part.strip() for part in parts[1:-1]]  # Skip first and last (empty due to leading/trailing pipes)
-
-def pad_or_truncate_cells(cells: list, target_length: int) -> list:
-    """Ensure the cells list has exactly the target length."""
-    if len(cells) < target_length:
-        return cells + [''] * (target_length - len(cells))
-    return cells[:target_length]  # Truncate if too many
-
-def process_cell_content(cells: list) -> list:
-    """Process the content of each cell for better formatting."""
-    processed = []
-    for cell in cells:
-        # Convert bullet points for better readability
-        if cell.strip().startswith('-'):
-            cell = '• ' + cell.strip()[1:].strip()
-        processed.append(cell)
-    return processed
-
-def determine_alignments(separator_row: str, num_cols: int) -> list:
-    """Determine column alignments from separator row."""
-    alignments = ['left'] * num_cols  # Default all to left alignment
-    
-    if separator_row:
-        separator_cells = extract_cells(separator_row)
-        for i, cell in enumerate(separator_cells):
-            if i >= num_cols:
-                break
-
-            cell = cell.strip()
-            if cell.startswith(':') and cell.endswith(':'):
-                alignments[i] = 'center'
-            elif cell.endswith(':'):
-                alignments[i] = 'right'
-    
-    return alignments
-
-def format_separator_row(alignments: list) -> str:
-    """Format the separator row with proper alignment indicators."""
-    separators = []
-    for align in alignments:
-        if align == 'center':
-            separators.append(':---:')
-        elif align == 'right':
-            separators.append('---:')
-        else:  # left alignment
-            separators.append('---')
-    
-    return '| ' + ' | '.join(separators) + ' |'
-
-def format_row(cells: list) -> str:
-    """Format a row with proper cell spacing."""
-    return '| ' + ' | '.join(cells) + ' |'
-
-async def get_combined_markdown(page: OCRPageObject, document_type: str = "cheatsheet") -> str:
-    """Gets markdown with embedded images for a single page object."""
-    if not page or not hasattr(page, 'markdown'): # Added check for markdown attribute
-        logger.warning(f"OCR page object is empty or missing markdown. Index: {getattr(page, 'index', 'N/A')}")
-        return ""
-
-    page_index = page.index
-    ocr_images_data = []
-    if page.images:
-        for img_obj in page.images:
-            if img_obj.id and img_obj.image_base64:
-                ocr_images_data.append({"id": img_obj.id, "image_base64": img_obj.image_base64})
-            else:
-                logger.warning(f"Page {page_index + 1}: Found image object with missing id or base64.")
-    else:
-        logger.info(f"Page {page_index + 1}: No images found in OCR result.")
-
-    # Replace images in markdown using their original Mistral IDs and the new unique filenames
-    # The ocr_images_data list now contains dicts like {"id": "img-0.jpeg", "image_base64": "..."}
-    processed_markdown = replace_images_in_markdown(page.markdown, ocr_images_data, page_index)
-
-    # Refinement step (ensure GOOGLE_API_KEY check is appropriate)
-    if settings.GOOGLE_API_KEY:
-        try:
-            logger.info(f"Refining markdown for page {page_index + 1} using Google Gemini")
-            refined_markdown = await refine_markdown(processed_markdown, context=document_type)
-            # (image and table count logging can remain here for verification)
-            return refined_markdown
-        except Exception as e:
-            logger.error(f"Error refining markdown for page {page_index + 1} with Google Gemini: {str(e)}. Using processed markdown.")
-            return processed_markdown # Fallback to markdown processed for images and tables
+    job_data = await get_job(r, job_id)
+    if not job_data or job_data.get("status") in TERMINAL_STATUSES:
+        return False
+
+    queued_fields = await unschedule_job(r, job_id)
+    if queued_fields is not None:
+        # Never reached a worker, so there is nothing to stop
+        await update_job(r, job_id, status="cancelled", detail="Processing was cancelled.")
+        if queued_fields.get("fingerprint"):
+            await release_fingerprint(r, queued_fields["fingerprint"], job_id)
+        spool_path_for_job(job_id).unlink(missing_ok=True)
+        metrics.increment("jobs_cancelled")
+        logger.info(f"Job {job_id}: Cancelled before dispatch")
+        return True
+
+    await request_cancellation(r, job_id)
+    return False
+
+# Stands in for the page list when rendering a response around stored pages
+PAGES_PLACEHOLDER = "__pages__"
+
+def passthrough_encoding(stored_pages: list[str], accept_encoding: str | None) -> str | None:
+    """The Content-Encoding shared by all stored pages, if the client accepts it."""
+    encodings = {stored_encoding(stored_page) for stored_page in stored_pages}
+    if len(encodings) != 1:
+        return None
+    encoding = encodings.pop()
+    return encoding if encoding and accepts_encoding(accept_encoding, encoding) else None
+
+def job_etag(job_id: str, data_job_id: str, job_data: dict) -> str:
+    """Strong ETag for a job's responses, which changes whenever its status record or pages do."""
+    digest = hashlib.sha256(f"{job_id}:{data_job_id}:{job_data.get('revision', 0)}".encode("utf-8")).hexdigest()
+    return f'"{digest[:24]}"'
+
+def encoded_etag(etag: str, encoding: str | None) -> str:
+    # Compressed and plain bodies are different representations, so they need different strong ETags
+    return f'{etag[:-1]}-{encoding}"' if encoding else etag
+
+def matching_etag(if_none_match: str | None, etag: str | None, accept_encoding: str | None) -> str | None:
+    """
+    The current ETag that If-None-Match names, in a representation the client accepts,
+    or None if it names none of them. A 304 must carry this ETag rather than the plain one.
+    """
+    if not if_none_match or not etag:
+        return None
+    current_etags = {etag} | {
+        encoded_etag(etag, encoding) for encoding in MARKER_ENCODINGS.values()
+        if accepts_encoding(accept_encoding, encoding)
+    }
+    for tag in if_none_match.split(","):
+        # If-None-Match uses weak comparison, and proxies may weaken ETags when recompressing
+        tag = tag.strip().removeprefix("W/")
+        if tag == "*":
+            # Any representation matches; every client accepts the plain one
+            return etag
+        if tag in current_etags:
+            return tag
+    return None
+
+def poll_headers(job_status: str | None, etag: str | None) -> dict:
+    """Caching headers for job responses: the ETag, and a polling hint while the job isn't finished."""
+    headers = {}
+    if etag:
+        headers.update({"ETag": etag, "Cache-Control": "private, no-cache"})
+    if job_status in ("queued", "processing"):
+        headers["Retry-After"] = str(settings.JOB_POLL_RETRY_AFTER_SECONDS)
+    return headers
+
+def not_modified_response(headers: dict, etag: str) -> Response:
+    metrics.increment("job_responses_not_modified")
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={**headers, "ETag": etag})
+
+def stored_pages_response(envelope: dict | None, stored_pages: list[str], accept_encoding: str | None,
+                          headers: dict | None = None) -> Response:
+    """
+    Sends stored pages inside envelope (a JSON object with PAGES_PLACEHOLDER where the
+    page list goes), or a single page if envelope is None. The server wrote the pages, so
+    their JSON is sent as stored instead of being parsed, validated and re-encoded. If
+    the client accepts the stored compression they aren't even decompressed.
+    """
+    encoding = passthrough_encoding(stored_pages, accept_encoding)
+    headers = {**(headers or {}), "Vary": "Accept-Encoding"}
+    if "ETag" in headers:
+        headers["ETag"] = encoded_etag(headers["ETag"], encoding)
+    if envelope is None:
+        pieces = stored_pages[:1]
     else:
-        logger.info(f"Page {page_index + 1}: No GOOGLE_API_KEY provided. Skipping LLM refinement.")
-        return processed_markdown
-
-# --- Background Task for Processing ---
-async def run_mistral_ocr_processing(job_id: str, file_content: bytes, file_name: str, r: redis.Redis, document_type: str = "cheatsheet"):
-    job_key = f"{PROCESSING_DB_PREFIX}{job_id}"
-    signed_url = None
-    uploaded_file_id = None
-
-    try:
-        logger.info(f"Job {job_id}: Starting processing for {file_name}")
-        # 1. Upload the entire file
-        uploaded_pdf = mistral_client.files.upload(
-            file={
-                "file_name": file_name,
-                "content": file_content
-            },
-            purpose="ocr"
-        )
-        uploaded_file_id = uploaded_pdf.id
-        logger.info(f"Job {job_id}: File uploaded to Mistral")
-
-        # 2. Get Signed URL
-        signed_url_response = mistral_client.files.get_signed_url(file_id=uploaded_file_id)
-        signed_url = signed_url_response.url
-
-        # 3. Update status to processing in Redis (no page count needed upfront)
-        await r.setex(job_key, settings.PROCESSING_RESULT_EXPIRATION_SECONDS,
-                    json.dumps({"status": "processing", "file_name": file_name}))
-
-        # 4. Process ENTIRE Document in one API call
-        logger.info(f"Job {job_id}: Sending document to OCR service")
-        ocr_response_obj = mistral_client.ocr.process(
-            model="mistral-ocr-latest",
-            document={
-                "type": "document_url",
-                "document_url": signed_url
-            },
-            include_image_base64=True
-        )
-
-        # 5. Process Pages from the single response
-        processed_pages_data = []
-        num_pages = 0
-        if ocr_response_obj and ocr_response_obj.pages:
-            num_pages = len(ocr_response_obj.pages)
-            logger.info(f"Job {job_id}: Received {num_pages} pages from OCR service")
-
-            for page_result in ocr_response_obj.pages:
-                page_num = page_result.index + 1
-                logger.info(f"Job {job_id}: Processing page {page_num}/{num_pages}")
-                try:
-                    # Pass the page_result (OCRPageObject) directly
-                    markdown_content = await get_combined_markdown(page_result, document_type)
-
-                    processed_pages_data.append(
-                        ProcessedPage(
-                            page_number=page_num,
-                            markdown_content=markdown_content
-                        ).model_dump()
-                    )
-                except Exception as page_extract_err:
-                    logger.error(f"Job {job_id}: Error processing page {page_num}: {page_extract_err}")
-                    processed_pages_data.append(
-                        ProcessedPage(
-                            page_number=page_num,
-                            markdown_content=f"*Error processing page {page_num}: There was a problem extracting content from this page.*"
-                        ).model_dump()
-                    )
-
-                # Update progress (now based on pages processed from the response)
-                await r.setex(job_key, settings.PROCESSING_RESULT_EXPIRATION_SECONDS,
-                            json.dumps({"status": "processing", "file_name": file_name, "current_page": page_num, "total_pages": num_pages}))
-        else:
-            logger.error(f"Job {job_id}: OCR response did not contain any pages")
-            raise Exception("OCR response did not contain any pages.")
-
-        # 6. Final Result
-        result = ProcessingResult(
-            file_name=file_name,
-            total_pages=num_pages,
-            pages=processed_pages_data
+        # The page list is the envelope's last field, so the last occurrence is the placeholder
+        prefix, suffix = json_codec.dumps(envelope).rsplit(json_codec.dumps(PAGES_PLACEHOLDER), 1)
+        pieces = [f"{prefix}[".encode("utf-8")]
+        for position, stored_page in enumerate(stored_pages):
+            if position:
+                pieces.append(b",")
+            pieces.append(stored_page)
+        pieces.append(f"]{suffix}".encode("utf-8"))
+
+    if not encoding:
+        body = b"".join(
+            piece if isinstance(piece, bytes) else decode_stored(piece).encode("utf-8") for piece in pieces
         )
-
-        await r.setex(job_key, settings.PROCESSING_RESULT_EXPIRATION_SECONDS,
-                    json.dumps({"status": "completed", "result": result.model_dump()}))
-        logger.info(f"Job {job_id}: Processing completed successfully")
-
-    except Exception as e:
-        logger.error(f"Job {job_id}: Error during processing: {str(e)}")
-        await r.setex(job_key, settings.PROCESSING_RESULT_EXPIRATION_SECONDS,
-                    json.dumps({"status": "error", "detail": f"An unexpected error occurred during OCR: {str(e)}"}))
-    finally:
-        # Clean up uploaded file from Mistral storage if possible (optional)
-        if uploaded_file_id:
-            try:
-                mistral_client.files.delete(file_id=uploaded_file_id)
-                logger.info(f"Job {job_id}: Cleaned up temporary files")
-            except Exception as del_err:
-                logger.warning(f"Job {job_id}: Error deleting uploaded file: {str(del_err)}")
+        return Response(content=body, media_type="application/json", headers=headers)
+    metrics.increment("page_responses_passthrough")
+    return Response(
+        content=encoded_body(pieces, encoding),
+        media_type="application/json",
+        headers={**headers, "Content-Encoding": encoding}
+    )
 
 # --- API Endpoints ---
 @router.post("/", status_code=status.HTTP_202_ACCEPTED)
 async def process_pdf_endpoint(
     file: UploadFile = File(...),
     document_type: str = "cheatsheet",  # Default document type
+    fast_first_view: bool = False,  # Publish raw OCR pages first, refine them in the background
+    priority: str | None = Query(None, pattern="^(interactive|bulk)$"),  # Defaults to bulk for users with a backlog
     current_user: User = Depends(get_current_active_user),
-    r: redis.Redis = Depends(get_redis_client),
-    background_tasks: BackgroundTasks = BackgroundTasks()
+    r: redis.Redis = Depends(get_redis_client)
 ):
-    """Accepts PDF, starts Mistral OCR background processing, returns job ID."""
+    """Accepts PDF, enqueues it for the OCR workers, returns job ID."""
     if file.content_type != "application/pdf":
         raise HTTPException(status_code=400, detail="Invalid file type. Only PDFs are accepted.")
 
     job_id = str(uuid.uuid4())
-    job_key = f"{PROCESSING_DB_PREFIX}{job_id}"
     file_name = file.filename
 
     logger.info(f"User {current_user.email} uploaded file: {file_name}")
+    fingerprint = None
+    # Hand the PDF to the workers through the shared upload spool
+    spool_path = spool_path_for_job(job_id)
+    enqueued = False
 
     try:
-        file_content = await file.read()
+        content_hash = await spool_upload(file, spool_path)
+        job_record = {
+            "status": "queued",
+            "file_name": file_name,
+            "user_id": current_user.id
+        }
+
+        # Identical uploads (same bytes, document type and pipeline version) share one result
+        fingerprint = document_fingerprint(content_hash, document_type, PIPELINE_VERSION)
+
+        # Claim the fingerprint, or attach to the job that already holds it (in flight or completed)
+        while not await claim_fingerprint(r, fingerprint, job_id):
+            source_job_id = await find_reusable_job(r, fingerprint)
+            # Attaching fails if the job started being cancelled since; the fingerprint is then released
+            if source_job_id and await attach_job(r, source_job_id, job_id):
+                logger.info(f"Job {job_id}: Attached to job {source_job_id} for identical document {fingerprint[:12]}")
+                await create_job(r, job_id, **job_record, source_job_id=source_job_id)
+                return {"job_id": job_id, "status": "queued"}
+
+        # Results of earlier jobs survive on disk after their Redis entries expire
+        cached_result = await load_cached_result(fingerprint)
+        if cached_result:
+            logger.info(f"Job {job_id}: Completed from cached result for document {fingerprint[:12]}")
+            await create_job(r, job_id, **job_record)
+            await save_pages(r, job_id, cached_result.get("pages", []))
+            await update_job(r, job_id, status="completed", total_pages=cached_result.get("total_pages", 0))
+            return {"job_id": job_id, "status": "completed"}
+
         # Store initial job status
-        await r.setex(job_key, settings.PROCESSING_RESULT_EXPIRATION_SECONDS,
-                      json.dumps({
-                          "status": "queued",
-                          "file_name": file_name,
-                          "user_id": current_user.id
-                      }))
+        await create_job(r, job_id, **job_record)
 
-        # Add the processing to background tasks
-        background_tasks.add_task(run_mistral_ocr_processing, job_id, file_content, file_name, r, document_type)
+        # Queue for the OCR workers (see worker.py) in fair order across users; the API process does no OCR itself
+        try:
+            page_count = await asyncio.to_thread(count_pdf_pages, spool_path)
+        except Exception:
+            page_count = 1  # Unreadable here; the worker reports the real error
+        job_priority = await choose_priority(r, current_user.id, priority)
+        await schedule_job(
+            r,
+            build_job_fields(
+                job_id, file_name, document_type, current_user.id,
+                fingerprint=fingerprint, fast_first_view=fast_first_view
+            ),
+            job_priority,
+            page_count
+        )
+        enqueued = True
 
         return {"job_id": job_id, "status": "queued"}
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error accepting job {job_id}: {e}")
         # Don't set error status in Redis here, as the job hasn't started
+        if fingerprint:
+            await release_fingerprint(r, fingerprint, job_id)
         raise HTTPException(status_code=500, detail=f"Failed to queue processing job: {str(e)}")
     finally:
         await file.close() # Close file handle
+        if not enqueued:
+            # Attached, served from cache or rejected: no worker will need the spooled file
+            spool_path.unlink(missing_ok=True)
 
 
 @router.get("/{job_id}") # No response_model here, return raw dict based on status
 async def get_processing_result(
     job_id: str,
+    accept_encoding: str | None = Header(None),
+    if_none_match: str | None = Header(None),
     current_user: User = Depends(get_current_active_user),
     r: redis.Redis = Depends(get_redis_client)
 ):
-    """Retrieves the status or result of a processing job by its ID."""
-    job_key = f"{PROCESSING_DB_PREFIX}{job_id}"
-    job_data_json = await r.get(job_key)
+    """
+    Retrieves the status or result of a processing job by its ID. Completed results are
+    sent compressed as stored when the client accepts the stored encoding.
 
-    if not job_data_json:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Processing job not found or expired.")
+    Responses carry an ETag; polls with a matching If-None-Match get 304 Not Modified
+    from the status record alone. Queued and running jobs also send Retry-After.
+    """
+    data_job_id, job_data = await load_user_job(r, job_id, current_user)
+    job_status = job_data.get("status")
+    # Queue positions move without the job itself changing, so queued responses get no ETag
+    etag = job_etag(job_id, data_job_id, job_data) if job_status != "queued" else None
+    headers = poll_headers(job_status, etag)
+    matched_etag = matching_etag(if_none_match, etag, accept_encoding)
+    if matched_etag:
+        return not_modified_response(headers, matched_etag)
 
     try:
-        job_data = json.loads(job_data_json)
-        job_status = job_data.get("status")
-
-        # Check if the job belongs to the current user (if user_id is stored)
-        if "user_id" in job_data and job_data["user_id"] != current_user.id:
-            logger.warning(f"User {current_user.id} attempted to access job {job_id} belonging to user {job_data['user_id']}")
-            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You don't have permission to access this job.")
 
         if job_status == "completed":
-            result_payload = job_data.get("result", {})
-            # Validate the structure before returning
-            try:
-                validated_result = ProcessingResult(**result_payload)
-                return {"status": "completed", "result": validated_result}
-            except ValidationError as val_err:
-                logger.error(f"Job {job_id}: Validation error for completed result: {val_err}")
-                raise HTTPException(status_code=500, detail="Completed job data is invalid.")
+            # Only completed jobs read the (potentially large) page hash
+            stored_pages = await get_stored_pages(r, data_job_id)
+            # Shaped like {"status": "completed", "result": ProcessingResult}
+            return stored_pages_response({"status": "completed", "result": {
+                "file_name": job_data.get("file_name") or "",
+                "total_pages": job_data.get("total_pages", len(stored_pages)),
+                "pages": PAGES_PLACEHOLDER
+            }}, stored_pages, accept_encoding, headers)
         elif job_status == "processing":
              # Return processing status including progress
              return JSONResponse(
@@ -514,19 +372,29 @@ async def get_processing_result(
                      "status": "processing",
                      "current_page": job_data.get("current_page", 0),
                      "total_pages": job_data.get("total_pages", 0),
-                     "file_name": job_data.get("file_name")
-                 }
+                     "file_name": job_data.get("file_name"),
+                     # Unrefined pages readable through the page endpoints so far, and whether all are
+                     "first_view_pages": job_data.get("first_view_pages", 0),
+                     "first_view_ready": job_data.get("first_view") == "ready"
+                 },
+                 headers=headers
              )
         elif job_status == "queued":
+            # Waiting jobs report where they are in the fair queue; dispatched ones are about to start
+            queue_info = await get_queue_position(r, data_job_id) or {"queue_position": 0, "eta_seconds": None}
             return JSONResponse(
                  status_code=status.HTTP_202_ACCEPTED,
-                 content={"status": "queued", "file_name": job_data.get("file_name")}
+                 content={"status": "queued", "file_name": job_data.get("file_name"), **queue_info},
+                 headers=headers
              )
+        elif job_status == "cancelled":
+            return JSONResponse(content={"status": "cancelled", "file_name": job_data.get("file_name")}, headers=headers)
         elif job_status == "error":
             # Return error status with detail
             return JSONResponse(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                content={"status": "error", "detail": job_data.get('detail', 'Unknown processing error')}
+                content={"status": "error", "detail": job_data.get('detail', 'Unknown processing error')},
+                headers=headers
             )
         else:
             # Unknown status
@@ -536,20 +404,269 @@ async def get_processing_result(
                 content={"status": "error", "detail": "Unknown job status found in storage."}
             )
 
-    except (json.JSONDecodeError, ValidationError) as e:
-        logger.error(f"Error decoding/validating job data for {job_id}: {e}")
+    except ValueError as e:
+        logger.error(f"Error decoding job data for {job_id}: {e}")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Could not read job result data.")
 
+@router.delete("/{job_id}", status_code=status.HTTP_202_ACCEPTED)
+async def cancel_processing_job(
+    job_id: str,
+    current_user: User = Depends(get_current_active_user),
+    r: redis.Redis = Depends(get_redis_client)
+):
+    """
+    Cancels a queued or running job. Jobs still waiting in the queue are cancelled right
+    away; running jobs are stopped by whichever worker runs them, and their status turns
+    `cancelled` once the worker has cleaned up.
+
+    Uploads of the same document by other users attach to one job. Cancelling only
+    detaches the requester: the job keeps running while any other upload depends on it,
+    and is stopped once its owner and every attached upload have cancelled.
+    """
+    _, job_data = await load_user_job(r, job_id, current_user, follow_source=False)
+    if job_data.get("status") in TERMINAL_STATUSES:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Job is already {job_data.get('status')}.")
+
+    source_job_id = job_data.get("source_job_id")
+    if source_job_id:
+        await update_job(r, job_id, status="cancelled")
+        logger.info(f"Job {job_id}: Detached from job {source_job_id} by user {current_user.id}")
+        if await release_job_run(r, source_job_id, job_id):
+            # This was the last upload waiting for a job its owner had cancelled
+            await stop_job_run(r, source_job_id)
+        return JSONResponse(status_code=status.HTTP_200_OK, content={"job_id": job_id, "status": "cancelled"})
+
+    await update_job(r, job_id, owner_cancelled="1")
+    if not await release_job_run(r, job_id):
+        logger.info(f"Job {job_id}: Cancelled by user {current_user.id}, still running for attached uploads")
+        return JSONResponse(status_code=status.HTTP_200_OK, content={"job_id": job_id, "status": "cancelled"})
+
+    logger.info(f"Job {job_id}: Cancellation requested by user {current_user.id}")
+    if await stop_job_run(r, job_id):
+        return JSONResponse(status_code=status.HTTP_200_OK, content={"job_id": job_id, "status": "cancelled"})
+    return {"job_id": job_id, "status": "cancelling"}
+
+@router.get("/{job_id}/manifest")
+async def get_job_manifest(
+    job_id: str,
+    if_none_match: str | None = Header(None),
+    current_user: User = Depends(get_current_active_user),
+    r: redis.Redis = Depends(get_redis_client)
+):
+    """Returns the job's status plus page count, per-page sizes and image counts, without page content."""
+    data_job_id, job_data = await load_user_job(r, job_id, current_user)
+    etag = job_etag(job_id, data_job_id, job_data)
+    headers = poll_headers(job_data.get("status"), etag)
+    matched_etag = matching_etag(if_none_match, etag, None)
+    if matched_etag:
+        return not_modified_response(headers, matched_etag)
+    return JSONResponse(content={
+        "status": job_data.get("status"),
+        "file_name": job_data.get("file_name"),
+        "total_pages": job_data.get("total_pages", 0),
+        "pages": await get_page_manifest(r, data_job_id)
+    }, headers=headers)
+
+@router.get("/{job_id}/pages")
+async def get_job_pages(
+    job_id: str,
+    start: int = Query(1, ge=1, description="First page number to return"),
+    count: int = Query(10, ge=1, le=MAX_PAGES_PER_REQUEST, description="Number of pages to return"),
+    accept_encoding: str | None = Header(None),
+    if_none_match: str | None = Header(None),
+    current_user: User = Depends(get_current_active_user),
+    r: redis.Redis = Depends(get_redis_client)
+):
+    """
+    Returns a window of pages. Works while the job is still processing; pages that
+    haven't finished yet are simply absent from the response.
+    """
+    data_job_id, job_data = await load_user_job(r, job_id, current_user)
+    etag = job_etag(job_id, data_job_id, job_data)
+    headers = poll_headers(job_data.get("status"), etag)
+    matched_etag = matching_etag(if_none_match, etag, accept_encoding)
+    if matched_etag:
+        return not_modified_response(headers, matched_etag)
+    stored_pages = await get_stored_page_range(r, data_job_id, start, count)
+    response = {
+        "status": job_data.get("status"),
+        "total_pages": job_data.get("total_pages", 0),
+        "start": start,
+        "count": count,
+        "pages": PAGES_PLACEHOLDER
+    }
+    return stored_pages_response(response, stored_pages, accept_encoding, headers)
+
+@router.get("/{job_id}/pages/{page_number}")
+async def get_job_page(
+    job_id: str,
+    page_number: int,
+    accept_encoding: str | None = Header(None),
+    if_none_match: str | None = Header(None),
+    current_user: User = Depends(get_current_active_user),
+    r: redis.Redis = Depends(get_redis_client)
+):
+    """Returns a single page of a job."""
+    data_job_id, job_data = await load_user_job(r, job_id, current_user)
+    etag = job_etag(job_id, data_job_id, job_data)
+    headers = poll_headers(job_data.get("status"), etag)
+    matched_etag = matching_etag(if_none_match, etag, accept_encoding)
+    if matched_etag:
+        return not_modified_response(headers, matched_etag)
+    stored_page = await get_stored_page(r, data_job_id, page_number)
+    if not stored_page:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Page {page_number} not found or not processed yet.")
+    return stored_pages_response(None, [stored_page], accept_encoding, headers)
+
+# Seconds between keep-alive comments on an idle event stream
+SSE_KEEPALIVE_SECONDS = 15.0
+# How often event streams re-read the job when the Redis client can't subscribe (Upstash REST)
+EVENT_POLL_INTERVAL_SECONDS = 2.0
+
+def format_sse(event: str, data: dict) -> str:
+    """Formats a single Server-Sent Events message."""
+    return f"event: {event}\ndata: {json_codec.dumps(data)}\n\n"
+
+async def poll_job_events(r: redis.Redis, job_id: str, job_data: dict, sent_versions: dict[int, int]):
+    """
+    SSE messages for a job followed by polling its status record, for Redis clients
+    without pub/sub. Pages are only re-read when the record's revision changed.
+    """
+    idle_seconds = 0.0
+    while True:
+        await asyncio.sleep(EVENT_POLL_INTERVAL_SECONDS)
+        latest = await get_job(r, job_id)
+        if not latest:
+            yield format_sse("status", {"status": "error", "detail": "Processing job not found or expired."})
+            return
+        if latest.get("revision") == job_data.get("revision"):
+            idle_seconds += EVENT_POLL_INTERVAL_SECONDS
+            if idle_seconds >= SSE_KEEPALIVE_SECONDS:
+                idle_seconds = 0.0
+                yield ": keep-alive\n\n"
+            continue
+
+        idle_seconds = 0.0
+        for page in await get_pages(r, job_id):
+            if sent_versions.get(page["page_number"], 0) < page.get("version", 1):
+                sent_versions[page["page_number"]] = page.get("version", 1)
+                yield format_sse("page", page)
+        changed = {
+            field: value for field, value in latest.items()
+            if field not in ("user_id", "revision") and job_data.get(field) != value
+        }
+        job_data = latest
+        if changed:
+            yield format_sse("status", changed)
+        if latest.get("status") in TERMINAL_STATUSES:
+            return
+
+@router.get("/{job_id}/events")
+async def stream_job_events(
+    job_id: str,
+    current_user: User = Depends(get_current_active_user),
+    r: redis.Redis = Depends(get_redis_client)
+):
+    """
+    Streams a job's progress as Server-Sent Events.
+
+    The first `status` event carries the full status record; later ones carry only the
+    fields that changed (status, progress). A `page` event with each page's markdown is
+    sent as soon as the page is stored, starting with pages finished before the client
+    connected. In fast first view mode a page is sent twice: first unrefined
+    (`refined: false`), then again with a higher `version` once refined. A `cancel`
+    event is sent when cancellation is requested. The stream ends once the job
+    completes, fails or is cancelled.
+
+    Over Upstash's REST API, which can't subscribe, the job is polled every
+    EVENT_POLL_INTERVAL_SECONDS instead and no `cancel` events are sent.
+    """
+    data_job_id, user_job_data = await load_user_job(r, job_id, current_user)
+
+    async def event_stream():
+        if user_job_data.get("owner_cancelled") == "1" and user_job_data.get("status") == "cancelled":
+            # Cancelled by this user, but still running for uploads attached to it
+            yield format_sse("status", {"status": "cancelled", "file_name": user_job_data.get("file_name")})
+            return
+        # REST clients (Upstash) can't subscribe; the job is followed by polling instead
+        pubsub = r.pubsub() if hasattr(r, "pubsub") else None
+        if pubsub is not None:
+            await pubsub.subscribe(events_channel(data_job_id))
+        try:
+            # Snapshot after subscribing so nothing published in between is lost
+            job_data = await get_job(r, data_job_id)
+            if not job_data:
+                yield format_sse("status", {"status": "error", "detail": "Processing job not found or expired."})
+                return
+            job_data.pop("user_id", None)
+            yield format_sse("status", job_data)
+
+            # Latest version sent per page, so refined replacements go out but stale events don't
+            sent_versions = {}
+            for page in await get_pages(r, data_job_id):
+                sent_versions[page["page_number"]] = page.get("version", 1)
+                yield format_sse("page", page)
+
+            if job_data.get("status") in TERMINAL_STATUSES:
+                return
+
+            if pubsub is None:
+                async for message in poll_job_events(r, data_job_id, job_data, sent_versions):
+                    yield message
+                return
+
+            while True:
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=SSE_KEEPALIVE_SECONDS)
+                if message is None:
+                    # SSE comment line keeps proxies from closing an idle connection
+                    yield ": keep-alive\n\n"
+                    continue
+
+                job_event = json_codec.loads(message["data"])
+                event, data = job_event.get("event"), job_event.get("data", {})
+                if event == "page":
+                    page_number, version = data.get("page_number"), data.get("version", 1)
+                    if sent_versions.get(page_number, 0) >= version:
+                        continue
+                    sent_versions[page_number] = version
+                yield format_sse(event, data)
+
+                if event == "status" and data.get("status") in TERMINAL_STATUSES:
+                    return
+        finally:
+            if pubsub is not None:
+                await pubsub.unsubscribe()
+                await pubsub.aclose()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # Define a model for the text rephrasing request
 class RephraseRequest(BaseModel):
     text_content: str
     mode: str = "summarize"  # Options: summarize, eli5, remove_jargon
     document_type: str = "academic paper"
 
+# Upper bound of items in one /rephrase/batch request
+MAX_REPHRASE_BATCH_ITEMS = 20
+
+class RephraseBatchRequest(BaseModel):
+    items: list[RephraseRequest]
+
+REPHRASE_FUNCTIONS = {
+    "summarize": summarize_text,
+    "eli5": explain_like_im_five,
+    "remove_jargon": remove_jargon,
+}
+
 @router.post("/rephrase", status_code=status.HTTP_200_OK)
 async def rephrase_text(
     rephrase_request: RephraseRequest,
-    current_user: User = Depends(get_current_active_user)
+    current_user: User = Depends(get_current_active_user),
+    r: redis.Redis = Depends(get_redis_client)
 ):
     """
     Rephrase selected text content using different modes.
@@ -569,23 +686,22 @@ async def rephrase_text(
                 detail="Text content cannot be empty"
             )
             
-        rephrased_text = ""
-        
-        # Apply the appropriate rephrasing function based on mode
-        if rephrase_request.mode == "summarize":
-            rephrased_text = await summarize_text(rephrase_request.text_content, context=rephrase_request.document_type)
-        elif rephrase_request.mode == "eli5":
-            rephrased_text = await explain_like_im_five(rephrase_request.text_content, context=rephrase_request.document_type)
-        elif rephrase_request.mode == "remove_jargon":
-            rephrased_text = await remove_jargon(rephrase_request.text_content, context=rephrase_request.document_type)
-        else:
+        rephrase = REPHRASE_FUNCTIONS.get(rephrase_request.mode)
+        if rephrase is None:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail=f"Invalid rephrasing mode: {rephrase_request.mode}. Supported modes: summarize, eli5, remove_jargon"
             )
+
+        # Identical selections share cached results and in-flight Gemini calls
+        rephrased_text = await cached_rephrase(
+            r, rephrase_request.mode, rephrase_request.text_content, rephrase_request.document_type, rephrase
+        )
             
         return {"rephrased_text": rephrased_text}
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error rephrasing text: {str(e)}")
         raise HTTPException(
@@ -593,59 +709,109 @@ async def rephrase_text(
             detail=f"Error rephrasing text: {str(e)}"
         )
 
-# Add a function to preprocess base64 data
-def preprocess_base64(base64_str: str) -> str:
-    """Clean and validate base64 data"""
-    if not base64_str:
-        return ""
-        
-    # Remove line breaks, spaces, and other whitespace
-    cleaned = re.sub(r'\s+', '', base64_str)
-    
-    # Remove data URI prefix if present
-    if "base64," in cleaned:
-        cleaned = cleaned.split("base64,")[1]
-        
-    # Validate if the string is proper base64
-    try:
-        # Try decoding a small part to validate
-        base64.b64decode(cleaned[:20] + '=' * (4 - len(cleaned[:20]) % 4))
-        return cleaned
-    except Exception as e:
-        logger.warning(f"Invalid base64 data: {e}")
-        return ""
-
-# Helper function to determine mime type based on base64 data
-def determine_mime_type(base64_str: str) -> str:
-    """Determine the MIME type based on the base64 string pattern."""
-    if not base64_str:
-        return "image/jpeg"  # Default
+@router.post("/rephrase/stream")
+async def stream_rephrase_text(
+    rephrase_request: RephraseRequest,
+    current_user: User = Depends(get_current_active_user),
+    r: redis.Redis = Depends(get_redis_client)
+):
+    """
+    Streaming variant of /rephrase that sends the text as Server-Sent Events while Gemini
+    produces it: `chunk` events carry {"text": ...} fragments to append, followed by a
+    final `done` event, or an `error` event if rephrasing fails midway.
+    """
+    if not rephrase_request.text_content or len(rephrase_request.text_content.strip()) == 0:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Text content cannot be empty"
+        )
+    if rephrase_request.mode not in REPHRASE_FUNCTIONS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid rephrasing mode: {rephrase_request.mode}. Supported modes: summarize, eli5, remove_jargon"
+        )
+    logger.info(f"Streaming rephrased text in mode: {rephrase_request.mode}")
+
+    started = time.monotonic()
+    cache_key = rephrase_cache_key(rephrase_request.mode, rephrase_request.document_type, rephrase_request.text_content)
+
+    async def event_stream():
+        cached_text = await load_cached_rephrase(r, cache_key)
+        if cached_text is not None:
+            metrics.increment("rephrase_cache_hits")
+            metrics.observe("rephrase_stream_ttfb_seconds", time.monotonic() - started)
+            yield format_sse("chunk", {"text": cached_text})
+            yield format_sse("done", {})
+            return
+        metrics.increment("rephrase_cache_misses")
+
+        rephrased_parts = []
+        try:
+            async for chunk in stream_rephrase(
+                rephrase_request.text_content, rephrase_request.mode, context=rephrase_request.document_type
+            ):
+                if not rephrased_parts:
+                    metrics.observe("rephrase_stream_ttfb_seconds", time.monotonic() - started)
+                rephrased_parts.append(chunk)
+                yield format_sse("chunk", {"text": chunk})
+        except Exception as e:
+            logger.error(f"Error streaming rephrased text: {str(e)}")
+            yield format_sse("error", {"detail": "Error rephrasing text. Please try again."})
+            return
+
+        await save_rephrase(r, cache_key, rephrase_request.text_content, "".join(rephrased_parts))
+        yield format_sse("done", {})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.post("/rephrase/batch")
+async def rephrase_text_batch(
+    batch_request: RephraseBatchRequest,
+    current_user: User = Depends(get_current_active_user),
+    r: redis.Redis = Depends(get_redis_client)
+):
+    """
+    Rephrase several selections and/or modes in one request.
 
-    # Remove any whitespace that might be present
-    base64_str = base64_str.strip()
-    
-    # First few characters of the base64 can indicate the format
-    # JPEG signature starts with /9j/
-    if base64_str.startswith('/9j/'):
-        return "image/jpeg"
-    # PNG signature starts with iVBOR
-    elif base64_str.startswith('iVBOR'):
-        return "image/png"
-    # GIF signature starts with R0lGOD
-    elif base64_str.startswith('R0lGOD'):
-        return "image/gif"
-    # BMP signature starts with Qk0
-    elif base64_str.startswith('Qk0'):
-        return "image/bmp"
-    # PDF (sometimes embedded)
-    elif base64_str.startswith('JVBERi0'):
-        return "application/pdf"
-    # SVG possibly
-    elif base64_str.startswith('UEs') or base64_str.startswith('PHN2'):
-        return "image/svg+xml"
-    # WebP
-    elif base64_str.startswith('UklGR'):
-        return "image/webp"
-
-    # Default to JPEG if unknown
-    return "image/jpeg"
\ No newline at end of file
+    Results are sent as Server-Sent Events as they complete, in any order: one `result`
+    event per item with its index in the request and either `rephrased_text` or `error`,
+    followed by a final `done` event. Identical items are only rephrased once.
+    """
+    items = batch_request.items
+    if not items:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="At least one item is required"
+        )
+    if len(items) > MAX_REPHRASE_BATCH_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {MAX_REPHRASE_BATCH_ITEMS} items can be rephrased per request"
+        )
+    for index, item in enumerate(items):
+        if not item.text_content or len(item.text_content.strip()) == 0:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Text content of item {index} cannot be empty"
+            )
+        if item.mode not in REPHRASE_FUNCTIONS:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Invalid rephrasing mode for item {index}: {item.mode}. Supported modes: summarize, eli5, remove_jargon"
+            )
+    logger.info(f"Rephrasing batch of {len(items)} items")
+
+    async def event_stream():
+        async for result in run_rephrase_batch(r, [item.model_dump() for item in items], REPHRASE_FUNCTIONS):
+            yield format_sse("result", result)
+        yield format_sse("done", {})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -43,6 +43,8 @@ class Settings(BaseSettings):
     REDIS_PORT: int = int(os.getenv("REDIS_PORT", "6379"))
     REDIS_DB: int = int(os.getenv("REDIS_DB", "0"))
     REDIS_PASSWORD: str = os.getenv("REDIS_PASSWORD", "")
+    # Connect over TLS (e.g. to Upstash's Redis endpoint)
+    REDIS_SSL: bool = os.getenv("REDIS_SSL", "false").lower() == "true"
 
     # Upstash Redis config (for production)
     UPSTASH_REDIS_URL: str | None = os.getenv("UPSTASH_REDIS_URL", None)
@@ -52,6 +54,80 @@ class Settings(BaseSettings):
 
     # Application Settings
     PROCESSING_RESULT_EXPIRATION_SECONDS: int = int(os.getenv("PROCESSING_RESULT_EXPIRATION_SECONDS", str(3600 * 24)))
+    # Maximum number of pages refined concurrently within a single job
+    PAGE_REFINEMENT_CONCURRENCY: int = int(os.getenv("PAGE_REFINEMENT_CONCURRENCY", "8"))
+    # Maximum number of concurrent calls this process makes to the Mistral OCR API
+    OCR_MAX_CONCURRENCY: int = int(os.getenv("OCR_MAX_CONCURRENCY", "4"))
+    # PDFs are OCR'd as page-range chunks of this many pages (0 disables splitting)
+    OCR_CHUNK_PAGES: int = int(os.getenv("OCR_CHUNK_PAGES", "20"))
+    # Maximum number of chunks of one document OCR'd at once
+    OCR_CHUNK_CONCURRENCY: int = int(os.getenv("OCR_CHUNK_CONCURRENCY", "4"))
+    # Largest accepted upload, in bytes
+    MAX_UPLOAD_BYTES: int = int(os.getenv("MAX_UPLOAD_BYTES", str(100 * 1024 * 1024)))
+    # Use the embedded text layer of born-digital pages instead of OCR when it passes quality checks.
+    # Off by default: text-layer markdown has no headings, so opt in for mostly plain-prose documents
+    TEXT_LAYER_FAST_PATH: bool = os.getenv("TEXT_LAYER_FAST_PATH", "false").lower() == "true"
+    # Pages with less extracted text than this are treated as scanned and sent to OCR
+    TEXT_LAYER_MIN_CHARS: int = int(os.getenv("TEXT_LAYER_MIN_CHARS", "200"))
+    # Cache Gemini page refinements keyed by page content, context, model and prompt version
+    REFINEMENT_CACHE_ENABLED: bool = os.getenv("REFINEMENT_CACHE_ENABLED", "true").lower() == "true"
+    # How long cached refinements are kept in Redis (default: 30 days)
+    REFINEMENT_CACHE_TTL_SECONDS: int = int(os.getenv("REFINEMENT_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+    # Size limit of the in-process refinement cache tier
+    REFINEMENT_CACHE_LOCAL_MAX_BYTES: int = int(os.getenv("REFINEMENT_CACHE_LOCAL_MAX_BYTES", str(32 * 1024 * 1024)))
+    # How long /process/rephrase results are cached in Redis (default: 7 days)
+    REPHRASE_CACHE_TTL_SECONDS: int = int(os.getenv("REPHRASE_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+    # Connections kept open by the shared Gemini client
+    LLM_MAX_CONNECTIONS: int = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+    # Seconds an idle Gemini connection is kept alive for reuse
+    LLM_KEEPALIVE_EXPIRY_SECONDS: float = float(os.getenv("LLM_KEEPALIVE_EXPIRY_SECONDS", "60"))
+    # Gemini quota shared by all processes through Redis (0 disables the shared bucket)
+    LLM_REQUESTS_PER_MINUTE: int = int(os.getenv("LLM_REQUESTS_PER_MINUTE", "1000"))
+    LLM_TOKENS_PER_MINUTE: int = int(os.getenv("LLM_TOKENS_PER_MINUTE", "1000000"))
+    # Bounds and starting point of the adaptive per-process limit on in-flight Gemini calls
+    LLM_INITIAL_CONCURRENCY: int = int(os.getenv("LLM_INITIAL_CONCURRENCY", "8"))
+    LLM_MIN_CONCURRENCY: int = int(os.getenv("LLM_MIN_CONCURRENCY", "1"))
+    LLM_MAX_CONCURRENCY: int = int(os.getenv("LLM_MAX_CONCURRENCY", "20"))
+    # Gemini responses slower than this shrink the concurrency limit
+    LLM_LATENCY_TARGET_SECONDS: float = float(os.getenv("LLM_LATENCY_TARGET_SECONDS", "30"))
+    # Retries of rate-limited or failed Gemini calls, with jittered exponential backoff
+    LLM_MAX_RETRIES: int = int(os.getenv("LLM_MAX_RETRIES", "4"))
+    LLM_RETRY_BASE_DELAY_SECONDS: float = float(os.getenv("LLM_RETRY_BASE_DELAY_SECONDS", "1"))
+    LLM_RETRY_MAX_DELAY_SECONDS: float = float(os.getenv("LLM_RETRY_MAX_DELAY_SECONDS", "30"))
+    # OCR quality score (share of suspicious words, 0-1) from which pages are refined with Gemini; 0 refines every page
+    OCR_REFINEMENT_THRESHOLD: float = float(os.getenv("OCR_REFINEMENT_THRESHOLD", "0.02"))
+    # Pages estimated above this many tokens are refined in chunks to stay within the 8192 token output limit
+    REFINE_CHUNK_MAX_TOKENS: int = int(os.getenv("REFINE_CHUNK_MAX_TOKENS", "4000"))
+    # Pages refined at once per process in "fast first view" mode, where raw pages are already readable
+    BACKGROUND_REFINEMENT_CONCURRENCY: int = int(os.getenv("BACKGROUND_REFINEMENT_CONCURRENCY", "4"))
+    # Jobs a single user may have running at once; the rest wait in the fair queue
+    SCHEDULER_USER_MAX_CONCURRENCY: int = int(os.getenv("SCHEDULER_USER_MAX_CONCURRENCY", "2"))
+    # How much faster interactive uploads advance than bulk ones in the fair queue
+    SCHEDULER_INTERACTIVE_WEIGHT: int = int(os.getenv("SCHEDULER_INTERACTIVE_WEIGHT", "4"))
+    # Uploads from a user with this many jobs already waiting are queued as bulk
+    SCHEDULER_BULK_THRESHOLD: int = int(os.getenv("SCHEDULER_BULK_THRESHOLD", "2"))
+    # Undelivered jobs kept on the worker stream; more would lock in dispatch order early
+    SCHEDULER_DISPATCH_AHEAD: int = int(os.getenv("SCHEDULER_DISPATCH_AHEAD", "1"))
+    # Initial processing time per page used for queue ETAs until real timings are recorded
+    SCHEDULER_SECONDS_PER_PAGE: float = float(os.getenv("SCHEDULER_SECONDS_PER_PAGE", "5"))
+    # Codec stored pages are compressed with: gzip, zstd (needs the zstandard package) or none
+    RESULT_COMPRESSION: str = os.getenv("RESULT_COMPRESSION", "gzip")
+    # Compression level for stored pages (gzip caps it at 9)
+    RESULT_COMPRESSION_LEVEL: int = int(os.getenv("RESULT_COMPRESSION_LEVEL", "6"))
+    # Seconds clients are asked (via Retry-After) to wait between polls of a queued or running job
+    JOB_POLL_RETRY_AFTER_SECONDS: int = int(os.getenv("JOB_POLL_RETRY_AFTER_SECONDS", "2"))
+    # Seconds between additions of each process's counters to the shared metrics in Redis
+    METRICS_FLUSH_INTERVAL_SECONDS: float = float(os.getenv("METRICS_FLUSH_INTERVAL_SECONDS", "10"))
+    # Directory uploaded PDFs are spooled to until a worker picks them up (shared by API and workers)
+    UPLOAD_SPOOL_DIR: str = os.getenv("UPLOAD_SPOOL_DIR", "uploads")
+    # Number of jobs each worker process runs at once
+    WORKER_CONCURRENCY: int = int(os.getenv("WORKER_CONCURRENCY", "2"))
+    # A job whose worker hasn't heartbeated for this long is redelivered to another worker
+    JOB_VISIBILITY_TIMEOUT_SECONDS: int = int(os.getenv("JOB_VISIBILITY_TIMEOUT_SECONDS", "300"))
+    # Jobs delivered more than this many times are marked as failed instead of retried again
+    JOB_MAX_DELIVERIES: int = int(os.getenv("JOB_MAX_DELIVERIES", "3"))
+    # Directory completed results are cached in, keyed by document fingerprint
+    RESULT_CACHE_DIR: str = os.getenv("RESULT_CACHE_DIR", "result_cache")
     ENVIRONMENT: str = os.getenv("ENVIRONMENT", "development")
     DEBUG: bool = ENVIRONMENT == "development"
 
@@ -0,0 +1,25 @@
+"""
+JSON encoding for job payloads in Redis (status events, pages, queued jobs), the
+on-disk result cache and API responses.
+
+Backed by orjson, which encodes and decodes several times faster than the json module.
+Output is compact UTF-8 with non-ASCII characters left unescaped; orjson's decode
+errors subclass json.JSONDecodeError, so existing error handling keeps working.
+"""
+from typing import Any
+
+import orjson
+
+
+def dumps(obj: Any) -> str:
+    """Encode to a JSON string (for Redis, whose clients here take strings)."""
+    return orjson.dumps(obj).decode("utf-8")
+
+
+def dumps_bytes(obj: Any) -> bytes:
+    """Encode to UTF-8 JSON bytes (for files and response bodies)."""
+    return orjson.dumps(obj)
+
+
+def loads(data: str | bytes) -> Any:
+    return orjson.loads(data)
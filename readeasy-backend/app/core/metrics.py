@@ -0,0 +1,83 @@
+"""
+Counters and gauges for cache and upstream call metrics.
+
+Counters are collected in process and periodically added to a Redis hash (see flush),
+so GET /api/metrics reports totals across every API and worker process, including
+work that only happens in workers such as page refinement and resumed jobs. Gauges and
+maxima only make sense per process and are reported for the answering process only.
+"""
+import asyncio
+import logging
+import threading
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+# Hash of counter name -> total across all processes
+METRICS_KEY = "metrics:counters"
+
+_lock = threading.Lock()
+_counters: dict[str, float] = defaultdict(float)
+# Counter increments not yet added to METRICS_KEY
+_pending: dict[str, float] = defaultdict(float)
+
+
+def increment(name: str, amount: float = 1) -> None:
+    """Add amount to the counter called name."""
+    with _lock:
+        _counters[name] += amount
+        _pending[name] += amount
+
+
+def set_gauge(name: str, value: float) -> None:
+    """Set the current value of name (e.g. a concurrency limit)."""
+    with _lock:
+        _counters[name] = value
+
+
+def observe(name: str, value: float) -> None:
+    """Record a measurement (e.g. a latency) as {name}_count, {name}_sum and {name}_max."""
+    with _lock:
+        for counter, amount in ((f"{name}_count", 1), (f"{name}_sum", value)):
+            _counters[counter] += amount
+            _pending[counter] += amount
+        _counters[f"{name}_max"] = max(_counters[f"{name}_max"], value)
+
+
+def snapshot() -> dict[str, float]:
+    """Current value of every counter and gauge of this process, sorted by name."""
+    with _lock:
+        return dict(sorted(_counters.items()))
+
+
+async def flush(r) -> None:
+    """Add this process's counter increments since the last flush to the shared totals in Redis."""
+    with _lock:
+        pending = list(_pending.items())
+        _pending.clear()
+    for position, (name, amount) in enumerate(pending):
+        try:
+            await r.hincrbyfloat(METRICS_KEY, name, amount)
+        except Exception as e:
+            # Keep what wasn't added for the next flush
+            logger.warning(f"Could not flush metrics: {e}")
+            with _lock:
+                for unflushed_name, unflushed_amount in pending[position:]:
+                    _pending[unflushed_name] += unflushed_amount
+            return
+
+
+async def flush_periodically(r, interval_seconds: float) -> None:
+    """Flush every interval_seconds until cancelled, then once more."""
+    try:
+        while True:
+            await asyncio.sleep(interval_seconds)
+            await flush(r)
+    finally:
+        await flush(r)
+
+
+async def shared_snapshot(r) -> dict[str, float]:
+    """Counter totals of all processes as last flushed to Redis, sorted by name."""
+    totals = await r.hgetall(METRICS_KEY)
+    return {name: float(totals[name]) for name in sorted(totals)}
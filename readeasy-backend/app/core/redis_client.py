@@ -7,13 +7,19 @@ from typing import Union, Optional, Any, Dict, Callable, List
 logger = logging.getLogger(__name__)
 
 class UpstashRedisWrapper:
-    """Wrapper to make Upstash Redis API compatible with asyncio Redis."""
+    """
+    Wrapper to make Upstash Redis API compatible with asyncio Redis.
+
+    Only the commands the API needs are available over REST. Stream consumer groups and
+    pub/sub subscriptions are not, so OCR workers need a native Redis connection (see
+    worker.py), and event streams fall back to polling.
+    """
     
     def __init__(self, client):
         self.client = client
         
-    async def set(self, key, value, ex=None):
-        return self.client.set(key, value, ex=ex)
+    async def set(self, key, value, ex=None, px=None, nx=False):
+        return self.client.set(key, value, ex=ex, px=px, nx=nx)
         
     async def get(self, key):
         return self.client.get(key)
@@ -49,7 +55,26 @@ class UpstashRedisWrapper:
         
     async def hdel(self, name, *keys):
         return self.client.hdel(name, *keys)
+
+    async def hincrby(self, name, key, amount=1):
+        return self.client.hincrby(name, key, amount)
+
+    async def hincrbyfloat(self, name, key, amount=1.0):
+        return self.client.hincrbyfloat(name, key, amount)
+
+    async def zrank(self, name, value):
+        return self.client.zrank(name, value)
+
+    async def zrange(self, name, start, end):
+        return self.client.zrange(name, start, end)
     
+    async def eval(self, script, numkeys, *keys_and_args):
+        return self.client.eval(script, list(keys_and_args[:numkeys]), list(keys_and_args[numkeys:]))
+
+    async def publish(self, channel, message):
+        # Publishing works over REST; subscribing (used by event streams) needs a native Redis connection
+        return self.client.publish(channel, message)
+
     async def keys(self, pattern):
         return self.client.keys(pattern)
         
@@ -88,6 +113,7 @@ if settings.USE_UPSTASH and settings.UPSTASH_REDIS_URL and settings.UPSTASH_REDI
             port=settings.REDIS_PORT,
             db=settings.REDIS_DB,
             password=settings.REDIS_PASSWORD,
+            ssl=settings.REDIS_SSL,
             decode_responses=True
         )
 else:
@@ -97,6 +123,7 @@ else:
         port=settings.REDIS_PORT,
         db=settings.REDIS_DB,
         password=settings.REDIS_PASSWORD,
+        ssl=settings.REDIS_SSL,
         decode_responses=True
     )
     logger.info(f"Initialized standard Redis client ({settings.REDIS_HOST}:{settings.REDIS_PORT})")
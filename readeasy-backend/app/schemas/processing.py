@@ -5,6 +5,10 @@ class ProcessedPage(BaseModel):
     # original_text: str # Removed
     # simplified_text: str # Removed
     markdown_content: str # Added
+    # False while the page still shows raw OCR output in "fast first view" mode
+    refined: bool = True
+    # Bumped whenever a stored page is replaced (e.g. by its refined version)
+    version: int = 1
     # images: list[str] = [] # Removed, images are embedded in markdown
 
 class ProcessingResult(BaseModel):
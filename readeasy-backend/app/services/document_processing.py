@@ -0,0 +1,709 @@
+"""
+OCR document processing pipeline: image extraction, table repair and page refinement.
+
+This module is shared by the API (to record job state) and by the out-of-process
+OCR workers in worker.py, which run run_mistral_ocr_processing for queued jobs.
+"""
+import re  # Global import for regular expressions
+import logging
+import base64
+import asyncio
+import contextlib
+from pathlib import Path
+from typing import Awaitable, Callable
+import redis.asyncio as redis
+
+from app.services.text_refiner import refine_markdown
+from app.services.image_storage import ImageStorageService
+from app.services.ocr_quality import needs_refinement
+from app.services.pdf import count_pdf_pages, chunk_page_indices, extract_pdf_pages, extract_text_layer_pages
+from app.services.ocr_client import MistralOCRClient, ocr_client
+from app.services.result_cache import save_cached_result, release_fingerprint
+from app.services.job_store import (
+    update_job,
+    save_page,
+    get_pages,
+    delete_pages,
+    wait_for_cancellation,
+    save_page_checkpoints,
+    load_page_checkpoints,
+    delete_page_checkpoints,
+)
+from app.core.config import settings
+from app.core import metrics
+
+# Import Mistral specific parts
+from mistralai.models import OCRPageObject
+
+# Set up logger for this module
+logger = logging.getLogger(__name__)
+
+# Bump whenever a pipeline change alters the output; cached results of older versions are then ignored
+PIPELINE_VERSION = "3"
+
+# Initialize image storage service
+image_service = ImageStorageService(storage_dir="static/temp_images")
+
+# Base URL for constructing image URLs, should be configured if not localhost
+BACKEND_BASE_URL = settings.BACKEND_URL or "http://localhost:8001"
+IMAGE_API_ENDPOINT_PREFIX = "/api/v1/images" # Path to your image serving endpoint
+# Finds the saved image filenames referenced by prepared markdown
+SAVED_IMAGE_PATTERN = re.compile(re.escape(IMAGE_API_ENDPOINT_PREFIX) + r"/([^)\s]+)\)")
+
+# --- Helper function from user script (adapted) ---
+# This function seems redundant now given the new replace_images_in_markdown logic.
+# Consider removing if it's not used elsewhere or has a different specific purpose.
+# def normalize_image_references(markdown_str: str) -> str:
+#     ...
+
+def replace_images_in_markdown(markdown_content: str, ocr_images_data: list[dict], page_index: int,
+                               saved_images: list[str] | None = None) -> str:
+    """
+    Replaces image references in markdown with backend URLs pointing to uniquely named, saved image files.
+    Saved filenames are appended to saved_images if given, so they can be removed if the job is cancelled.
+    """
+    if not markdown_content:
+        return ""
+
+    # This map will store {original_mistral_id: unique_backend_filename}
+    image_id_to_unique_filename = {}
+
+    # 1. Save all images from OCR data for this page and create the mapping
+    for img_data in ocr_images_data:
+        original_mistral_id = img_data.get("id")
+        base64_str = img_data.get("image_base64")
+
+        if not original_mistral_id or not base64_str:
+            logger.warning(f"Page {page_index + 1}: Skipping image due to missing id or base64 data. ID: {original_mistral_id}")
+            continue
+
+        processed_base64 = preprocess_base64(base64_str)
+        if not processed_base64:
+            logger.warning(f"Page {page_index + 1}: Invalid base64 for image {original_mistral_id}. Skipping.")
+            continue
+
+        mime_type = determine_mime_type(processed_base64) 
+        name_hint = original_mistral_id.split('.')[0] # e.g., "img-0"
+        
+        # Save image using the service, which now returns a unique filename
+        unique_filename = image_service.save_image(
+            processed_base64,
+            mime_type=mime_type,
+            name_hint=name_hint
+        )
+
+        if unique_filename:
+            image_id_to_unique_filename[original_mistral_id] = unique_filename
+            if saved_images is not None:
+                saved_images.append(unique_filename)
+            logger.info(f"Page {page_index + 1}: Saved image {original_mistral_id} as {unique_filename}")
+        else:
+            logger.error(f"Page {page_index + 1}: Failed to save image {original_mistral_id}.")
+
+    # 2. Replace image references in markdown
+    # Regex to find markdown image tags: ![alt text](image_id_from_mistral)
+    # It should correctly handle cases where image_id_from_mistral might have an extension.
+    pattern = re.compile(r"(!\[(.*?)\]\((.*?\.(?:jpeg|jpg|png|gif))\))") # Matches ![alt](id.ext)
+
+    def replace_match(match):
+        full_tag, alt_text, original_img_ref = match.groups()
+        
+        # original_img_ref is like "img-0.jpeg"
+        unique_filename = image_id_to_unique_filename.get(original_img_ref)
+        
+        if unique_filename:
+            # Construct the full URL to the backend image endpoint
+            backend_image_url = f"{BACKEND_BASE_URL}{IMAGE_API_ENDPOINT_PREFIX}/{unique_filename}"
+            new_tag = f"![{alt_text}]({backend_image_url})"
+            logger.debug(f"Page {page_index + 1}: Replaced '{original_img_ref}' with '{backend_image_url}'")
+            return new_tag
+        else:
+            # If the image wasn't in ocr_images_data or failed to save, keep original or use placeholder
+            logger.warning(f"Page {page_index + 1}: Image ref '{original_img_ref}' not found in saved images. Original tag kept.")
+            # Optionally, replace with a specific placeholder for missing backend images
+            # return f"![{alt_text}](http://image-placeholder.internal/image_not_found_on_backend.jpg)"
+            return full_tag # Keep original if not found
+
+    processed_markdown = pattern.sub(replace_match, markdown_content)
+    
+    # After replacements, call table fixing
+    processed_markdown = fix_markdown_tables(processed_markdown)
+    
+    logger.info(f"Page {page_index + 1}: Markdown processing complete. Images mapped: {len(image_id_to_unique_filename)}")
+    return processed_markdown
+
+def fix_markdown_tables(markdown_str: str) -> str:
+    """
+    Enhanced function to robustly fix and format markdown tables.
+    
+    This function:
+    1. Properly detects table boundaries in markdown text
+    2. Normalizes table structure with consistent column counts
+    3. Handles header rows and separator rows correctly
+    4. Ensures proper formatting and alignment of all cells
+    5. Adds visual spacing around tables for better readability
+    """
+    if not markdown_str:
+        return ""
+
+    lines = markdown_str.split('\n')
+    result_lines = []
+    i = 0
+    
+    while i < len(lines):
+        line = lines[i].strip()
+
+        # Detect potential table start (line with multiple pipe characters that looks like a table row)
+        if line.count('|') >= 2 and line.strip().startswith('|') and line.strip().endswith('|'):
+            # Found potential table start, collect all table lines
+            table_lines = [line]
+            table_start_idx = i
+            i += 1
+            
+            # Collect all subsequent lines that look like table rows
+            while i < len(lines) and lines[i].strip().count('|') >= 2 and lines[i].strip().startswith('|') and lines[i].strip().endswith('|'):
+                table_lines.append(lines[i].strip())
+                i += 1
+            
+            # Only process as table if we have at least 2 rows (header + data)
+            if len(table_lines) >= 2:
+                # Process and fix the table
+                fixed_table = process_table(table_lines)
+                
+                # Add a blank line before the table if there isn't one already
+                if result_lines and result_lines[-1].strip():
+                    result_lines.append('')
+                
+                # Add the fixed table
+                result_lines.extend(fixed_table)
+                
+                # Add a blank line after the table
+                result_lines.append('')
+            else:
+                # Not a valid table, preserve original lines
+                result_lines.extend(lines[table_start_idx:i])
+        else:
+            # Not a table line, keep as is
+            result_lines.append(line)
+            i += 1
+    
+    return '\n'.join(result_lines)
+
+def process_table(table_lines: list) -> list:
+    """Process and fix a markdown table section."""
+    
+    # Clean up each line
+    cleaned_lines = []
+    for line in table_lines:
+        # Remove problematic tokens and normalize
+        cleaned = line.strip()
+        cleaned = cleaned.replace('[UNK]:', '').replace('[PAD]', '').replace('<unk>', '').replace('<pad>', '')
+        cleaned = re.sub(r'→\s*T\s*→', '→', cleaned)  # Fix arrow symbols
+        
+        # Normalize spacing around pipes for consistent cell detection
+        # First, ensure the line has leading and trailing pipes
+        if not cleaned.startswith('|'):
+            cleaned = '| ' + cleaned
+        if not cleaned.endswith('|'):
+            cleaned = cleaned + ' |'
+            
+        # Then normalize internal spacing
+        cleaned = re.sub(r'\|\s*', '| ', cleaned)
+        cleaned = re.sub(r'\s*\|', ' |', cleaned)
+        
+        # Skip completely empty rows
+        if re.match(r'^\s*\|(\s*\|)+\s*$', cleaned):
+            continue
+
+        cleaned_lines.append(cleaned)
+    
+    if not cleaned_lines:
+        return []  # No valid lines found
+    
+    # Analyze the first row to determine number of columns
+    header_cells = extract_cells(cleaned_lines[0])
+    num_cols = max(len(header_cells), 1)  # Ensure at least one column
+    
+    # Check if second row is a separator row
+    has_separator = False
+    if len(cleaned_lines) > 1:
+        second_row_cells = extract_cells(cleaned_lines[1])
+        has_separator = all(
+            cell.strip().replace('-', '').replace(':', '') == '' 
+            for cell in second_row_cells
+        )
+
+    # Rebuild the table with proper structure
+    fixed_table = []
+    
+    # 1. Properly format header row
+    header_cells = pad_or_truncate_cells(header_cells, num_cols)
+    fixed_table.append(format_row(header_cells))
+
+    # 2. Always include a proper separator row with alignment
+    alignments = determine_alignments(cleaned_lines[1] if has_separator and len(cleaned_lines) > 1 else None, num_cols)
+    separator_row = format_separator_row(alignments)
+    fixed_table.append(separator_row)
+    
+    # 3. Process data rows (skip header and separator if present)
+    start_idx = 1
+    if has_separator:
+        start_idx = 2
+        
+    for i in range(start_idx, len(cleaned_lines)):
+        row_cells = extract_cells(cleaned_lines[i])
+        row_cells = pad_or_truncate_cells(row_cells, num_cols)
+        row_cells = process_cell_content(row_cells)
+        fixed_table.append(format_row(row_cells))
+    
+    return fixed_table
+
+def extract_cells(row: str) -> list:
+    """Extract cell content from a table row."""
+    # Split by pipe and remove empty first/last elements
+    parts = row.split('|')
+    return [part.strip() for part in parts[1:-1]]  # Skip first and last (empty due to leading/trailing pipes)
+
+def pad_or_truncate_cells(cells: list, target_length: int) -> list:
+    """Ensure the cells list has exactly the target length."""
+    if len(cells) < target_length:
+        return cells + [''] * (target_length - len(cells))
+    return cells[:target_length]  # Truncate if too many
+
+def process_cell_content(cells: list) -> list:
+    """Process the content of each cell for better formatting."""
+    processed = []
+    for cell in cells:
+        # Convert bullet points for better readability
+        if cell.strip().startswith('-'):
+            cell = '• ' + cell.strip()[1:].strip()
+        processed.append(cell)
+    return processed
+
+def determine_alignments(separator_row: str, num_cols: int) -> list:
+    """Determine column alignments from separator row."""
+    alignments = ['left'] * num_cols  # Default all to left alignment
+    
+    if separator_row:
+        separator_cells = extract_cells(separator_row)
+        for i, cell in enumerate(separator_cells):
+            if i >= num_cols:
+                break
+
+            cell = cell.strip()
+            if cell.startswith(':') and cell.endswith(':'):
+                alignments[i] = 'center'
+            elif cell.endswith(':'):
+                alignments[i] = 'right'
+    
+    return alignments
+
+def format_separator_row(alignments: list) -> str:
+    """Format the separator row with proper alignment indicators."""
+    separators = []
+    for align in alignments:
+        if align == 'center':
+            separators.append(':---:')
+        elif align == 'right':
+            separators.append('---:')
+        else:  # left alignment
+            separators.append('---')
+    
+    return '| ' + ' | '.join(separators) + ' |'
+
+def format_row(cells: list) -> str:
+    """Format a row with proper cell spacing."""
+    return '| ' + ' | '.join(cells) + ' |'
+
+def prepare_page_markdown(page: OCRPageObject, saved_images: list[str] | None = None) -> str:
+    """Gets markdown with embedded images and fixed tables for a single page object, without LLM refinement."""
+    if not page or not hasattr(page, 'markdown'): # Added check for markdown attribute
+        logger.warning(f"OCR page object is empty or missing markdown. Index: {getattr(page, 'index', 'N/A')}")
+        return ""
+
+    page_index = page.index
+    ocr_images_data = []
+    if page.images:
+        for img_obj in page.images:
+            if img_obj.id and img_obj.image_base64:
+                ocr_images_data.append({"id": img_obj.id, "image_base64": img_obj.image_base64})
+            else:
+                logger.warning(f"Page {page_index + 1}: Found image object with missing id or base64.")
+    else:
+        logger.info(f"Page {page_index + 1}: No images found in OCR result.")
+
+    # Replace images in markdown using their original Mistral IDs and the new unique filenames
+    # The ocr_images_data list now contains dicts like {"id": "img-0.jpeg", "image_base64": "..."}
+    return replace_images_in_markdown(page.markdown, ocr_images_data, page_index, saved_images)
+
+async def refine_page_markdown(processed_markdown: str, page_index: int, document_type: str = "cheatsheet",
+                               ocr_markdown: str | None = None, background: bool = False) -> str:
+    """
+    Refines a page's prepared markdown with the LLM when it is configured and the page needs it.
+    Whether it needs it is judged from ocr_markdown, the page as OCR returned it (table fixes
+    would hide broken tables), falling back to the prepared markdown when that isn't available.
+    Background refinement (of a page that is already readable) yields to foreground LLM calls.
+    """
+    if not processed_markdown:
+        return processed_markdown
+
+    # Refinement step (ensure GOOGLE_API_KEY check is appropriate)
+    scored_markdown = processed_markdown if ocr_markdown is None else ocr_markdown
+    if settings.GOOGLE_API_KEY and not needs_refinement(scored_markdown, settings.OCR_REFINEMENT_THRESHOLD):
+        # Clean pages are kept as OCR'd; only likely-broken ones are worth an LLM call
+        logger.info(f"Page {page_index + 1}: OCR output looks clean. Skipping LLM refinement.")
+        metrics.increment("refinement_skipped_clean_pages")
+        return processed_markdown
+    if settings.GOOGLE_API_KEY:
+        try:
+            logger.info(f"Refining markdown for page {page_index + 1} using Google Gemini")
+            refined_markdown = await refine_markdown(processed_markdown, context=document_type, background=background)
+            # (image and table count logging can remain here for verification)
+            return refined_markdown
+        except Exception as e:
+            logger.error(f"Error refining markdown for page {page_index + 1} with Google Gemini: {str(e)}. Using processed markdown.")
+            return processed_markdown # Fallback to markdown processed for images and tables
+    else:
+        logger.info(f"Page {page_index + 1}: No GOOGLE_API_KEY provided. Skipping LLM refinement.")
+        return processed_markdown
+
+# --- Job Processing (run by the OCR workers) ---
+async def ocr_document(job_id: str, file_path: Path, file_name: str, ocr: MistralOCRClient,
+                       page_indices: list[int], num_pages: int,
+                       on_chunk_pages: Callable[[list[OCRPageObject]], Awaitable[None]] | None = None) -> list[OCRPageObject]:
+    """
+    OCRs the given pages of a PDF as chunks of OCR_CHUNK_PAGES pages, up to OCR_CHUNK_CONCURRENCY at once.
+    Page indices are remapped so they refer to pages of the original document. on_chunk_pages
+    is awaited with each chunk's pages as soon as that chunk is done (e.g. to checkpoint them).
+    If a chunk fails, the other chunks are cancelled and its error is raised.
+    """
+    page_chunks = chunk_page_indices(page_indices, settings.OCR_CHUNK_PAGES)
+    logger.info(f"Job {job_id}: Sending {len(page_indices)} page(s) to OCR service in {len(page_chunks)} chunk(s)")
+    chunk_semaphore = asyncio.Semaphore(max(1, settings.OCR_CHUNK_CONCURRENCY))
+    file_stem = Path(file_name or "document").stem
+
+    async def upload_chunk(chunk_indices: list[int]) -> str:
+        if len(chunk_indices) == num_pages:
+            # Whole document: stream it from the spool file instead of reading it into memory
+            with open(file_path, "rb") as pdf_file:
+                return await ocr.upload(file_name, pdf_file)
+        # Chunks are only materialised while they hold a slot, bounding memory per job
+        chunk_content = await asyncio.to_thread(extract_pdf_pages, file_path, chunk_indices)
+        return await ocr.upload(f"{file_stem}-{chunk_indices[0] + 1}.pdf", chunk_content)
+
+    async def ocr_chunk(chunk_indices: list[int]) -> list[OCRPageObject]:
+        async with chunk_semaphore:
+            uploaded_file_id = await upload_chunk(chunk_indices)
+            try:
+                signed_url = await ocr.get_signed_url(uploaded_file_id)
+                ocr_response_obj = await ocr.process(signed_url)
+            finally:
+                # Clean up uploaded file from Mistral storage if possible (optional)
+                try:
+                    await ocr.delete(uploaded_file_id)
+                except Exception as del_err:
+                    logger.warning(f"Job {job_id}: Error deleting uploaded file: {str(del_err)}")
+
+        pages = ocr_response_obj.pages if ocr_response_obj and ocr_response_obj.pages else []
+        # OCR indices are relative to the chunk; map them back to pages of the original document
+        pages = [
+            page.model_copy(update={"index": chunk_indices[page.index]})
+            for page in pages if page.index < len(chunk_indices)
+        ]
+        if on_chunk_pages:
+            await on_chunk_pages(pages)
+        return pages
+
+    try:
+        # Unlike gather, a task group stops the remaining chunks once one has failed
+        async with asyncio.TaskGroup() as chunk_group:
+            chunk_tasks = [chunk_group.create_task(ocr_chunk(chunk_indices)) for chunk_indices in page_chunks]
+    except ExceptionGroup as chunk_errors:
+        raise chunk_errors.exceptions[0]
+    return [page for chunk_task in chunk_tasks for page in chunk_task.result()]
+
+# How long a cancelled pipeline gets to clean up before it is cancelled again. A cancellation
+# that lands while a Redis command is in flight can be lost in the client.
+CANCEL_REPEAT_SECONDS = 5.0
+
+# Shared by all jobs in this process so background refinement of already-readable
+# pages ("fast first view" mode) can't crowd out first-view work and interactive calls.
+# Their Gemini calls also yield to foreground ones in the LLM gateway.
+background_refinement_semaphore = asyncio.Semaphore(max(1, settings.BACKGROUND_REFINEMENT_CONCURRENCY))
+
+def page_record(page_number: int, markdown_content: str, refined: bool = True, version: int = 1) -> dict:
+    """
+    A page as stored and served, shaped like schemas.processing.ProcessedPage. Built as a
+    plain dict since pages produced here need no validation.
+    """
+    return {"page_number": page_number, "markdown_content": markdown_content, "refined": refined, "version": version}
+
+def prepare_pages(job_id: str, ocr_pages: list[OCRPageObject], saved_images: list[str] | None = None) -> dict[int, str | None]:
+    """Prepares markdown (saved images, fixed tables) for OCR'd pages by page index; None for pages that failed."""
+    prepared_pages = {}
+    for page_result in ocr_pages:
+        try:
+            prepared_pages[page_result.index] = prepare_page_markdown(page_result, saved_images)
+        except Exception as page_extract_err:
+            logger.error(f"Job {job_id}: Error preparing page {page_result.index + 1}: {page_extract_err}")
+            prepared_pages[page_result.index] = None
+    return prepared_pages
+
+async def publish_first_view(r: redis.Redis, job_id: str, prepared_pages: dict[int, str | None],
+                             published_page_numbers: set[int]):
+    """
+    Stores pages' unrefined markdown right away so they are readable at OCR latency, and
+    records how many pages can be read so far. Pages in published_page_numbers (including
+    pages stored by an earlier run of the job) are left alone; the new ones are added to it.
+    """
+    for page_index, markdown_content in prepared_pages.items():
+        page_num = page_index + 1
+        if page_num in published_page_numbers:
+            continue
+        if markdown_content is None:
+            markdown_content = f"*Error processing page {page_num}: There was a problem extracting content from this page.*"
+        await save_page(r, job_id, page_record(page_num, markdown_content, refined=False))
+        published_page_numbers.add(page_num)
+    await update_job(r, job_id, first_view_pages=len(published_page_numbers))
+
+async def finish_cancelled_job(r: redis.Redis, job_id: str, saved_images: list[str], fingerprint: str | None = None):
+    """Removes what a cancelled job produced so far and marks it cancelled."""
+    removed = sum(1 for filename in saved_images if image_service.delete_image(filename))
+    await delete_pages(r, job_id)
+    await delete_page_checkpoints(r, job_id)
+    await update_job(r, job_id, status="cancelled", detail="Processing was cancelled.")
+    if fingerprint:
+        await release_fingerprint(r, fingerprint, job_id)
+    metrics.increment("jobs_cancelled")
+    logger.info(f"Job {job_id}: Cancelled, removed {removed} saved image(s)")
+
+async def run_mistral_ocr_processing(job_id: str, file_path: Path, file_name: str, r: redis.Redis, document_type: str = "cheatsheet", ocr: MistralOCRClient | None = None, fingerprint: str | None = None, fast_first_view: bool = False):
+    """
+    Runs the pipeline for a job until it finishes or cancellation is requested (see
+    DELETE /process/{job_id}), which may come from any API process. Cancelling stops
+    OCR and pending page refinements, deletes Mistral uploads and the images saved so far.
+    """
+    saved_images = []
+    processing_task = asyncio.create_task(process_document(
+        job_id, file_path, file_name, r, document_type, ocr, fingerprint, fast_first_view, saved_images
+    ))
+    cancel_watch = asyncio.create_task(wait_for_cancellation(r, job_id))
+    try:
+        await asyncio.wait((processing_task, cancel_watch), return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        cancel_watch.cancel()
+        # Let the pipeline's own cleanup (e.g. deleting Mistral uploads) run to the end,
+        # repeating the cancellation if the pipeline carries on as if it never arrived
+        while not processing_task.done():
+            processing_task.cancel()
+            await asyncio.wait((processing_task,), timeout=CANCEL_REPEAT_SECONDS)
+
+    if processing_task.cancelled():
+        logger.info(f"Job {job_id}: Cancellation requested, stopped processing")
+        await finish_cancelled_job(r, job_id, saved_images, fingerprint)
+
+async def process_document(job_id: str, file_path: Path, file_name: str, r: redis.Redis, document_type: str = "cheatsheet", ocr: MistralOCRClient | None = None, fingerprint: str | None = None, fast_first_view: bool = False, saved_images: list[str] | None = None):
+    """
+    Processes a job's PDF, resuming from checkpoints if an earlier run was interrupted
+    (e.g. the worker crashed or was redeployed and the job was redelivered): pages OCR'd
+    before are not OCR'd again, and pages already refined and stored are kept.
+    """
+    ocr = ocr or ocr_client
+    saved_images = [] if saved_images is None else saved_images
+
+    try:
+        logger.info(f"Job {job_id}: Starting processing for {file_name}")
+        # 1. Update status to processing in Redis (no page count needed upfront)
+        await update_job(r, job_id, status="processing", file_name=file_name)
+
+        # 2. Work left by an interrupted run: OCR'd pages (with their images saved) and stored pages
+        prepared_pages: dict[int, str | None] = await load_page_checkpoints(r, job_id)
+        stored_pages = {page["page_number"]: page for page in await get_pages(r, job_id)}
+        # Unrefined first view pages still need refinement
+        finished_pages_data = {number: page for number, page in stored_pages.items() if page.get("refined", True)}
+        if prepared_pages or stored_pages:
+            logger.info(f"Job {job_id}: Resuming with {len(prepared_pages)} OCR'd and {len(finished_pages_data)} finished pages")
+            metrics.increment("jobs_resumed")
+            for markdown in prepared_pages.values():
+                saved_images.extend(SAVED_IMAGE_PATTERN.findall(markdown))
+
+        # 3. Born-digital pages with a good embedded text layer are converted locally, skipping OCR
+        num_pages = await asyncio.to_thread(count_pdf_pages, file_path)
+        text_layer_pages = {}
+        if settings.TEXT_LAYER_FAST_PATH:
+            text_layer_pages = await asyncio.to_thread(
+                extract_text_layer_pages, file_path, settings.TEXT_LAYER_MIN_CHARS
+            )
+            logger.info(f"Job {job_id}: Text layer used for {len(text_layer_pages)}/{num_pages} pages, skipping their OCR")
+        prepared_pages.update(prepare_pages(job_id, [
+            OCRPageObject(index=page_index, markdown=markdown, images=[], dimensions=None)
+            for page_index, markdown in text_layer_pages.items()
+        ]))
+        # Pages as OCR returned them, for the refinement decision. Pages OCR'd by an earlier run
+        # are only checkpointed after preparation, so they are scored on that instead.
+        ocr_markdown: dict[int, str] = dict(text_layer_pages)
+        ocr_page_indices = [page_index for page_index in range(num_pages) if page_index not in prepared_pages]
+
+        # In fast first view mode pages become readable as they come in: resumed and
+        # text-layer pages now, OCR'd pages chunk by chunk, before any refinement starts
+        first_view_pages = set(stored_pages)
+        if fast_first_view:
+            await update_job(r, job_id, total_pages=num_pages)
+            await publish_first_view(r, job_id, prepared_pages, first_view_pages)
+
+        # 4. OCR the remaining pages, split into page-range chunks processed in parallel.
+        # Each chunk is prepared and checkpointed as soon as it is done.
+        async def checkpoint_chunk(chunk_pages: list[OCRPageObject]):
+            chunk_prepared = prepare_pages(job_id, chunk_pages, saved_images)
+            prepared_pages.update(chunk_prepared)
+            ocr_markdown.update((page.index, page.markdown) for page in chunk_pages if page.markdown is not None)
+            await save_page_checkpoints(r, job_id, {
+                page_index: markdown for page_index, markdown in chunk_prepared.items() if markdown is not None
+            })
+            if fast_first_view:
+                await publish_first_view(r, job_id, chunk_prepared, first_view_pages)
+
+        if ocr_page_indices:
+            await ocr_document(job_id, file_path, file_name, ocr, ocr_page_indices, num_pages, on_chunk_pages=checkpoint_chunk)
+        page_indices = sorted(prepared_pages)
+
+        # 5. Process Pages from the OCR response, refining up to PAGE_REFINEMENT_CONCURRENCY at once
+        processed_pages_data = []
+        num_pages = 0
+        if page_indices:
+            num_pages = len(page_indices)
+            logger.info(f"Job {job_id}: Received {num_pages} pages from OCR service")
+
+            if fast_first_view:
+                await update_job(r, job_id, total_pages=num_pages, first_view="ready")
+                logger.info(f"Job {job_id}: First view of all {num_pages} pages is readable")
+
+            # Slots are filled as pages finish so the final result keeps the OCR page order
+            processed_pages_data = [finished_pages_data.get(page_index + 1) for page_index in page_indices]
+            refinement_semaphore = asyncio.Semaphore(max(1, settings.PAGE_REFINEMENT_CONCURRENCY))
+
+            async def process_page(position: int, page_index: int) -> tuple[int, dict]:
+                page_num = page_index + 1
+                async with refinement_semaphore:
+                    logger.info(f"Job {job_id}: Processing page {page_num}/{num_pages}")
+                    try:
+                        if prepared_pages[page_index] is None:
+                            raise Exception("Page could not be prepared")
+                        # Background refinement of already-readable pages yields to first-view work
+                        async with background_refinement_semaphore if fast_first_view else contextlib.nullcontext():
+                            markdown_content = await refine_page_markdown(
+                                prepared_pages[page_index], page_index, document_type, ocr_markdown.get(page_index),
+                                background=fast_first_view
+                            )
+                    except Exception as page_extract_err:
+                        # A failing page must not abort the rest of the document
+                        logger.error(f"Job {job_id}: Error processing page {page_num}: {page_extract_err}")
+                        markdown_content = f"*Error processing page {page_num}: There was a problem extracting content from this page.*"
+
+                # Replaces the first view page, so clients see a newer version
+                return position, page_record(page_num, markdown_content, version=2 if fast_first_view else 1)
+
+            page_tasks = [
+                asyncio.create_task(process_page(position, page_index))
+                for position, page_index in enumerate(page_indices)
+                if processed_pages_data[position] is None
+            ]
+            try:
+                finished_pages = num_pages - len(page_tasks)
+                for next_finished in asyncio.as_completed(page_tasks):
+                    position, page_data = await next_finished
+                    processed_pages_data[position] = page_data
+                    finished_pages += 1
+
+                    # Store the page as soon as it is done; status polls only read the small record
+                    await save_page(r, job_id, page_data)
+                    # Update progress (current_page counts pages that have finished, in any order)
+                    await update_job(r, job_id, current_page=finished_pages, total_pages=num_pages)
+            finally:
+                # Don't leave page tasks running if progress reporting itself failed
+                for page_task in page_tasks:
+                    page_task.cancel()
+        else:
+            logger.error(f"Job {job_id}: OCR response did not contain any pages")
+            raise Exception("OCR response did not contain any pages.")
+
+        # 6. Final Result
+        result = {"file_name": file_name, "total_pages": num_pages, "pages": processed_pages_data}
+
+        # Pages are already stored; completing the job only touches the status record
+        await update_job(r, job_id, status="completed", total_pages=num_pages)
+        await delete_page_checkpoints(r, job_id)
+        if fingerprint:
+            # Keep the result beyond the Redis TTL so re-uploads of this file skip OCR entirely
+            await save_cached_result(fingerprint, result)
+        logger.info(f"Job {job_id}: Processing completed successfully")
+
+    except Exception as e:
+        logger.error(f"Job {job_id}: Error during processing: {str(e)}")
+        await update_job(r, job_id, status="error", detail=f"An unexpected error occurred during OCR: {str(e)}")
+        await delete_page_checkpoints(r, job_id)
+        # Without checkpoints nothing will reuse what the failed run produced
+        await delete_pages(r, job_id)
+        removed = sum(1 for filename in saved_images if image_service.delete_image(filename))
+        logger.info(f"Job {job_id}: Removed {removed} saved image(s) of the failed run")
+        if fingerprint:
+            # Let the next upload of this file start a fresh job instead of attaching to the failed one
+            await release_fingerprint(r, fingerprint, job_id)
+
+
+# Add a function to preprocess base64 data
+def preprocess_base64(base64_str: str) -> str:
+    """Clean and validate base64 data"""
+    if not base64_str:
+        return ""
+        
+    # Remove line breaks, spaces, and other whitespace
+    cleaned = re.sub(r'\s+', '', base64_str)
+    
+    # Remove data URI prefix if present
+    if "base64," in cleaned:
+        cleaned = cleaned.split("base64,")[1]
+        
+    # Validate if the string is proper base64
+    try:
+        # Try decoding a small part to validate
+        base64.b64decode(cleaned[:20] + '=' * (4 - len(cleaned[:20]) % 4))
+        return cleaned
+    except Exception as e:
+        logger.warning(f"Invalid base64 data: {e}")
+        return ""
+
+# Helper function to determine mime type based on base64 data
+def determine_mime_type(base64_str: str) -> str:
+    """Determine the MIME type based on the base64 string pattern."""
+    if not base64_str:
+        return "image/jpeg"  # Default
+
+    # Remove any whitespace that might be present
+    base64_str = base64_str.strip()
+    
+    # First few characters of the base64 can indicate the format
+    # JPEG signature starts with /9j/
+    if base64_str.startswith('/9j/'):
+        return "image/jpeg"
+    # PNG signature starts with iVBOR
+    elif base64_str.startswith('iVBOR'):
+        return "image/png"
+    # GIF signature starts with R0lGOD
+    elif base64_str.startswith('R0lGOD'):
+        return "image/gif"
+    # BMP signature starts with Qk0
+    elif base64_str.startswith('Qk0'):
+        return "image/bmp"
+    # PDF (sometimes embedded)
+    elif base64_str.startswith('JVBERi0'):
+        return "application/pdf"
+    # SVG possibly
+    elif base64_str.startswith('UEs') or base64_str.startswith('PHN2'):
+        return "image/svg+xml"
+    # WebP
+    elif base64_str.startswith('UklGR'):
+        return "image/webp"
+
+    # Default to JPEG if unknown
+    return "image/jpeg"
\ No newline at end of file
@@ -72,4 +72,17 @@ class ImageStorageService:
         """Check if an image file exists."""
         if not filename:
             return False
-        return (self.storage_dir / filename).exists() 
\ No newline at end of file
+        return (self.storage_dir / filename).exists() 
+
+    def delete_image(self, filename: str) -> bool:
+        """Delete a saved image file. Returns False if it didn't exist or couldn't be removed."""
+        if not filename:
+            return False
+        try:
+            (self.storage_dir / filename).unlink()
+            return True
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            logger.error(f"Error deleting image {filename}: {e}")
+            return False
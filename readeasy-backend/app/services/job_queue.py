@@ -0,0 +1,104 @@
+"""
+Durable processing job queue built on Redis Streams.
+
+The scheduler (see job_scheduler.py) appends one entry per uploaded PDF to the processing
+stream, in fair order across users. OCR workers (see worker.py) read from it through a
+consumer group, acknowledge entries once the job has reached a final state, and reclaim
+entries whose worker stopped heartbeating.
+"""
+import logging
+from pathlib import Path
+
+import redis.asyncio as redis
+from redis.exceptions import ResponseError
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+JOB_STREAM_KEY = "processing_jobs"
+JOB_CONSUMER_GROUP = "ocr_workers"
+
+
+def spool_path_for_job(job_id: str) -> Path:
+    """Location of the uploaded PDF for a job. Must be on storage shared by the API and workers."""
+    spool_dir = Path(settings.UPLOAD_SPOOL_DIR)
+    spool_dir.mkdir(exist_ok=True, parents=True)
+    return spool_dir / f"{job_id}.pdf"
+
+
+async def ensure_consumer_group(r: redis.Redis) -> None:
+    """Create the worker consumer group (and the stream) if they don't exist yet."""
+    try:
+        await r.xgroup_create(JOB_STREAM_KEY, JOB_CONSUMER_GROUP, id="0", mkstream=True)
+        logger.info(f"Created consumer group {JOB_CONSUMER_GROUP} on {JOB_STREAM_KEY}")
+    except ResponseError as e:
+        # BUSYGROUP means another process already created it
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+def build_job_fields(job_id: str, file_name: str, document_type: str, user_id: str,
+                     fingerprint: str = "", fast_first_view: bool = False) -> dict:
+    """Stream entry fields for a job. Jobs reach the stream through the scheduler (see job_scheduler.py)."""
+    return {
+        "job_id": job_id,
+        "file_path": str(spool_path_for_job(job_id)),
+        "file_name": file_name or "",
+        "document_type": document_type,
+        "user_id": user_id or "",
+        "fingerprint": fingerprint,
+        "fast_first_view": "1" if fast_first_view else "",
+    }
+
+
+async def read_jobs(r: redis.Redis, consumer: str, count: int = 1, block_ms: int = 5000) -> list[tuple[str, dict]]:
+    """Read up to count new jobs for this consumer, blocking up to block_ms if none are waiting."""
+    response = await r.xreadgroup(
+        JOB_CONSUMER_GROUP, consumer, {JOB_STREAM_KEY: ">"}, count=count, block=block_ms
+    )
+    if not response:
+        return []
+    # Response shape: [[stream_name, [(message_id, fields), ...]]]
+    return [(message_id, fields) for message_id, fields in response[0][1] if fields]
+
+
+async def claim_stale_jobs(r: redis.Redis, consumer: str, count: int = 1) -> list[tuple[str, dict, int]]:
+    """
+    Take over jobs whose worker hasn't heartbeated within JOB_VISIBILITY_TIMEOUT_SECONDS.
+    Returns (message_id, fields, times_delivered) for each reclaimed job. Entries trimmed
+    from the stream come back with empty fields: they are no longer pending and there is
+    nothing to run, but the caller still has to free their user's slot.
+    """
+    min_idle_ms = settings.JOB_VISIBILITY_TIMEOUT_SECONDS * 1000
+    response = await r.xautoclaim(
+        JOB_STREAM_KEY, JOB_CONSUMER_GROUP, consumer, min_idle_time=min_idle_ms, start_id="0-0", count=count
+    )
+    # Response shape: [next_start_id, [(message_id, fields), ...], deleted_ids]; Redis 7
+    # drops trimmed entries from the pending list itself and reports them in deleted_ids
+    claimed = [(message_id, {}, 0) for message_id in (response[2] if len(response) > 2 else [])]
+    for message_id, fields in response[1]:
+        if not fields:
+            # Redis 6.2 returns trimmed entries without fields and leaves them pending
+            await ack_job(r, message_id)
+            claimed.append((message_id, {}, 0))
+            continue
+        pending = await r.xpending_range(
+            JOB_STREAM_KEY, JOB_CONSUMER_GROUP, min=message_id, max=message_id, count=1
+        )
+        times_delivered = pending[0]["times_delivered"] if pending else 1
+        claimed.append((message_id, fields, times_delivered))
+    return claimed
+
+
+async def heartbeat_job(r: redis.Redis, consumer: str, message_id: str) -> None:
+    """Reset the idle time of an in-progress job so other workers don't reclaim it."""
+    await r.xclaim(
+        JOB_STREAM_KEY, JOB_CONSUMER_GROUP, consumer, min_idle_time=0, message_ids=[message_id], justid=True
+    )
+
+
+async def ack_job(r: redis.Redis, message_id: str) -> None:
+    """Acknowledge a job that reached a final state and drop it from the stream."""
+    await r.xack(JOB_STREAM_KEY, JOB_CONSUMER_GROUP, message_id)
+    await r.xdel(JOB_STREAM_KEY, message_id)
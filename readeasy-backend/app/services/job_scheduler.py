@@ -0,0 +1,225 @@
+"""
+Fair scheduling of processing jobs in front of the worker stream.
+
+New jobs don't go straight onto the processing stream. They wait in a Redis sorted
+set ordered by weighted-fair-queuing finish tags. Each user has one flow per priority
+class ("interactive" for single uploads, "bulk" once a user has several jobs waiting),
+and a job's tag is
+
+    max(virtual time, previous tag of its flow) + pages / class weight
+
+so a user with 40 queued PDFs advances their own flow's clock, not everyone else's.
+Jobs are moved onto the stream one at a time (see dispatch_next_job) when the stream
+has no undelivered backlog, picking the lowest tag whose user is below
+SCHEDULER_USER_MAX_CONCURRENCY running jobs. Workers free the user's slot when they
+acknowledge the job. Once a user has no jobs waiting their flow tags are dropped, so the
+next upload starts from the virtual time and the tags hash only holds active users.
+"""
+import logging
+
+import redis.asyncio as redis
+
+from app.core import json_codec
+from app.core.config import settings
+from app.services.job_queue import JOB_STREAM_KEY, JOB_CONSUMER_GROUP
+
+logger = logging.getLogger(__name__)
+
+SCHEDULER_DB_PREFIX = "processing_queue:"
+PENDING_JOBS_KEY = f"{SCHEDULER_DB_PREFIX}pending"          # sorted set: job_id -> finish tag
+PENDING_FIELDS_KEY = f"{SCHEDULER_DB_PREFIX}jobs"           # hash: job_id -> stream fields (JSON)
+QUEUED_COUNTS_KEY = f"{SCHEDULER_DB_PREFIX}queued"          # hash: user_id -> jobs waiting
+RUNNING_COUNTS_KEY = f"{SCHEDULER_DB_PREFIX}running"        # hash: user_id -> jobs on the stream
+ENTRY_USERS_KEY = f"{SCHEDULER_DB_PREFIX}entry_users"       # hash: stream entry ID -> user_id holding the slot
+FLOW_TAGS_KEY = f"{SCHEDULER_DB_PREFIX}flow_tags"           # hash: user_id:priority -> last finish tag
+VIRTUAL_TIME_KEY = f"{SCHEDULER_DB_PREFIX}virtual_time"     # tag of the last dispatched job
+SECONDS_PER_PAGE_KEY = f"{SCHEDULER_DB_PREFIX}seconds_per_page"
+
+PRIORITY_CLASSES = ("interactive", "bulk")
+
+# Lowers a user's queued count (KEYS[3]) and drops their flow tags once nothing of theirs is waiting
+RELEASE_QUEUED_JOB_LUA = """
+local function release_queued_job(flow_tags_key, user_id)
+    if redis.call('HINCRBY', KEYS[3], user_id, -1) <= 0 then
+        redis.call('HDEL', KEYS[3], user_id)
+        redis.call('HDEL', flow_tags_key, %s)
+    end
+end
+""" % ", ".join(f"user_id .. ':{priority}'" for priority in PRIORITY_CLASSES)
+
+# KEYS: pending, fields, queued, flow tags, virtual time
+# ARGV: job_id, user_id, flow, cost, fields JSON
+SCHEDULE_SCRIPT = """
+local virtual_time = tonumber(redis.call('GET', KEYS[5]) or '0')
+local last_tag = tonumber(redis.call('HGET', KEYS[4], ARGV[3]) or '0')
+local tag = math.max(virtual_time, last_tag) + tonumber(ARGV[4])
+redis.call('HSET', KEYS[4], ARGV[3], tostring(tag))
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[5])
+redis.call('HINCRBY', KEYS[3], ARGV[2], 1)
+redis.call('ZADD', KEYS[1], tag, ARGV[1])
+return tostring(tag)
+"""
+
+# KEYS: pending, fields, queued, running, virtual time, stream, flow tags, entry users
+# ARGV: consumer group, per-user cap, dispatch-ahead limit, candidates to scan
+DISPATCH_SCRIPT = RELEASE_QUEUED_JOB_LUA + """
+local backlog = redis.call('XLEN', KEYS[6]) - redis.call('XPENDING', KEYS[6], ARGV[1])[1]
+if backlog >= tonumber(ARGV[3]) then
+    return false
+end
+
+local candidates = redis.call('ZRANGE', KEYS[1], 0, tonumber(ARGV[4]) - 1, 'WITHSCORES')
+for i = 1, #candidates, 2 do
+    local job_id = candidates[i]
+    local encoded = redis.call('HGET', KEYS[2], job_id)
+    if not encoded then
+        redis.call('ZREM', KEYS[1], job_id)
+    else
+        local fields = cjson.decode(encoded)
+        local user_id = fields['user_id']
+        if tonumber(redis.call('HGET', KEYS[4], user_id) or '0') < tonumber(ARGV[2]) then
+            redis.call('ZREM', KEYS[1], job_id)
+            redis.call('HDEL', KEYS[2], job_id)
+            release_queued_job(KEYS[7], user_id)
+            redis.call('HINCRBY', KEYS[4], user_id, 1)
+            redis.call('SET', KEYS[5], candidates[i + 1])
+            local entry = {}
+            for key, value in pairs(fields) do
+                table.insert(entry, key)
+                table.insert(entry, value)
+            end
+            local message_id = redis.call('XADD', KEYS[6], '*', unpack(entry))
+            redis.call('HSET', KEYS[8], message_id, user_id)
+            return message_id
+        end
+    end
+end
+return false
+"""
+
+# KEYS: pending, fields, queued, flow tags
+# ARGV: job_id
+UNSCHEDULE_SCRIPT = RELEASE_QUEUED_JOB_LUA + """
+if redis.call('ZREM', KEYS[1], ARGV[1]) == 0 then
+    return false
+end
+local encoded = redis.call('HGET', KEYS[2], ARGV[1])
+redis.call('HDEL', KEYS[2], ARGV[1])
+if encoded then
+    release_queued_job(KEYS[4], cjson.decode(encoded)['user_id'])
+end
+return encoded or ''
+"""
+
+# KEYS: running, entry users
+# ARGV: stream entry ID, user_id from its fields ('' once the entry was trimmed)
+RELEASE_SLOT_SCRIPT = """
+local user_id = redis.call('HGET', KEYS[2], ARGV[1])
+if user_id then
+    redis.call('HDEL', KEYS[2], ARGV[1])
+elseif ARGV[2] ~= '' then
+    -- Dispatched before entries recorded their user
+    user_id = ARGV[2]
+else
+    return 0
+end
+if redis.call('HINCRBY', KEYS[1], user_id, -1) <= 0 then
+    redis.call('HDEL', KEYS[1], user_id)
+end
+return 1
+"""
+
+
+async def queued_job_count(r: redis.Redis, user_id: str) -> int:
+    """Number of the user's jobs waiting to be dispatched."""
+    return int(await r.hget(QUEUED_COUNTS_KEY, user_id or "") or 0)
+
+
+async def choose_priority(r: redis.Redis, user_id: str, requested: str | None = None) -> str:
+    """Use the requested class, or demote users with several jobs already waiting to bulk."""
+    if requested in PRIORITY_CLASSES:
+        return requested
+    if await queued_job_count(r, user_id) >= settings.SCHEDULER_BULK_THRESHOLD:
+        return "bulk"
+    return "interactive"
+
+
+async def schedule_job(r: redis.Redis, fields: dict, priority: str, page_count: int) -> None:
+    """Queue a job (its stream fields) for fair dispatch to the workers."""
+    user_id = fields.get("user_id", "")
+    weight = settings.SCHEDULER_INTERACTIVE_WEIGHT if priority == "interactive" else 1
+    cost = max(1, page_count) / max(1, weight)
+    fields = {**fields, "priority": priority, "page_count": str(page_count)}
+    await r.eval(
+        SCHEDULE_SCRIPT, 5, PENDING_JOBS_KEY, PENDING_FIELDS_KEY, QUEUED_COUNTS_KEY, FLOW_TAGS_KEY, VIRTUAL_TIME_KEY,
+        fields["job_id"], user_id, f"{user_id}:{priority}", cost, json_codec.dumps(fields)
+    )
+    logger.info(f"Job {fields['job_id']}: Scheduled as {priority} ({page_count} pages)")
+    await dispatch_next_job(r)
+
+
+async def dispatch_next_job(r: redis.Redis) -> str | None:
+    """Move the next fair job onto the worker stream if workers are ready for it. Returns its entry ID."""
+    try:
+        message_id = await r.eval(
+            DISPATCH_SCRIPT, 8, PENDING_JOBS_KEY, PENDING_FIELDS_KEY, QUEUED_COUNTS_KEY, RUNNING_COUNTS_KEY,
+            VIRTUAL_TIME_KEY, JOB_STREAM_KEY, FLOW_TAGS_KEY, ENTRY_USERS_KEY,
+            JOB_CONSUMER_GROUP, settings.SCHEDULER_USER_MAX_CONCURRENCY, settings.SCHEDULER_DISPATCH_AHEAD, 100
+        )
+    except Exception as e:
+        # e.g. NOGROUP before the first worker started; workers dispatch once they're up
+        logger.warning(f"Could not dispatch queued jobs: {e}")
+        return None
+    if message_id:
+        logger.info(f"Dispatched queued job as stream entry {message_id}")
+    return message_id or None
+
+
+async def unschedule_job(r: redis.Redis, job_id: str) -> dict | None:
+    """Remove a job that is still waiting for dispatch. Returns its stream fields, or None if it already left the queue."""
+    encoded = await r.eval(
+        UNSCHEDULE_SCRIPT, 4, PENDING_JOBS_KEY, PENDING_FIELDS_KEY, QUEUED_COUNTS_KEY, FLOW_TAGS_KEY, job_id
+    )
+    if encoded is None:
+        return None
+    return json_codec.loads(encoded) if encoded else {}
+
+
+async def release_user_slot(r: redis.Redis, message_id: str, user_id: str = "") -> None:
+    """
+    Free the running-job slot a stream entry took once it has been acknowledged. The
+    slot's user is looked up by entry ID, so entries trimmed from the stream (whose fields
+    are gone) still give their slot back.
+    """
+    await r.eval(RELEASE_SLOT_SCRIPT, 2, RUNNING_COUNTS_KEY, ENTRY_USERS_KEY, message_id, user_id or "")
+
+
+async def record_job_duration(r: redis.Redis, seconds: float, page_count: int) -> None:
+    """Fold a finished job's time per page into the moving average used for ETAs."""
+    if page_count <= 0:
+        return
+    previous = float(await r.get(SECONDS_PER_PAGE_KEY) or settings.SCHEDULER_SECONDS_PER_PAGE)
+    await r.set(SECONDS_PER_PAGE_KEY, str(0.8 * previous + 0.2 * seconds / page_count))
+
+
+async def get_queue_position(r: redis.Redis, job_id: str) -> dict | None:
+    """
+    Position (1-based) of a waiting job in dispatch order and a rough ETA in seconds
+    until it finishes. None if the job isn't waiting (e.g. already on the stream).
+    """
+    rank = await r.zrank(PENDING_JOBS_KEY, job_id)
+    if rank is None:
+        return None
+
+    job_ids = await r.zrange(PENDING_JOBS_KEY, 0, rank)
+    pages_ahead = 0
+    for encoded in await r.hmget(PENDING_FIELDS_KEY, job_ids):
+        if encoded:
+            pages_ahead += max(1, int(json_codec.loads(encoded).get("page_count") or 1))
+    running = sum(max(0, int(count)) for count in (await r.hgetall(RUNNING_COUNTS_KEY)).values())
+    seconds_per_page = float(await r.get(SECONDS_PER_PAGE_KEY) or settings.SCHEDULER_SECONDS_PER_PAGE)
+    return {
+        "queue_position": rank + 1,
+        # Work ahead (and the job itself) spread over the jobs currently running in parallel
+        "eta_seconds": round(pages_ahead * seconds_per_page / max(1, running)),
+    }
@@ -0,0 +1,307 @@
+"""
+Redis storage for processing jobs.
+
+Each job is split into two keys so polling stays cheap regardless of document size:
+
+- processing_job:{id}        hash with the small status/progress record
+- processing_job:{id}:pages  hash of page number -> page JSON (compressed, see result_codec.py),
+                             written as pages finish
+- processing_job:{id}:page_meta  hash of page number -> {size, image_count} for manifests
+- processing_job:{id}:cancel     set while cancellation of the job has been requested
+- processing_job:{id}:attached   set of jobs attached to this one (uploads of the same
+                                 document by other users), which keep its run going
+- processing_job:{id}:checkpoint hash of page index -> OCR'd markdown (images already saved),
+                                 so a job redelivered after a worker crash skips finished OCR
+
+The status record's revision field is bumped after every change to the job or its
+pages, so the API can derive ETags from it without reading the pages.
+
+Every status change and finished page is also published on processing_job_events:{id}
+so API workers can push updates to streaming clients (see GET /process/{id}/events).
+Cancellation requests are published there too, so whichever OCR worker runs the job
+stops it promptly (see wait_for_cancellation).
+"""
+import asyncio
+import logging
+import re
+
+import redis.asyncio as redis
+
+from app.core import json_codec
+from app.core.config import settings
+from app.services.result_codec import encode_stored, decode_stored
+
+logger = logging.getLogger(__name__)
+
+PROCESSING_DB_PREFIX = "processing_job:"
+JOB_EVENTS_CHANNEL_PREFIX = "processing_job_events:"
+
+# Statuses after which a job no longer changes
+TERMINAL_STATUSES = ("completed", "error", "cancelled")
+
+# How often a running job re-checks its cancel flag when no event arrived (or pub/sub is unavailable)
+CANCEL_POLL_INTERVAL_SECONDS = 5.0
+
+# Status record fields stored as integers (Redis hashes only hold strings)
+INT_FIELDS = ("current_page", "total_pages", "first_view_pages", "revision")
+
+IMAGE_TAG_PATTERN = re.compile(r"!\[[^\]]*\]\(")
+
+# KEYS: attached set, cancel flag
+# ARGV: attaching job_id, TTL
+ATTACH_SCRIPT = """
+if redis.call('EXISTS', KEYS[2]) == 1 then
+    return 0
+end
+redis.call('SADD', KEYS[1], ARGV[1])
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+# Drops a job that depended on a run (an attached job, or the owner when ARGV[1] is empty)
+# and flags the run for cancellation once the owner cancelled and nothing is attached.
+# KEYS: attached set, cancel flag, status record
+# ARGV: detaching job_id, TTL
+RELEASE_RUN_SCRIPT = """
+if ARGV[1] ~= '' then
+    redis.call('SREM', KEYS[1], ARGV[1])
+end
+if redis.call('SCARD', KEYS[1]) > 0 or redis.call('HGET', KEYS[3], 'owner_cancelled') ~= '1' then
+    return 0
+end
+redis.call('SET', KEYS[2], '1', 'EX', ARGV[2])
+return 1
+"""
+
+
+def job_key(job_id: str) -> str:
+    return f"{PROCESSING_DB_PREFIX}{job_id}"
+
+
+def pages_key(job_id: str) -> str:
+    return f"{PROCESSING_DB_PREFIX}{job_id}:pages"
+
+
+def page_meta_key(job_id: str) -> str:
+    return f"{PROCESSING_DB_PREFIX}{job_id}:page_meta"
+
+
+def cancel_key(job_id: str) -> str:
+    return f"{PROCESSING_DB_PREFIX}{job_id}:cancel"
+
+
+def checkpoint_key(job_id: str) -> str:
+    return f"{PROCESSING_DB_PREFIX}{job_id}:checkpoint"
+
+
+def attached_key(job_id: str) -> str:
+    return f"{PROCESSING_DB_PREFIX}{job_id}:attached"
+
+
+def events_channel(job_id: str) -> str:
+    return f"{JOB_EVENTS_CHANNEL_PREFIX}{job_id}"
+
+
+async def publish_job_event(r: redis.Redis, job_id: str, event: str, data: dict) -> None:
+    """Notify subscribers of a job's event channel. Failures only cost streaming clients an update."""
+    try:
+        await r.publish(events_channel(job_id), json_codec.dumps({"event": event, "data": data}))
+    except Exception as e:
+        logger.warning(f"Job {job_id}: Could not publish {event} event: {e}")
+
+
+def _to_mapping(fields: dict) -> dict:
+    # Hashes can't hold None; absent fields read back as missing instead
+    return {key: str(value) for key, value in fields.items() if value is not None}
+
+
+async def _bump_revision(r: redis.Redis, job_id: str) -> None:
+    # Bumped after the change is written: a response may pair new data with the previous
+    # ETag (costing the client one extra full response), but never old data with the new one
+    await r.hincrby(job_key(job_id), "revision", 1)
+
+
+async def create_job(r: redis.Redis, job_id: str, **fields) -> None:
+    """Create (or replace) a job's status record."""
+    key = job_key(job_id)
+    await r.delete(key, pages_key(job_id), page_meta_key(job_id))
+    await r.hset(key, mapping=_to_mapping(fields))
+    await _bump_revision(r, job_id)
+    await r.expire(key, settings.PROCESSING_RESULT_EXPIRATION_SECONDS)
+
+
+async def update_job(r: redis.Redis, job_id: str, **fields) -> None:
+    """Update fields of a job's status record, leaving the other fields (e.g. user_id) intact."""
+    key = job_key(job_id)
+    await r.hset(key, mapping=_to_mapping(fields))
+    await _bump_revision(r, job_id)
+    await r.expire(key, settings.PROCESSING_RESULT_EXPIRATION_SECONDS)
+    await publish_job_event(r, job_id, "status", fields)
+
+
+async def get_job(r: redis.Redis, job_id: str) -> dict | None:
+    """Load a job's status record, or None if the job doesn't exist or expired."""
+    job_data = await r.hgetall(job_key(job_id))
+    if not job_data:
+        return None
+    for field in INT_FIELDS:
+        if field in job_data:
+            job_data[field] = int(job_data[field])
+    return job_data
+
+
+async def request_cancellation(r: redis.Redis, job_id: str) -> None:
+    """Flag a job for cancellation and notify the worker running it."""
+    await r.set(cancel_key(job_id), "1", ex=settings.PROCESSING_RESULT_EXPIRATION_SECONDS)
+    await publish_job_event(r, job_id, "cancel", {})
+
+
+async def is_cancellation_requested(r: redis.Redis, job_id: str) -> bool:
+    return bool(await r.exists(cancel_key(job_id)))
+
+
+async def attach_job(r: redis.Redis, source_job_id: str, job_id: str) -> bool:
+    """Record that job_id is served by source_job_id's run. False if that run is already being cancelled."""
+    return bool(await r.eval(
+        ATTACH_SCRIPT, 2, attached_key(source_job_id), cancel_key(source_job_id),
+        job_id, settings.PROCESSING_RESULT_EXPIRATION_SECONDS
+    ))
+
+
+async def release_job_run(r: redis.Redis, source_job_id: str, job_id: str | None = None) -> bool:
+    """
+    Drop a dependant of source_job_id's run: the attached job job_id, or the owner (whose
+    cancellation must already be recorded as owner_cancelled) when job_id is None. Returns
+    True once nothing needs the run any more; its cancel flag is then set, and the caller
+    stops it (see request_cancellation).
+    """
+    return bool(await r.eval(
+        RELEASE_RUN_SCRIPT, 3, attached_key(source_job_id), cancel_key(source_job_id), job_key(source_job_id),
+        job_id or "", settings.PROCESSING_RESULT_EXPIRATION_SECONDS
+    ))
+
+
+async def wait_for_cancellation(r: redis.Redis, job_id: str) -> None:
+    """
+    Return once cancellation of the job has been requested. Listens on the job's event
+    channel and re-checks the flag periodically, so a missed message only delays it.
+    """
+    while True:
+        pubsub = None
+        try:
+            pubsub = r.pubsub()
+            await pubsub.subscribe(events_channel(job_id))
+            # Checked after subscribing so a request published in between isn't missed
+            while not await is_cancellation_requested(r, job_id):
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=CANCEL_POLL_INTERVAL_SECONDS)
+                if message and json_codec.loads(message["data"]).get("event") == "cancel":
+                    return
+            return
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Without pub/sub (or while Redis is unavailable) fall back to polling the flag
+            logger.debug(f"Job {job_id}: Cancellation listener unavailable: {e}")
+            await asyncio.sleep(CANCEL_POLL_INTERVAL_SECONDS)
+            try:
+                if await is_cancellation_requested(r, job_id):
+                    return
+            except Exception:
+                pass
+        finally:
+            if pubsub is not None:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+
+
+def _page_meta(page_json: str, page: dict) -> str:
+    return json_codec.dumps({
+        "size": len(page_json.encode("utf-8")),
+        "image_count": len(IMAGE_TAG_PATTERN.findall(page.get("markdown_content", ""))),
+    })
+
+
+async def _store_pages(r: redis.Redis, job_id: str, pages: list[dict]) -> None:
+    page_jsons, page_metas = {}, {}
+    for page in pages:
+        number = str(page["page_number"])
+        page_json = json_codec.dumps(page)
+        page_jsons[number] = encode_stored(page_json)
+        page_metas[number] = _page_meta(page_json, page)
+    await r.hset(pages_key(job_id), mapping=page_jsons)
+    await r.hset(page_meta_key(job_id), mapping=page_metas)
+    await _bump_revision(r, job_id)
+    for key in (job_key(job_id), pages_key(job_id), page_meta_key(job_id)):
+        await r.expire(key, settings.PROCESSING_RESULT_EXPIRATION_SECONDS)
+
+
+async def save_page(r: redis.Redis, job_id: str, page: dict) -> None:
+    """Store a single finished page."""
+    await _store_pages(r, job_id, [page])
+    await publish_job_event(r, job_id, "page", page)
+
+
+async def save_pages(r: redis.Redis, job_id: str, pages: list[dict]) -> None:
+    """Store several pages at once (e.g. when restoring a cached result)."""
+    if not pages:
+        return
+    await _store_pages(r, job_id, pages)
+
+
+async def delete_pages(r: redis.Redis, job_id: str) -> None:
+    """Drop all stored pages of a job (e.g. after it was cancelled)."""
+    await r.delete(pages_key(job_id), page_meta_key(job_id))
+    await _bump_revision(r, job_id)
+
+
+async def save_page_checkpoints(r: redis.Redis, job_id: str, pages: dict[int, str]) -> None:
+    """Record OCR'd page markdown by page index. Failures only cost a resumed job some OCR work."""
+    if not pages:
+        return
+    try:
+        await r.hset(checkpoint_key(job_id), mapping={str(index): markdown for index, markdown in pages.items()})
+        await r.expire(checkpoint_key(job_id), settings.PROCESSING_RESULT_EXPIRATION_SECONDS)
+    except Exception as e:
+        logger.warning(f"Job {job_id}: Could not checkpoint {len(pages)} page(s): {e}")
+
+
+async def load_page_checkpoints(r: redis.Redis, job_id: str) -> dict[int, str]:
+    """OCR'd page markdown checkpointed by an earlier run of the job, by page index."""
+    return {int(index): markdown for index, markdown in (await r.hgetall(checkpoint_key(job_id))).items()}
+
+
+async def delete_page_checkpoints(r: redis.Redis, job_id: str) -> None:
+    await r.delete(checkpoint_key(job_id))
+
+
+async def get_pages(r: redis.Redis, job_id: str) -> list[dict]:
+    """Load all stored pages of a job, ordered by page number."""
+    return [json_codec.loads(decode_stored(stored_page)) for stored_page in await get_stored_pages(r, job_id)]
+
+
+async def get_stored_pages(r: redis.Redis, job_id: str) -> list[str]:
+    """All pages of a job as stored (possibly compressed), ordered by page number."""
+    stored_pages = await r.hgetall(pages_key(job_id))
+    return [stored_pages[number] for number in sorted(stored_pages, key=int)]
+
+
+async def get_stored_page_range(r: redis.Redis, job_id: str, start: int, count: int) -> list[str]:
+    """Up to count pages as stored (possibly compressed), starting at page number start. Missing pages are skipped."""
+    page_numbers = [str(number) for number in range(start, start + count)]
+    return [stored_page for stored_page in await r.hmget(pages_key(job_id), page_numbers) if stored_page]
+
+
+async def get_stored_page(r: redis.Redis, job_id: str, page_number: int) -> str | None:
+    """A single page as stored (possibly compressed)."""
+    return await r.hget(pages_key(job_id), str(page_number))
+
+
+async def get_page_manifest(r: redis.Redis, job_id: str) -> list[dict]:
+    """Per-page sizes and image counts of the stored pages, ordered by page number."""
+    page_meta = await r.hgetall(page_meta_key(job_id))
+    return [
+        {"page_number": int(number), **json_codec.loads(page_meta[number])}
+        for number in sorted(page_meta, key=int)
+    ]
@@ -0,0 +1,97 @@
+"""
+Process-wide Gemini client.
+
+Building a genai.Client per request throws away its connection pool, so every call
+paid for a new TCP + TLS handshake. The API creates one client at startup (see the
+lifespan in main.py), workers create it on first use, and all rephrase/refinement
+calls share its keep-alive pool (HTTP/2 when the h2 package is installed).
+"""
+import importlib.util
+import logging
+
+import httpx
+from google import genai
+from google.genai import types
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+SAFETY_SETTINGS = [
+    types.SafetySetting(category=category, threshold="BLOCK_MEDIUM_AND_ABOVE")
+    for category in (
+        "HARM_CATEGORY_HARASSMENT",
+        "HARM_CATEGORY_HATE_SPEECH",
+        "HARM_CATEGORY_SEXUALLY_EXPLICIT",
+        "HARM_CATEGORY_DANGEROUS_CONTENT",
+    )
+]
+
+
+def _generation_config(temperature: float, max_output_tokens: int) -> types.GenerateContentConfig:
+    return types.GenerateContentConfig(
+        temperature=temperature,
+        candidate_count=1,
+        max_output_tokens=max_output_tokens,
+        thinking_config=types.ThinkingConfig(thinking_budget=0),  # Disable thinking
+        safety_settings=SAFETY_SETTINGS
+    )
+
+
+# Generation configs per mode, built once instead of per request
+GENERATION_CONFIGS = {
+    "refine": _generation_config(temperature=0.1, max_output_tokens=8192),  # Low temperature for factual correction
+    "summarize": _generation_config(temperature=0.3, max_output_tokens=3072),  # Limit output length for summaries
+    "eli5": _generation_config(temperature=0.4, max_output_tokens=3072),  # More creative, simple language
+    "remove_jargon": _generation_config(temperature=0.2, max_output_tokens=4096),  # Accurate simplification
+}
+
+# Same modes, answering with a JSON array of strings so several passages fit in one call
+PACKED_GENERATION_CONFIGS = {
+    mode: config.model_copy(update={
+        "max_output_tokens": 8192,
+        "response_mime_type": "application/json",
+        "response_schema": list[str],
+    })
+    for mode, config in GENERATION_CONFIGS.items()
+    if mode != "refine"
+}
+
+_client: genai.Client | None = None
+
+
+def _http_options() -> types.HttpOptions:
+    # Passing our own transport keeps the SDK on httpx (not aiohttp) with a bounded keep-alive pool
+    transport = httpx.AsyncHTTPTransport(
+        http2=HTTP2_AVAILABLE,
+        limits=httpx.Limits(
+            max_connections=settings.LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.LLM_MAX_CONNECTIONS,
+            keepalive_expiry=settings.LLM_KEEPALIVE_EXPIRY_SECONDS,
+        ),
+    )
+    return types.HttpOptions(async_client_args={"transport": transport})
+
+
+def start_llm_client(api_key: str | None) -> genai.Client | None:
+    """Create the shared client. Without an API key there is nothing to create."""
+    global _client
+    if _client is None and api_key:
+        _client = genai.Client(api_key=api_key, http_options=_http_options())
+        logger.info(f"Created shared Gemini client (HTTP/2: {HTTP2_AVAILABLE}, pool size: {settings.LLM_MAX_CONNECTIONS})")
+    return _client
+
+
+def get_llm_client(api_key: str | None) -> genai.Client | None:
+    """Return the shared client, creating it on first use (e.g. in worker processes)."""
+    return _client or start_llm_client(api_key)
+
+
+async def close_llm_client() -> None:
+    """Close the shared client's connection pool on shutdown."""
+    global _client
+    if _client is not None:
+        await _client.aio.aclose()
+        _client = None
@@ -0,0 +1,285 @@
+"""
+Rate-limit-aware gateway for Gemini calls.
+
+Every text_refiner call goes through generate_content() or stream_content(), which:
+
+- takes requests and estimated tokens from a token bucket in Redis, so the
+  LLM_REQUESTS_PER_MINUTE / LLM_TOKENS_PER_MINUTE quota is shared by all API and
+  worker processes,
+- bounds in-flight calls with an AIMD limit that grows while calls succeed quickly
+  and halves on 429s or slow responses, so throughput settles just under the quota,
+- serves waiting foreground calls (rephrasing, refinement a reader is waiting for)
+  before background ones (refining pages already published as a first view), and
+  keeps one slot of the limit free of background calls,
+- retries 429s and 5xx errors with jittered exponential backoff, honouring
+  Retry-After. A Retry-After also pauses the shared bucket for every process.
+"""
+import asyncio
+import logging
+import random
+import time
+from typing import AsyncIterator
+
+from google.genai import errors, types
+
+from app.core import metrics
+from app.core.config import settings
+from app.core.redis_client import redis_client
+from app.services.llm_client import get_llm_client
+from app.services.markdown_chunker import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+LLM_RATE_LIMIT_DB_PREFIX = "llm_rate_limit:"
+
+# Status codes worth retrying: rate limiting and transient server errors
+RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# Refills both buckets for the time elapsed since the last call, then takes one request
+# and the estimated tokens if both are available. Returns how many milliseconds to wait
+# otherwise (or while a Retry-After pause is in effect).
+TOKEN_BUCKET_SCRIPT = """
+local pause_ms = redis.call('PTTL', KEYS[2])
+if pause_ms > 0 then
+    return pause_ms
+end
+
+local rpm = tonumber(ARGV[1])
+local tpm = tonumber(ARGV[2])
+local cost = math.min(tonumber(ARGV[3]), tpm)
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+
+local state = redis.call('HMGET', KEYS[1], 'requests', 'tokens', 'ts')
+local requests = tonumber(state[1]) or rpm
+local tokens = tonumber(state[2]) or tpm
+local elapsed = math.max(0, now - (tonumber(state[3]) or now))
+requests = math.min(rpm, requests + elapsed * rpm / 60000)
+tokens = math.min(tpm, tokens + elapsed * tpm / 60000)
+
+local wait_ms = 0
+if requests < 1 then
+    wait_ms = math.max(wait_ms, (1 - requests) * 60000 / rpm)
+end
+if tokens < cost then
+    wait_ms = math.max(wait_ms, (cost - tokens) * 60000 / tpm)
+end
+if wait_ms == 0 then
+    requests = requests - 1
+    tokens = tokens - cost
+end
+
+redis.call('HSET', KEYS[1], 'requests', tostring(requests), 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], 120000)
+return math.ceil(wait_ms)
+"""
+
+
+class LLMRateLimitError(Exception):
+    """Gemini kept rejecting a call as rate limited after all retries."""
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Additive-increase / multiplicative-decrease limit on in-flight calls.
+    The limit grows by about one per limit-many fast successes and halves on
+    rate limiting; slow responses shrink it gently. Background calls only start
+    while no foreground call is waiting, and never take the last free slot.
+    """
+
+    def __init__(self, initial: int, minimum: int, maximum: int, latency_target: float):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.latency_target = latency_target
+        self.in_flight = 0
+        self.background_in_flight = 0
+        self.foreground_waiting = 0
+        self._condition = asyncio.Condition()
+
+    def _background_may_start(self) -> bool:
+        return (not self.foreground_waiting and self.in_flight < int(self.limit)
+                and self.background_in_flight < max(1, int(self.limit) - 1))
+
+    async def acquire(self, background: bool = False) -> None:
+        async with self._condition:
+            if background:
+                await self._condition.wait_for(self._background_may_start)
+                self.background_in_flight += 1
+            else:
+                self.foreground_waiting += 1
+                try:
+                    await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+                finally:
+                    self.foreground_waiting -= 1
+                # Background calls held back for this one may go ahead now
+                self._condition.notify_all()
+            self.in_flight += 1
+
+    async def release(self, latency: float | None = None, throttled: bool = False, background: bool = False) -> None:
+        async with self._condition:
+            self.in_flight -= 1
+            if background:
+                self.background_in_flight -= 1
+            if throttled:
+                self.limit = max(self.minimum, self.limit / 2)
+            elif latency is not None and latency > self.latency_target:
+                self.limit = max(self.minimum, self.limit * 0.9)
+            elif latency is not None:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            metrics.set_gauge("llm_concurrency_limit", self.limit)
+            self._condition.notify_all()
+
+
+_limiter: AdaptiveConcurrencyLimiter | None = None
+
+
+def _get_limiter() -> AdaptiveConcurrencyLimiter:
+    # Created lazily so the condition binds to the running event loop
+    global _limiter
+    if _limiter is None:
+        _limiter = AdaptiveConcurrencyLimiter(
+            initial=settings.LLM_INITIAL_CONCURRENCY,
+            minimum=settings.LLM_MIN_CONCURRENCY,
+            maximum=settings.LLM_MAX_CONCURRENCY,
+            latency_target=settings.LLM_LATENCY_TARGET_SECONDS,
+        )
+    return _limiter
+
+
+def estimate_request_tokens(prompt: str, config: types.GenerateContentConfig) -> int:
+    """Rough token cost of a call: the prompt's estimated tokens, plus a similar-sized answer."""
+    prompt_tokens = estimate_tokens(prompt) + 1
+    return prompt_tokens + min(config.max_output_tokens or prompt_tokens, prompt_tokens)
+
+
+async def _take_from_bucket(model: str, tokens: int) -> None:
+    """Wait until the shared bucket has room for one request of the given token cost."""
+    if settings.LLM_REQUESTS_PER_MINUTE <= 0 or settings.LLM_TOKENS_PER_MINUTE <= 0:
+        return
+    bucket_key = f"{LLM_RATE_LIMIT_DB_PREFIX}{model}"
+    while True:
+        try:
+            wait_ms = await redis_client.eval(
+                TOKEN_BUCKET_SCRIPT, 2, bucket_key, f"{bucket_key}:pause",
+                settings.LLM_REQUESTS_PER_MINUTE, settings.LLM_TOKENS_PER_MINUTE, tokens
+            )
+        except Exception as e:
+            # Without Redis only the local concurrency limit applies
+            logger.warning(f"LLM rate limit bucket unavailable: {e}")
+            return
+        if not wait_ms or int(wait_ms) <= 0:
+            return
+        metrics.increment("llm_bucket_waits")
+        await asyncio.sleep(int(wait_ms) / 1000)
+
+
+async def _pause_bucket(model: str, seconds: float) -> None:
+    """Make every process hold off until Gemini's Retry-After has passed."""
+    try:
+        await redis_client.set(f"{LLM_RATE_LIMIT_DB_PREFIX}{model}:pause", "1", px=max(1, int(seconds * 1000)))
+    except Exception as e:
+        logger.warning(f"Could not pause LLM rate limit bucket: {e}")
+
+
+def _retry_after_seconds(error: errors.APIError) -> float | None:
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _backoff_seconds(attempt: int) -> float:
+    # Full jitter keeps retrying processes from hitting the quota in lockstep
+    return random.uniform(0, min(settings.LLM_RETRY_MAX_DELAY_SECONDS, settings.LLM_RETRY_BASE_DELAY_SECONDS * 2 ** attempt))
+
+
+async def _retry_delay(error: errors.APIError, model: str, attempt: int) -> float:
+    """Seconds to wait before retrying a failed call. Re-raises errors that shouldn't be retried."""
+    throttled = error.code == 429
+    if error.code not in RETRYABLE_STATUS_CODES:
+        raise error
+    metrics.increment("llm_throttled_calls" if throttled else "llm_server_errors")
+
+    retry_after = _retry_after_seconds(error)
+    if retry_after is not None:
+        await _pause_bucket(model, retry_after)
+    if attempt == settings.LLM_MAX_RETRIES:
+        if throttled:
+            raise LLMRateLimitError(f"Gemini rate limit persisted after {attempt + 1} attempts") from error
+        raise error
+    delay = retry_after if retry_after is not None else _backoff_seconds(attempt)
+    logger.warning(f"Gemini call failed with {error.code}, retrying in {delay:.1f}s (attempt {attempt + 1})")
+    return delay
+
+
+async def generate_content(model: str, prompt: str, config: types.GenerateContentConfig,
+                           api_key: str | None, background: bool = False) -> types.GenerateContentResponse:
+    """
+    Call Gemini through the shared rate limits, retrying throttled and transient failures.
+    Background calls yield to foreground ones (see AdaptiveConcurrencyLimiter).
+    """
+    client = get_llm_client(api_key)
+    limiter = _get_limiter()
+    tokens = estimate_request_tokens(prompt, config)
+
+    for attempt in range(settings.LLM_MAX_RETRIES + 1):
+        await _take_from_bucket(model, tokens)
+        await limiter.acquire(background)
+        started = time.monotonic()
+        try:
+            response = await client.aio.models.generate_content(model=model, contents=prompt, config=config)
+        except errors.APIError as e:
+            await limiter.release(throttled=e.code == 429, background=background)
+            await asyncio.sleep(await _retry_delay(e, model, attempt))
+            continue
+        except BaseException:
+            await limiter.release(background=background)
+            raise
+
+        await limiter.release(latency=time.monotonic() - started, background=background)
+        metrics.increment("llm_calls")
+        return response
+
+
+async def stream_content(model: str, prompt: str, config: types.GenerateContentConfig,
+                         api_key: str | None) -> AsyncIterator[str]:
+    """
+    Stream a Gemini completion as text chunks through the shared rate limits.
+    Failures before the first chunk are retried like generate_content(); once text
+    has been yielded the error is raised to the caller.
+    """
+    client = get_llm_client(api_key)
+    limiter = _get_limiter()
+    tokens = estimate_request_tokens(prompt, config)
+
+    for attempt in range(settings.LLM_MAX_RETRIES + 1):
+        await _take_from_bucket(model, tokens)
+        await limiter.acquire()
+        started = time.monotonic()
+        first_chunk_latency = None
+        try:
+            async for chunk in await client.aio.models.generate_content_stream(model=model, contents=prompt, config=config):
+                text = chunk.text
+                if not text:
+                    continue
+                if first_chunk_latency is None:
+                    # Time to first chunk is the latency signal; total time grows with output length
+                    first_chunk_latency = time.monotonic() - started
+                yield text
+        except errors.APIError as e:
+            await limiter.release(throttled=e.code == 429)
+            if first_chunk_latency is not None:
+                raise
+            await asyncio.sleep(await _retry_delay(e, model, attempt))
+            continue
+        except BaseException:
+            # Includes the consumer closing the stream early (client disconnects)
+            await limiter.release()
+            raise
+
+        await limiter.release(latency=first_chunk_latency)
+        metrics.increment("llm_calls")
+        return
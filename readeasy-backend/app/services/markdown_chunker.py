@@ -0,0 +1,207 @@
+"""
+Structure-aware chunking of page markdown for refinement.
+
+Refinement output is capped at max_output_tokens, and the refined page is about as
+long as the input, so dense pages (large tables, two-column papers) get truncated.
+Oversized pages are split into chunks at heading and paragraph boundaries, refined
+separately and stitched back in order (see stitch_chunks). Fenced code, display math and
+lines (which carry inline image tags and math) are never split. Tables too big for one
+chunk are split between rows, and every part repeats the header row.
+"""
+import re
+
+HEADING_PATTERN = re.compile(r"^#{1,6}\s")
+TABLE_ROW_PATTERN = re.compile(r"^\s*\|")
+TABLE_SEPARATOR_PATTERN = re.compile(r"^\s*\|?\s*:?-+:?\s*(\|\s*:?-+:?\s*)*\|?\s*$")
+FENCE_PATTERN = re.compile(r"^\s*(```|~~~)")
+
+# Display math delimiters: opening line pattern -> closing line pattern
+MATH_BLOCK_DELIMITERS = (
+    (re.compile(r"^\s*\$\$"), re.compile(r"\$\$\s*$")),
+    (re.compile(r"^\s*\\\["), re.compile(r"\\\]\s*$")),
+    (re.compile(r"^\s*\\begin\{"), re.compile(r"\\end\{[^}]*\}\s*$")),
+)
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Rough token count without a tokenizer: about 4 characters per token for prose,
+    with a floor of ~1.3 tokens per word plus half a token per symbol for markup-heavy text.
+    """
+    words = len(text.split())
+    symbols = len(re.findall(r"[|$\\{}_^#*\[\]()<>-]", text))
+    return max(len(text) // 4, int(words * 1.3) + symbols // 2)
+
+
+def _closing_pattern(line: str) -> re.Pattern | None:
+    for opening, closing in MATH_BLOCK_DELIMITERS:
+        if opening.match(line):
+            # Single-line display math ($$x$$) closes on the same line
+            rest = opening.sub("", line, count=1)
+            return None if closing.search(rest) else closing
+    return None
+
+
+def split_markdown_blocks(markdown: str) -> list[tuple[int, int, str]]:
+    """
+    Split markdown into blocks that must stay intact: paragraphs, headings (with the
+    text up to the next blank line), tables, fenced code and display math. Returns
+    (first line, end line, kind) ranges over markdown.split("\\n"); kind is "table" for
+    tables and "text" otherwise. Blank lines belong to no block.
+    """
+    blocks = []
+    start = None
+
+    def flush(end: int):
+        nonlocal start
+        if start is not None:
+            blocks.append((start, end, "text"))
+            start = None
+
+    lines = markdown.split("\n")
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+
+        if FENCE_PATTERN.match(line):
+            flush(i)
+            fence = FENCE_PATTERN.match(line).group(1)
+            first = i
+            i += 1
+            while i < len(lines):
+                i += 1
+                if lines[i - 1].strip().startswith(fence):
+                    break
+            blocks.append((first, i, "text"))
+            continue
+
+        closing = _closing_pattern(line)
+        if closing is not None:
+            flush(i)
+            first = i
+            i += 1
+            while i < len(lines):
+                i += 1
+                if closing.search(lines[i - 1]):
+                    break
+            blocks.append((first, i, "text"))
+            continue
+
+        if TABLE_ROW_PATTERN.match(line):
+            flush(i)
+            first = i
+            while i < len(lines) and TABLE_ROW_PATTERN.match(lines[i]):
+                i += 1
+            blocks.append((first, i, "table"))
+            continue
+
+        if not line.strip():
+            flush(i)
+        else:
+            if HEADING_PATTERN.match(line):
+                flush(i)
+            if start is None:
+                start = i
+        i += 1
+
+    flush(len(lines))
+    return blocks
+
+
+def _table_header_length(rows: list[str]) -> int:
+    """Number of leading rows that form the table's header: the header row and its separator."""
+    return 2 if len(rows) > 2 and TABLE_SEPARATOR_PATTERN.match(rows[1]) else 0
+
+
+def _split_table(rows: list[str], max_tokens: int) -> list[list[str]]:
+    """Split table rows into parts of at most max_tokens (estimated), each starting with the header."""
+    header = rows[:_table_header_length(rows)]
+    parts = []
+    current: list[str] = []
+    for row in rows[len(header):]:
+        # A part always gets at least one row, even if that row alone is over the limit
+        if current and estimate_tokens("\n".join(header + current + [row])) > max_tokens:
+            parts.append(header + current)
+            current = []
+        current.append(row)
+    parts.append(header + current)
+    return parts
+
+
+def chunk_markdown(markdown: str, max_tokens: int) -> list[str]:
+    """
+    Group blocks into chunks of at most max_tokens (estimated), preferring to start a
+    new chunk at a heading once the current one is half full. Tables over max_tokens are
+    split between rows with the header repeated; any other block over max_tokens becomes
+    a chunk of its own rather than being cut. Blank lines between blocks stay at the end
+    of the chunk before them, so stitch_chunks() puts the original document back together.
+    """
+    if estimate_tokens(markdown) <= max_tokens:
+        return [markdown]
+
+    lines = markdown.split("\n")
+    blocks = split_markdown_blocks(markdown)
+    # (lines, estimated tokens, whether it must start a chunk); each unit runs up to the
+    # next block, so it carries the blank lines after it
+    units = []
+    for position, (first, end, kind) in enumerate(blocks):
+        unit_start = 0 if position == 0 else first
+        unit_end = blocks[position + 1][0] if position + 1 < len(blocks) else len(lines)
+        block_tokens = estimate_tokens("\n".join(lines[first:end]))
+        if kind == "table" and block_tokens > max_tokens:
+            parts = _split_table(lines[first:end], max_tokens)
+            parts[0] = lines[unit_start:first] + parts[0]
+            parts[-1] = parts[-1] + lines[end:unit_end]
+            units.extend((part, estimate_tokens("\n".join(part)), index > 0) for index, part in enumerate(parts))
+        else:
+            units.append((lines[unit_start:unit_end], block_tokens, False))
+
+    chunks = []
+    current: list[str] = []
+    current_tokens = 0
+    ends_on_heading = False
+    for unit_lines, unit_tokens, starts_chunk in units:
+        starts_section = bool(HEADING_PATTERN.match(unit_lines[0]))
+        # Never end a chunk on a heading; it belongs with the text that follows
+        if current and (starts_chunk or not ends_on_heading and (
+            current_tokens + unit_tokens > max_tokens
+            or (starts_section and current_tokens >= max_tokens // 2)
+        )):
+            chunks.append("\n".join(current))
+            current, current_tokens = [], 0
+        current.extend(unit_lines)
+        current_tokens += unit_tokens
+        ends_on_heading = starts_section and not any(line.strip() for line in unit_lines[1:])
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+def _repeated_table_header(text: str, chunk: str) -> str | None:
+    """The header lines chunk repeats from a table that text ends with, if it continues that table."""
+    chunk_rows = chunk.split("\n")
+    if _table_header_length(chunk_rows) == 0 or text.endswith("\n\n"):
+        return None
+    text_rows = text.rstrip("\n").split("\n")
+    table_start = len(text_rows)
+    while table_start > 0 and TABLE_ROW_PATTERN.match(text_rows[table_start - 1]):
+        table_start -= 1
+    if text_rows[table_start:table_start + 2] != chunk_rows[:2]:
+        return None
+    return "\n".join(chunk_rows[:2]) + "\n"
+
+
+def stitch_chunks(chunks: list[str]) -> str:
+    """
+    Join chunks (as returned by chunk_markdown, or refined versions of them) back into one
+    document, dropping the header rows repeated at the start of each part of a split table.
+    """
+    text = ""
+    for chunk in chunks:
+        if text:
+            header = _repeated_table_header(text, chunk)
+            if header:
+                chunk = chunk[len(header):]
+            text += "\n"
+        text += chunk
+    return text
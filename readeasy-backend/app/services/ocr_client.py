@@ -0,0 +1,73 @@
+"""
+Non-blocking client for the Mistral OCR API.
+"""
+import asyncio
+import logging
+
+from mistralai import Mistral
+from mistralai.models import OCRResponse
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+OCR_MODEL = "mistral-ocr-latest"
+
+
+class MistralOCRClient:
+    """
+    Wraps the async half of the Mistral SDK so OCR work never runs on the event loop thread.
+    Every SDK call is gated by a shared semaphore, which caps the number of concurrent
+    requests this process makes against the OCR service.
+    """
+
+    def __init__(self, api_key: str, max_concurrency: int = 4):
+        self.client = Mistral(api_key=api_key)
+        self._semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def upload(self, file_name: str, content) -> str:
+        """Upload a document for OCR and return its Mistral file ID."""
+        async with self._semaphore:
+            uploaded_pdf = await self.client.files.upload_async(
+                file={
+                    "file_name": file_name,
+                    "content": content
+                },
+                purpose="ocr"
+            )
+        return uploaded_pdf.id
+
+    async def get_signed_url(self, file_id: str) -> str:
+        """Get a signed URL the OCR service can read the uploaded file from."""
+        async with self._semaphore:
+            signed_url_response = await self.client.files.get_signed_url_async(file_id=file_id)
+        return signed_url_response.url
+
+    async def process(self, document_url: str) -> OCRResponse:
+        """Run OCR over the document behind document_url, including page images."""
+        async with self._semaphore:
+            return await self.client.ocr.process_async(
+                model=OCR_MODEL,
+                document={
+                    "type": "document_url",
+                    "document_url": document_url
+                },
+                include_image_base64=True
+            )
+
+    async def delete(self, file_id: str) -> None:
+        """Delete an uploaded file from Mistral storage."""
+        async with self._semaphore:
+            await self.client.files.delete_async(file_id=file_id)
+
+
+# Ensure API key is loaded via settings
+if not settings.MISTRAL_API_KEY:
+    print("WARNING: MISTRAL_API_KEY not found in environment/config.")
+    # Optionally raise an error or handle appropriately
+
+# Shared client so the concurrency limit applies to every job in this process
+ocr_client = MistralOCRClient(
+    api_key=settings.MISTRAL_API_KEY,
+    max_concurrency=settings.OCR_MAX_CONCURRENCY
+)
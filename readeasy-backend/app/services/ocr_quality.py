@@ -0,0 +1,141 @@
+"""
+Cheap local quality score for OCR markdown.
+
+Mistral OCR gets most pages right, so sending every page to Gemini for refinement
+mostly pays for no-op rewrites. The scorer looks for the errors refinement exists to
+fix, namely words split by stray spaces ("Che tsheet", "Tr nsformers"), tokens that
+can't be English words, tokenizer debris such as [UNK] or <pad>, and broken tables.
+It runs on the markdown as returned by OCR, before fix_markdown_tables repairs the
+tables. Only pages scoring at or above OCR_REFINEMENT_THRESHOLD go to the LLM; the
+default threshold separates the labelled pages in tests/fixtures/ocr_pages.
+"""
+import re
+
+# Tokenizer/model debris that never belongs in a page
+DEBRIS_PATTERN = re.compile(r"\[(?:UNK|PAD|CLS|SEP|MASK)\]|<(?:unk|pad|think|internal|unknown)>|�", re.IGNORECASE)
+
+# Content the word checks shouldn't look at: math, images, links, code and HTML tags
+MATH_PATTERN = re.compile(r"\$\$.*?\$\$|\$[^$\n]+\$|\\\(.*?\\\)|\\\[.*?\\\]", re.DOTALL)
+IMAGE_OR_LINK_PATTERN = re.compile(r"!?\[([^\]]*)\]\([^)]*\)")
+CODE_PATTERN = re.compile(r"```.*?```|`[^`\n]*`", re.DOTALL)
+URL_PATTERN = re.compile(r"https?://\S+|www\.\S+")
+HTML_TAG_PATTERN = re.compile(r"</?[a-zA-Z][^>]*>")
+# Dotted abbreviations such as e.g., i.e. and s.d.
+DOTTED_ABBREVIATION_PATTERN = re.compile(r"\b(?:[A-Za-z]\.){2,}")
+
+# Words standing on their own; tokens glued to digits, underscores or hyphens (x_i, 3e-4,
+# ConvS2S, 10ms, i-th) are identifiers, numbers or compounds rather than OCR'd words
+WORD_PATTERN = re.compile(r"(?<![\w-])[A-Za-z]+(?:'[A-Za-z]+)?(?![\w-])")
+VOWEL_PATTERN = re.compile(r"[aeiouyAEIOUY]")
+
+# Short words that are fine on their own; any other 1-2 letter fragment is likely a split word
+SHORT_WORDS = {
+    "a", "i", "am", "an", "as", "at", "be", "by", "do", "go", "he", "if", "in", "is", "it",
+    "me", "my", "no", "of", "oh", "ok", "on", "or", "so", "to", "up", "us", "we", "vs", "eg",
+    "ie", "et", "al", "de", "la", "le", "ex", "id", "pi", "mu", "nu", "xi",
+}
+# Abbreviations, units and math operators that don't look like words, compared in lower case
+ABBREVIATIONS = {
+    "cf", "eq", "pp", "sd", "st", "nd", "rd", "th", "dr", "mr", "mrs", "jr", "sr", "nth", "ctrl",
+    "std", "sqrt", "min", "max", "log", "ln", "lg", "exp", "sin", "cos", "tan", "det", "tr",
+    "lim", "sup", "inf", "arg", "argmax", "argmin", "mod", "gcd", "lcm", "mm", "cm", "km",
+    "um", "nm", "mg", "kg", "ug", "ng", "ml", "ul", "mol", "rpm", "hz", "khz", "mhz", "ghz",
+    "db", "ms", "ns", "us", "ps", "kw", "mw", "kb", "mb", "gb", "tb", "ev", "kev", "mev",
+    "ph", "dna", "rna", "mrna",
+}
+# Word endings that only show up on their own when a word was split before them ("sim ple")
+SPLIT_SUFFIXES = {
+    "tion", "tions", "sion", "sions", "ment", "ments", "ness", "ity", "ous", "ble", "ple",
+    "ing", "ings", "ture", "ance", "ence", "ize", "izes", "ized", "ical", "ally", "ful",
+}
+# Consonant clusters English words start with; others (e.g. "tsh" in "tsheet") suggest a split word
+VALID_ONSETS = {
+    "bl", "br", "ch", "cl", "cr", "dr", "dw", "fl", "fr", "gh", "gl", "gn", "gr", "kl", "kn",
+    "kr", "ph", "pl", "pn", "pr", "ps", "qu", "rh", "sc", "sh", "sk", "sl", "sm", "sn", "sp",
+    "sq", "st", "sv", "sw", "th", "tr", "ts", "tw", "wh", "wr", "sch", "scr", "shr", "sph",
+    "spl", "spr", "squ", "str", "thr", "chr",
+}
+VOWELS = set("aeiouy")
+
+
+def _prose(markdown: str) -> str:
+    text = CODE_PATTERN.sub(" ", markdown)
+    text = MATH_PATTERN.sub(" ", text)
+    text = DOTTED_ABBREVIATION_PATTERN.sub(" ", text)
+    text = IMAGE_OR_LINK_PATTERN.sub(r" \1 ", text)
+    text = URL_PATTERN.sub(" ", text)
+    return HTML_TAG_PATTERN.sub(" ", text)
+
+
+def _is_suspicious_word(word: str) -> bool:
+    lower = word.lower()
+    if len(word) == 1 or lower in ABBREVIATIONS:
+        # Single letters are variables (x, W, k) as often as words
+        return False
+    if lower in SPLIT_SUFFIXES:
+        return True
+    if (word.isupper() or (word[:-1].isupper() and word[-1] == "s")) and len(word) <= 7:
+        # Acronyms (CPU, HTTP, GPUs) are fine without vowels
+        return False
+    if len(word) <= 2:
+        return lower not in SHORT_WORDS
+    if not VOWEL_PATTERN.search(word):
+        return True
+    if re.search(r"(.)\1\1", lower):
+        return True
+    if any(c.isupper() for c in word[1:]) and not word.isupper() and not word[1:].islower():
+        # Mixed case inside a word (e.g. "cHeat"), but allow CamelCase identifiers like "PyTorch"
+        return not re.fullmatch(r"(?:[A-Z][a-z]+)+", word)
+    onset = ""
+    for char in lower:
+        if char in VOWELS:
+            break
+        onset += char
+    return len(onset) >= 2 and onset not in VALID_ONSETS
+
+
+def _has_malformed_table(markdown: str) -> bool:
+    lines = markdown.splitlines()
+    i = 0
+    while i < len(lines):
+        if not lines[i].strip().startswith("|"):
+            i += 1
+            continue
+        table = []
+        while i < len(lines) and lines[i].strip().startswith("|"):
+            table.append(lines[i].strip())
+            i += 1
+        if len(table) < 2:
+            continue
+        # The second row must be a separator, and every row needs the same number of cells
+        if not re.fullmatch(r"\|?\s*:?-{3,}:?\s*(\|\s*:?-{3,}:?\s*)*\|?", table[1]):
+            return True
+        cell_counts = {len(row.strip("|").split("|")) for row in table}
+        if len(cell_counts) > 1:
+            return True
+    return False
+
+
+def score_ocr_markdown(markdown: str) -> float:
+    """
+    Likelihood that a page has OCR errors worth refining, from 0 (clean) to 1.
+    Debris tokens and malformed tables score 1; otherwise the score is the share of
+    words that look split or misspelled.
+    """
+    if not markdown or not markdown.strip():
+        return 0.0
+    if DEBRIS_PATTERN.search(markdown) or _has_malformed_table(markdown):
+        return 1.0
+
+    words = WORD_PATTERN.findall(_prose(markdown))
+    if not words:
+        return 0.0
+    suspicious = sum(1 for word in words if _is_suspicious_word(word))
+    return suspicious / len(words)
+
+
+def needs_refinement(markdown: str, threshold: float) -> bool:
+    """Whether a page should go to the LLM. A threshold of 0 or less refines every page."""
+    if threshold <= 0:
+        return True
+    return score_ocr_markdown(markdown) >= threshold
@@ -1,25 +1,163 @@
-from PyPDF2 import PdfReader
+from PyPDF2 import PdfReader, PdfWriter
 from fastapi import UploadFile
 import io
+import logging
+import re
 
-def extract_text_from_pdf(file_content: bytes) -> list[dict[str, any]]:
-    """Extracts text from each page of a PDF file content."""
-    pages_data = []
+logger = logging.getLogger(__name__)
+
+def count_pdf_pages(file_path) -> int:
+    """Counts the pages of a PDF on disk without loading the whole file into memory."""
+    with open(file_path, "rb") as pdf_file:
+        return len(PdfReader(pdf_file).pages)
+
+def chunk_page_indices(page_indices: list[int], pages_per_chunk: int) -> list[list[int]]:
+    """Splits page indices into consecutive chunks of at most pages_per_chunk pages."""
+    if pages_per_chunk <= 0 or len(page_indices) <= pages_per_chunk:
+        return [list(page_indices)]
+    return [page_indices[i:i + pages_per_chunk] for i in range(0, len(page_indices), pages_per_chunk)]
+
+def extract_pdf_pages(file_path, page_indices: list[int]) -> bytes:
+    """Builds a sub-document from the given pages of a PDF on disk."""
+    with open(file_path, "rb") as pdf_file:
+        reader = PdfReader(pdf_file)
+        writer = PdfWriter()
+        for page_index in page_indices:
+            writer.add_page(reader.pages[page_index])
+        buffer = io.BytesIO()
+        writer.write(buffer)
+    return buffer.getvalue()
+
+# --- Text layer fast path ---
+BULLET_PATTERN = re.compile(r"^[•▪●◦‣∙·\-\*–]\s+")
+NUMBERED_ITEM_PATTERN = re.compile(r"^\(?\d{1,3}[.)]\s+")
+NUMERIC_TOKEN_PATTERN = re.compile(r"^[-+±(]?[$€£]?\d[\d.,]*%?\)?$")
+MATH_CHARS = frozenset("∑∏∫∮√∞∂∇±∓×÷≤≥≠≈≡∝∈∉⊂⊃⊆⊇∪∩∀∃→←↔⇒⇔αβγδεζηθλμνξπρστφχψωΓΔΘΛΞΠΣΦΨΩ")
+
+def page_has_images(page) -> bool:
+    """Whether a page draws image or form XObjects, whose content a text layer can't represent."""
+    resources = page.get("/Resources")
+    if resources is None:
+        return False
+    xobjects = resources.get_object().get("/XObject")
+    if not xobjects:
+        return False
+    for xobject in xobjects.get_object().values():
+        if xobject.get_object().get("/Subtype") in ("/Image", "/Form"):
+            return True
+    return False
+
+def is_text_layer_usable(text: str, min_chars: int = 200) -> bool:
+    """
+    Heuristic check that an embedded text layer is a faithful, readable copy of the page.
+
+    Rejects pages with too little text (likely scanned), replacement characters (broken
+    font encodings), mostly non-word tokens, letter-spaced extraction ("T r a n s") and
+    run-together words (missing spaces).
+    """
+    stripped = text.strip() if text else ""
+    if len(stripped) < min_chars:
+        return False
+    if stripped.count("\ufffd") > len(stripped) * 0.001:
+        return False
+
+    printable = sum(1 for char in stripped if char.isprintable() or char.isspace())
+    if printable / len(stripped) < 0.98:
+        return False
+
+    words = stripped.split()
+    word_like = sum(1 for word in words if any(char.isalpha() for char in word))
+    if word_like / len(words) < 0.6:
+        return False
+    single_letters = sum(1 for word in words if len(word) == 1 and word.isalpha())
+    if single_letters / len(words) > 0.25:
+        return False
+    average_word_length = sum(len(word) for word in words) / len(words)
+    return 2.5 <= average_word_length <= 12
+
+def is_equation_line(line: str) -> bool:
+    """A line of mostly operators, sub/superscripted and one- or two-character tokens, e.g. "f(x) = a x^2 + b"."""
+    tokens = line.split()
+    if len(tokens) < 3 or not any(char in "=^_" or char in MATH_CHARS for char in line):
+        return False
+    symbolic = sum(
+        1 for token in tokens
+        if len(token) <= 2 or any(char in "=^_/" or char in MATH_CHARS for char in token)
+    )
+    return symbolic / len(tokens) >= 0.5
+
+def text_layer_loses_structure(text: str) -> bool:
+    """
+    Whether a page has layout that extracted text flattens but OCR keeps as markdown:
+    tables (rows of numeric columns, or cells extracted as many very short lines) and
+    math (equation lines or math glyphs, which OCR returns as LaTeX).
+    """
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    if not lines:
+        return False
+    numeric_rows = sum(
+        1 for line in lines
+        if sum(1 for token in line.split() if NUMERIC_TOKEN_PATTERN.match(token)) >= 3
+    )
+    if numeric_rows >= 3:
+        return True
+    if sum(1 for line in lines if is_equation_line(line)) >= 2:
+        return True
+    if sum(1 for char in text if char in MATH_CHARS) >= 5:
+        return True
+    short_lines = sum(1 for line in lines if len(line.split()) <= 2)
+    return len(lines) >= 8 and short_lines / len(lines) > 0.35
+
+def text_layer_to_markdown(text: str) -> str:
+    """Converts extracted page text to markdown: reflows wrapped lines, keeps list items, de-hyphenates."""
+    blocks = []
+    paragraph = []
+
+    def flush_paragraph():
+        if paragraph:
+            blocks.append(" ".join(paragraph))
+            paragraph.clear()
+
+    for raw_line in text.splitlines():
+        line = raw_line.strip()
+        if not line:
+            flush_paragraph()
+            continue
+        if BULLET_PATTERN.match(line):
+            flush_paragraph()
+            blocks.append("- " + BULLET_PATTERN.sub("", line))
+            continue
+        if NUMBERED_ITEM_PATTERN.match(line):
+            flush_paragraph()
+            blocks.append(line)
+            continue
+        if paragraph and paragraph[-1].endswith("-") and line[:1].islower():
+            # Re-join a word hyphenated across a line break
+            paragraph[-1] = paragraph[-1][:-1] + line
+            continue
+        paragraph.append(line)
+    flush_paragraph()
+
+    return "\n\n".join(blocks)
+
+def extract_text_layer_pages(file_path, min_chars: int = 200) -> dict[int, str]:
+    """
+    Returns {page index: markdown} for the pages of a PDF whose embedded text layer is good
+    enough to use instead of OCR. Pages missing from the result need OCR, including
+    born-digital pages with tables or math, which OCR turns into markdown tables and LaTeX.
+    """
+    text_layer_pages = {}
     try:
-        reader = PdfReader(io.BytesIO(file_content))
-        num_pages = len(reader.pages)
-        for i in range(num_pages):
-            page = reader.pages[i]
-            text = page.extract_text()
-            if text: # Only add pages with extracted text
-                pages_data.append({
-                    "page_number": i + 1,
-                    "original_text": text,
-                    "images": [] # Placeholder for image extraction logic
-                })
+        with open(file_path, "rb") as pdf_file:
+            reader = PdfReader(pdf_file)
+            for page_index, page in enumerate(reader.pages):
+                if page_has_images(page):
+                    continue
+                text = page.extract_text()
+                if is_text_layer_usable(text, min_chars=min_chars) and not text_layer_loses_structure(text):
+                    text_layer_pages[page_index] = text_layer_to_markdown(text)
     except Exception as e:
-        print(f"Error reading PDF: {e}")
-        # Depending on requirements, you might want to raise an exception here
-        # raise HTTPException(status_code=400, detail="Could not process PDF file.")
-        pass # Or return partial data / empty list
-    return pages_data 
\ No newline at end of file
+        # Any problem reading the text layer just means every page goes through OCR
+        logger.warning(f"Error reading PDF text layer: {e}")
+        return {}
+    return text_layer_pages
@@ -0,0 +1,145 @@
+"""
+Cache of Gemini refinement results.
+
+Entries are keyed by a hash of the input markdown, the document context, the model
+name and the prompt version, so editing the prompt template or switching models
+invalidates old entries automatically. Saved images get a fresh filename every time a
+document is processed, so image targets are replaced by numbered placeholders in both
+the key and the cached refinement, and put back from the current page on a hit. Lookups go through a small in-process LRU
+(bounded by REFINEMENT_CACHE_LOCAL_MAX_BYTES) before Redis, where entries live for
+REFINEMENT_CACHE_TTL_SECONDS and are shared by every API and worker process.
+"""
+import hashlib
+import logging
+import re
+import threading
+from collections import OrderedDict
+
+from app.core import metrics
+from app.core.config import settings
+from app.core.redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+REFINEMENT_CACHE_DB_PREFIX = "refinement_cache:"
+
+# ![alt](target): the target is captured so it can be swapped for a placeholder
+IMAGE_TARGET_PATTERN = re.compile(r"(!\[[^\]]*\]\()([^)\s]+)(\))")
+IMAGE_PLACEHOLDER_PREFIX = "cached-image-"
+
+
+def prompt_version(prompt_template: str) -> str:
+    """Short hash of a prompt template; changes whenever the template does."""
+    return hashlib.sha256(prompt_template.encode("utf-8")).hexdigest()[:12]
+
+
+def image_targets(markdown_content: str) -> list[str]:
+    """Distinct image targets of the markdown, in order of first appearance."""
+    return list(dict.fromkeys(match.group(2) for match in IMAGE_TARGET_PATTERN.finditer(markdown_content)))
+
+
+def replace_image_targets(markdown_content: str, replacements: dict[str, str]) -> str:
+    """Swaps the image targets found in replacements, leaving other targets alone."""
+    return IMAGE_TARGET_PATTERN.sub(
+        lambda match: f"{match.group(1)}{replacements.get(match.group(2), match.group(2))}{match.group(3)}",
+        markdown_content
+    )
+
+
+def image_placeholders(targets: list[str]) -> dict[str, str]:
+    """Placeholder for each image target, numbered by position so any page with as many images shares them."""
+    return {target: f"{IMAGE_PLACEHOLDER_PREFIX}{position}" for position, target in enumerate(targets)}
+
+
+def refinement_cache_key(markdown_content: str, context: str, model_name: str, version: str) -> str:
+    digest = hashlib.sha256()
+    for part in (model_name, version, context, markdown_content):
+        # Length-prefix each part so different splits of the same text can't collide
+        encoded = part.encode("utf-8")
+        digest.update(f"{len(encoded)}:".encode("utf-8"))
+        digest.update(encoded)
+    return digest.hexdigest()
+
+
+class LocalLRUCache:
+    """Thread-safe LRU of strings bounded by the total UTF-8 size of the stored values."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self._entries: OrderedDict[str, str] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        value_size = len(value.encode("utf-8"))
+        if value_size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size_bytes -= len(previous.encode("utf-8"))
+            self._entries[key] = value
+            self.size_bytes += value_size
+            while self.size_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size_bytes -= len(evicted.encode("utf-8"))
+
+
+_local_cache = LocalLRUCache(settings.REFINEMENT_CACHE_LOCAL_MAX_BYTES)
+
+
+def _record_hit(markdown_content: str, refined_markdown: str, tier: str) -> None:
+    metrics.increment("refinement_cache_hits")
+    metrics.increment(f"refinement_cache_{tier}_hits")
+    # Bytes that didn't have to travel to and from Gemini
+    metrics.increment(
+        "refinement_cache_bytes_saved",
+        len(markdown_content.encode("utf-8")) + len(refined_markdown.encode("utf-8"))
+    )
+
+
+async def get_cached_refinement(key: str, markdown_content: str) -> str | None:
+    """Return the cached refinement for key, checking the local tier before Redis."""
+    if not settings.REFINEMENT_CACHE_ENABLED:
+        return None
+
+    refined_markdown = _local_cache.get(key)
+    if refined_markdown is not None:
+        _record_hit(markdown_content, refined_markdown, "local")
+        return refined_markdown
+
+    try:
+        refined_markdown = await redis_client.get(f"{REFINEMENT_CACHE_DB_PREFIX}{key}")
+    except Exception as e:
+        # The cache is an optimisation; a Redis outage must not fail refinement
+        logger.warning(f"Refinement cache lookup failed: {e}")
+        refined_markdown = None
+
+    if refined_markdown is None:
+        metrics.increment("refinement_cache_misses")
+        return None
+
+    _local_cache.set(key, refined_markdown)
+    _record_hit(markdown_content, refined_markdown, "redis")
+    return refined_markdown
+
+
+async def save_refinement(key: str, refined_markdown: str) -> None:
+    """Store a successful refinement in both tiers."""
+    if not settings.REFINEMENT_CACHE_ENABLED:
+        return
+
+    _local_cache.set(key, refined_markdown)
+    try:
+        await redis_client.set(
+            f"{REFINEMENT_CACHE_DB_PREFIX}{key}", refined_markdown, ex=settings.REFINEMENT_CACHE_TTL_SECONDS
+        )
+    except Exception as e:
+        logger.warning(f"Could not store refinement in cache: {e}")
@@ -0,0 +1,109 @@
+"""
+Batch rephrasing for POST /process/rephrase/batch.
+
+Items are deduplicated by their rephrase cache key, answered from the cache where
+possible, and otherwise run concurrently under the shared Gemini limits (see
+llm_gateway). Short passages with the same mode and document type are packed into
+a single structured-output call; anything that can't be packed, or whose packed call
+fails, goes through coalesced_rephrase on its own. Cache hits and misses are counted
+once per unique item, where the cache is checked.
+"""
+import asyncio
+import logging
+from typing import AsyncIterator, Awaitable, Callable
+
+import redis.asyncio as redis
+
+from app.core import metrics
+from app.services.rephrase_cache import rephrase_cache_key, load_cached_rephrase, save_rephrase, coalesced_rephrase
+from app.services.text_refiner import rephrase_packed
+
+logger = logging.getLogger(__name__)
+
+# Passages up to this many characters are candidates for packing into a shared call
+PACK_MAX_CHARS = 800
+# Upper bound of passages per packed call, keeping the JSON answer well within the output limit
+PACK_MAX_ITEMS = 6
+
+
+async def _rephrase_single(r: redis.Redis, key: str, item: dict,
+                           rephrase_functions: dict[str, Callable[..., Awaitable[str]]]) -> list[tuple[str, str | None]]:
+    try:
+        rephrased_text = await coalesced_rephrase(
+            r, key, item["mode"], item["text_content"], item["document_type"], rephrase_functions[item["mode"]]
+        )
+        return [(key, rephrased_text)]
+    except Exception as e:
+        logger.error(f"Error rephrasing batch item: {e}")
+        return [(key, None)]
+
+
+async def _rephrase_pack(r: redis.Redis, pack: list[tuple[str, dict]],
+                         rephrase_functions: dict[str, Callable[..., Awaitable[str]]]) -> list[tuple[str, str | None]]:
+    mode, document_type = pack[0][1]["mode"], pack[0][1]["document_type"]
+    rephrased_texts = await rephrase_packed([item["text_content"] for _, item in pack], mode, context=document_type)
+    if rephrased_texts is None:
+        metrics.increment("rephrase_pack_fallbacks")
+        results = await asyncio.gather(*(_rephrase_single(r, key, item, rephrase_functions) for key, item in pack))
+        return [result for item_results in results for result in item_results]
+
+    metrics.increment("rephrase_packed_calls")
+    for (key, item), rephrased_text in zip(pack, rephrased_texts):
+        await save_rephrase(r, key, item["text_content"], rephrased_text)
+    return [(key, rephrased_text) for (key, _), rephrased_text in zip(pack, rephrased_texts)]
+
+
+async def run_rephrase_batch(r: redis.Redis, items: list[dict],
+                             rephrase_functions: dict[str, Callable[..., Awaitable[str]]]) -> AsyncIterator[dict]:
+    """
+    Rephrase items ({text_content, mode, document_type}) and yield
+    {"index", "mode", "rephrased_text"} (or {"index", "mode", "error"}) per item as
+    soon as its result is available. Duplicate items share one result.
+    """
+    indices_by_key: dict[str, list[int]] = {}
+    unique_items: dict[str, dict] = {}
+    for index, item in enumerate(items):
+        key = rephrase_cache_key(item["mode"], item["document_type"], item["text_content"])
+        indices_by_key.setdefault(key, []).append(index)
+        unique_items.setdefault(key, item)
+
+    def results_for(key: str, rephrased_text: str | None) -> list[dict]:
+        if rephrased_text is None:
+            result = {"error": "Error rephrasing text. Please try again."}
+        else:
+            result = {"rephrased_text": rephrased_text}
+        return [{"index": index, "mode": items[index]["mode"], **result} for index in indices_by_key[key]]
+
+    # Cache hits are sent straight away
+    cached_texts = await asyncio.gather(*(load_cached_rephrase(r, key) for key in unique_items))
+    pending: dict[tuple[str, str], list[tuple[str, dict]]] = {}
+    tasks = []
+    for (key, item), cached_text in zip(unique_items.items(), cached_texts):
+        if cached_text is not None:
+            metrics.increment("rephrase_cache_hits")
+            for result in results_for(key, cached_text):
+                yield result
+            continue
+        metrics.increment("rephrase_cache_misses")
+        if len(item["text_content"]) <= PACK_MAX_CHARS:
+            pending.setdefault((item["mode"], item["document_type"]), []).append((key, item))
+        else:
+            tasks.append(_rephrase_single(r, key, item, rephrase_functions))
+
+    for group in pending.values():
+        if len(group) == 1:
+            tasks.append(_rephrase_single(r, group[0][0], group[0][1], rephrase_functions))
+            continue
+        for start in range(0, len(group), PACK_MAX_ITEMS):
+            tasks.append(_rephrase_pack(r, group[start:start + PACK_MAX_ITEMS], rephrase_functions))
+
+    running = [asyncio.ensure_future(task) for task in tasks]
+    try:
+        for next_finished in asyncio.as_completed(running):
+            for key, rephrased_text in await next_finished:
+                for result in results_for(key, rephrased_text):
+                    yield result
+    finally:
+        # Stop outstanding work if the client went away
+        for task in running:
+            task.cancel()
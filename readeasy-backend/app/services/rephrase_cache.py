@@ -0,0 +1,111 @@
+"""
+Shared cache and request coalescing for /process/rephrase.
+
+Students reading the same handout tend to rephrase the same paragraphs. Results are
+cached in Redis keyed by (mode, prompt version, document type, normalized text), and identical
+requests arriving while a Gemini call is still running wait for that call instead
+of starting their own.
+"""
+import asyncio
+import hashlib
+import logging
+import re
+from typing import Awaitable, Callable
+
+import redis.asyncio as redis
+
+from app.core import metrics
+from app.core.config import settings
+from app.services.refinement_cache import prompt_version
+from app.services.text_refiner import REPHRASE_PROMPT_TEMPLATES, PACKED_REPHRASE_INSTRUCTIONS
+
+logger = logging.getLogger(__name__)
+
+REPHRASE_CACHE_DB_PREFIX = "rephrase_cache:"
+# Hash of each mode's prompts (batches add the packed instructions), so editing a prompt
+# stops old results from being served
+REPHRASE_PROMPT_VERSIONS = {
+    mode: prompt_version(template + PACKED_REPHRASE_INSTRUCTIONS) for mode, template in REPHRASE_PROMPT_TEMPLATES.items()
+}
+
+# Markdown that doesn't change what a selection says: paired emphasis and inline code
+# markers, headings, list bullets and block quotes. A lone * is kept ("2 * 3"), as are
+# single underscores and $ since they matter in math.
+EMPHASIS_PATTERN = re.compile(r"(\*\*|__|~~|\*|`)(?=\S)(.+?)(?<=\S)\1")
+LINE_PREFIX_PATTERN = re.compile(r"^\s{0,3}(#{1,6}|>|[-+*]|\d+[.)])\s+", re.MULTILINE)
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+# Rephrase calls currently in flight in this process, by cache key
+_in_flight: dict[str, asyncio.Task] = {}
+
+
+def normalize_rephrase_text(text: str) -> str:
+    """Collapse whitespace and markdown formatting so equivalent selections share a cache entry."""
+    text = LINE_PREFIX_PATTERN.sub("", text)
+    # Nested markers ("***bold italic***") come off one pair per pass
+    while True:
+        text, replaced = EMPHASIS_PATTERN.subn(r"\2", text)
+        if not replaced:
+            break
+    return WHITESPACE_PATTERN.sub(" ", text).strip()
+
+
+def rephrase_cache_key(mode: str, document_type: str, text: str) -> str:
+    text_hash = hashlib.sha256(normalize_rephrase_text(text).encode("utf-8")).hexdigest()
+    return f"{REPHRASE_CACHE_DB_PREFIX}{REPHRASE_PROMPT_VERSIONS.get(mode, '')}:{mode}:{document_type}:{text_hash}"
+
+
+async def load_cached_rephrase(r: redis.Redis, key: str) -> str | None:
+    """Cached result for a rephrase cache key, if any."""
+    try:
+        return await r.get(key)
+    except Exception as e:
+        # The cache is an optimisation; a Redis outage must not fail the request
+        logger.warning(f"Rephrase cache lookup failed: {e}")
+        return None
+
+
+async def save_rephrase(r: redis.Redis, key: str, text: str, rephrased_text: str) -> None:
+    """Cache a rephrase result, unless it is the input echoed back by an error fallback."""
+    if not rephrased_text or rephrased_text == text:
+        return
+    try:
+        await r.set(key, rephrased_text, ex=settings.REPHRASE_CACHE_TTL_SECONDS)
+    except Exception as e:
+        logger.warning(f"Could not store rephrased text in cache: {e}")
+
+
+async def _rephrase_and_store(r: redis.Redis, key: str, text: str, document_type: str,
+                              rephrase: Callable[..., Awaitable[str]]) -> str:
+    rephrased_text = await rephrase(text, context=document_type)
+    await save_rephrase(r, key, text, rephrased_text)
+    return rephrased_text
+
+
+async def cached_rephrase(r: redis.Redis, mode: str, text: str, document_type: str,
+                          rephrase: Callable[..., Awaitable[str]]) -> str:
+    """Return rephrase(text, context=document_type), served from the cache or a shared in-flight call."""
+    key = rephrase_cache_key(mode, document_type, text)
+
+    cached_text = await load_cached_rephrase(r, key)
+    if cached_text is not None:
+        metrics.increment("rephrase_cache_hits")
+        return cached_text
+    metrics.increment("rephrase_cache_misses")
+    return await coalesced_rephrase(r, key, mode, text, document_type, rephrase)
+
+
+async def coalesced_rephrase(r: redis.Redis, key: str, mode: str, text: str, document_type: str,
+                             rephrase: Callable[..., Awaitable[str]]) -> str:
+    """Run rephrase for a cache miss, joining an identical call already in flight. Callers count the miss."""
+    task = _in_flight.get(key)
+    if task is not None:
+        metrics.increment("rephrase_coalesced_requests")
+        logger.info(f"Joining in-flight {mode} rephrase")
+    else:
+        task = asyncio.create_task(_rephrase_and_store(r, key, text, document_type, rephrase))
+        _in_flight[key] = task
+        task.add_done_callback(lambda _: _in_flight.pop(key, None))
+
+    # Shield the shared call so one client disconnecting doesn't cancel it for everyone else
+    return await asyncio.shield(task)
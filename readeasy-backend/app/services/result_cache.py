@@ -0,0 +1,76 @@
+"""
+Content-addressed cache of processing results.
+
+A document fingerprint combines the hash of the uploaded bytes with the document type
+and the pipeline version. Redis maps each fingerprint to the job that produced (or is
+producing) its result, so re-uploads and concurrent uploads of the same file attach to
+that job. Completed results are also written to disk so they outlive the Redis TTL.
+"""
+import asyncio
+import hashlib
+import logging
+from pathlib import Path
+
+import redis.asyncio as redis
+
+from app.core import json_codec
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+FINGERPRINT_DB_PREFIX = "processing_fingerprint:"
+
+
+def document_fingerprint(content_hash: str, document_type: str, pipeline_version: str) -> str:
+    """Fingerprint identifying the result of processing a document with a given pipeline."""
+    return hashlib.sha256(f"{content_hash}:{document_type}:{pipeline_version}".encode("utf-8")).hexdigest()
+
+
+async def get_fingerprint_job(r: redis.Redis, fingerprint: str) -> str | None:
+    """Return the job ID registered for a fingerprint, if any."""
+    return await r.get(f"{FINGERPRINT_DB_PREFIX}{fingerprint}")
+
+
+async def claim_fingerprint(r: redis.Redis, fingerprint: str, job_id: str) -> bool:
+    """Register job_id as the producer of a fingerprint. Returns False if another job got there first."""
+    return bool(await r.set(
+        f"{FINGERPRINT_DB_PREFIX}{fingerprint}", job_id,
+        ex=settings.PROCESSING_RESULT_EXPIRATION_SECONDS, nx=True
+    ))
+
+
+async def release_fingerprint(r: redis.Redis, fingerprint: str, job_id: str) -> None:
+    """Forget a fingerprint (e.g. after its job failed), but only if job_id still owns it."""
+    fingerprint_key = f"{FINGERPRINT_DB_PREFIX}{fingerprint}"
+    if await r.get(fingerprint_key) == job_id:
+        await r.delete(fingerprint_key)
+
+
+def _cache_path(fingerprint: str) -> Path:
+    cache_dir = Path(settings.RESULT_CACHE_DIR)
+    cache_dir.mkdir(exist_ok=True, parents=True)
+    return cache_dir / f"{fingerprint}.json"
+
+
+async def load_cached_result(fingerprint: str) -> dict | None:
+    """Load a completed result from the on-disk cache."""
+    path = _cache_path(fingerprint)
+    if not path.exists():
+        return None
+    try:
+        return json_codec.loads(await asyncio.to_thread(path.read_bytes))
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable cached result {path}: {e}")
+        return None
+
+
+async def save_cached_result(fingerprint: str, result: dict) -> None:
+    """Persist a completed result to the on-disk cache."""
+    path = _cache_path(fingerprint)
+    tmp_path = path.with_suffix(".tmp")
+    try:
+        # Write then rename so readers never see a partially written file
+        await asyncio.to_thread(tmp_path.write_bytes, json_codec.dumps_bytes(result))
+        await asyncio.to_thread(tmp_path.replace, path)
+    except OSError as e:
+        logger.warning(f"Could not write cached result {path}: {e}")
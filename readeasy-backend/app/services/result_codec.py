@@ -0,0 +1,133 @@
+"""
+Compressed storage of page JSON in Redis, and responses built from it.
+
+Stored pages dominate Redis memory while results are kept for
+PROCESSING_RESULT_EXPIRATION_SECONDS, so page JSON is stored compressed. The Redis
+clients here only handle strings (decode_responses, Upstash REST), so a stored value is
+a marker naming the codec followed by base64:
+
+    gz:<base64>   CRC-32 and length of the JSON, then a raw DEFLATE segment
+    zs:<base64>   a zstd frame (when the optional zstandard package is installed)
+
+Values without a marker are plain JSON written before compression was enabled.
+
+Either codec lets encoded_body() join stored pages and surrounding JSON into one
+response body without decompressing the pages: DEFLATE segments end on a full flush,
+so they can follow each other inside one gzip member whose CRC is combined from the
+stored ones, and zstd decoders read concatenated frames.
+"""
+import base64
+import logging
+import struct
+import zlib
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Stored value marker -> Content-Encoding of the response body built from it
+MARKER_ENCODINGS = {"gz:": "gzip", "zs:": "zstd"}
+ENCODING_MARKERS = {encoding: marker for marker, encoding in MARKER_ENCODINGS.items()}
+MARKER_LENGTH = 3
+
+# gzip member header (no name, no mtime, unknown OS) and the empty final DEFLATE block
+GZIP_HEADER = b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff"
+DEFLATE_END = zlib.compressobj(wbits=-zlib.MAX_WBITS).flush()
+GZIP_SEGMENT_HEADER = struct.Struct("<II")  # CRC-32, length
+
+
+def crc32_combine(crc1: int, crc2: int, length2: int) -> int:
+    """
+    CRC-32 of two byte strings joined, from their CRCs and the second one's length.
+    CRC-32 is affine in its initial value, so running length2 zero bytes through zlib
+    from crc1 and from 0 gives the shift of crc1 without the second string's data.
+    """
+    zeros = bytes(length2)
+    return zlib.crc32(zeros, crc1) ^ zlib.crc32(zeros) ^ crc2
+
+
+def storage_encoding() -> str | None:
+    """Codec new pages are stored with, from RESULT_COMPRESSION (None stores plain JSON)."""
+    encoding = settings.RESULT_COMPRESSION.lower()
+    if encoding == "zstd" and zstandard is None:
+        logger.warning("RESULT_COMPRESSION is zstd but the zstandard package isn't installed; using gzip")
+        return "gzip"
+    return encoding if encoding in ENCODING_MARKERS else None
+
+
+def _compress(data: bytes, encoding: str) -> bytes:
+    """Compress data into a piece that encoded_body() can join with others."""
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=settings.RESULT_COMPRESSION_LEVEL).compress(data)
+    compressor = zlib.compressobj(min(9, settings.RESULT_COMPRESSION_LEVEL), wbits=-zlib.MAX_WBITS)
+    # A full flush ends the segment on a byte boundary without a final block
+    segment = compressor.compress(data) + compressor.flush(zlib.Z_FULL_FLUSH)
+    return GZIP_SEGMENT_HEADER.pack(zlib.crc32(data), len(data)) + segment
+
+
+def encode_stored(text: str) -> str:
+    """Encode JSON text for storage with the configured codec."""
+    encoding = storage_encoding()
+    if encoding is None:
+        return text
+    return ENCODING_MARKERS[encoding] + base64.b64encode(_compress(text.encode("utf-8"), encoding)).decode("ascii")
+
+
+def stored_encoding(value: str) -> str | None:
+    """Content-Encoding a stored value can be sent with, or None for plain JSON."""
+    return MARKER_ENCODINGS.get(value[:MARKER_LENGTH])
+
+
+def decode_stored(value: str) -> str:
+    """JSON text of a stored value, whichever way it was stored."""
+    encoding = stored_encoding(value)
+    if encoding is None:
+        return value
+    data = base64.b64decode(value[MARKER_LENGTH:])
+    if encoding == "zstd":
+        return zstandard.ZstdDecompressor().decompress(data).decode("utf-8")
+    decompressor = zlib.decompressobj(wbits=-zlib.MAX_WBITS)
+    return decompressor.decompress(data[GZIP_SEGMENT_HEADER.size:]).decode("utf-8")
+
+
+def encoded_body(pieces: list[str | bytes], encoding: str) -> bytes:
+    """
+    Response body with the given Content-Encoding for the concatenation of pieces, which
+    are stored values (str, all stored with that encoding) or uncompressed bytes such as
+    the JSON around a page list. Stored values are copied without decompressing them.
+    """
+    compressed = [
+        base64.b64decode(piece[MARKER_LENGTH:]) if isinstance(piece, str) else _compress(piece, encoding)
+        for piece in pieces
+    ]
+    if encoding == "zstd":
+        return b"".join(compressed)
+
+    crc, length, segments = 0, 0, []
+    for piece in compressed:
+        piece_crc, piece_length = GZIP_SEGMENT_HEADER.unpack_from(piece)
+        crc = crc32_combine(crc, piece_crc, piece_length)
+        length += piece_length
+        segments.append(piece[GZIP_SEGMENT_HEADER.size:])
+    return b"".join((GZIP_HEADER, *segments, DEFLATE_END, struct.pack("<II", crc, length & 0xFFFFFFFF)))
+
+
+def accepts_encoding(accept_encoding: str | None, encoding: str) -> bool:
+    """Whether an Accept-Encoding header allows the given encoding."""
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        if name.strip().lower() not in (encoding, "*"):
+            continue
+        params = params.strip()
+        if not params.startswith("q="):
+            return True
+        try:
+            return float(params[2:]) > 0
+        except ValueError:
+            return False
+    return False
@@ -1,12 +1,25 @@
 """
 Text refinement service using Google Gemini to improve OCR-generated markdown.
 """
-from google import genai
-from google.genai import types
+import asyncio
 import logging
 import json
 from app.core.config import settings
+from app.core import metrics
+from app.services.llm_client import GENERATION_CONFIGS, PACKED_GENERATION_CONFIGS
+from app.services.markdown_chunker import chunk_markdown, stitch_chunks
+from app.services.llm_gateway import generate_content, stream_content, LLMRateLimitError
+from app.services.refinement_cache import (
+    prompt_version,
+    refinement_cache_key,
+    image_targets,
+    image_placeholders,
+    replace_image_targets,
+    get_cached_refinement,
+    save_refinement,
+)
 import os
+from typing import AsyncIterator
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -34,37 +47,9 @@ except Exception as config_error:
     logging.error(f"Failed to configure Google Generative AI SDK: {config_error}")
     # Handle configuration error appropriately
 
-async def refine_markdown(markdown_content: str, context: str = "academic paper") -> str:
-    """
-    Refine OCR-generated markdown using Google Gemini models.
-    
-    Args:
-        markdown_content: The raw OCR-generated markdown
-        context: Optional context about the document type (e.g., academic paper, cheatsheet)
-    
-    Returns:
-        Improved markdown content with corrected text, formatting and structure
-    """
-    # Check if API key is available
-    current_api_key = google_api_key or settings.GOOGLE_API_KEY or os.getenv("GOOGLE_API_KEY") or settings.TOGETHER_API_KEY # Match configuration logic
-    if not current_api_key:
-        logger.warning("GOOGLE_API_KEY not configured - skipping markdown refinement")
-        return markdown_content
-    
-    if not markdown_content:
-        return ""
-    
-    try:
-        content_length = len(markdown_content)
-        # Update logging message
-        logger.info(f"Refining markdown content with Google Gemini (content length: {content_length})")
-        
-        # Define system prompt for the model (structure might be slightly different for Gemini)
-        # Note: Gemini models often work better with instructions directly in the user prompt 
-        # rather than a separate system prompt, depending on the model version.
-        # Let's combine the instruction and context into the main prompt.
-        
-        prompt = f"""
+# Prompt used to refine OCR markdown; filled in with the document context and page markdown.
+# Its hash is part of every refinement cache key, so editing it invalidates cached refinements.
+REFINE_PROMPT_TEMPLATE = """
         Context: You are processing text from a {context}.
         Task: You are an expert in improving OCR-generated text. Fix common OCR errors and improve the formatting of the following markdown content.
 
@@ -100,56 +85,78 @@ async def refine_markdown(markdown_content: str, context: str = "academic paper"
         ---
         Corrected Markdown:
         """
+
+REFINE_MODEL_NAME = "gemini-2.5-flash-preview-04-17"
+REPHRASE_MODEL_NAME = "gemini-2.5-flash-preview-04-17"
+REFINE_PROMPT_VERSION = prompt_version(REFINE_PROMPT_TEMPLATE)
+
+async def refine_markdown(markdown_content: str, context: str = "academic paper", background: bool = False) -> str:
+    """
+    Refine OCR-generated markdown using Google Gemini models.
+    
+    Args:
+        markdown_content: The raw OCR-generated markdown
+        context: Optional context about the document type (e.g., academic paper, cheatsheet)
+        background: Whether nobody is waiting for the result (the page is already readable),
+            so the Gemini call yields to foreground calls
+    
+    Returns:
+        Improved markdown content with corrected text, formatting and structure
+    """
+    # Check if API key is available
+    current_api_key = google_api_key or settings.GOOGLE_API_KEY or os.getenv("GOOGLE_API_KEY") or settings.TOGETHER_API_KEY # Match configuration logic
+    if not current_api_key:
+        logger.warning("GOOGLE_API_KEY not configured - skipping markdown refinement")
+        return markdown_content
+    
+    if not markdown_content:
+        return ""
+
+    # Pages too large for one response are refined in parts and stitched back in order
+    chunks = chunk_markdown(markdown_content, settings.REFINE_CHUNK_MAX_TOKENS)
+    if len(chunks) > 1:
+        logger.info(f"Refining oversized markdown in {len(chunks)} chunks (content length: {len(markdown_content)})")
+        metrics.increment("refinement_chunked_pages")
+        refined_chunks = await asyncio.gather(*(refine_markdown(chunk, context, background) for chunk in chunks))
+        # Refined chunks come back stripped; keep the blank lines that followed each one
+        return stitch_chunks([
+            refined.rstrip("\n") + chunk[len(chunk.rstrip("\n")):] for chunk, refined in zip(chunks, refined_chunks)
+        ])
+
+    # Identical pages (re-uploads, cover pages, licence pages...) are refined only once.
+    # Their images are saved under new names each time, so the key leaves the names out.
+    placeholders = image_placeholders(image_targets(markdown_content))
+    cache_key = refinement_cache_key(
+        replace_image_targets(markdown_content, placeholders), context, REFINE_MODEL_NAME, REFINE_PROMPT_VERSION
+    )
+    cached_markdown = await get_cached_refinement(cache_key, markdown_content)
+    if cached_markdown is not None:
+        logger.info(f"Using cached refinement (content length: {len(markdown_content)})")
+        return replace_image_targets(cached_markdown, {placeholder: target for target, placeholder in placeholders.items()})
+    
+    try:
+        content_length = len(markdown_content)
+        # Update logging message
+        logger.info(f"Refining markdown content with Google Gemini (content length: {content_length})")
+        
+        # Define system prompt for the model (structure might be slightly different for Gemini)
+        # Note: Gemini models often work better with instructions directly in the user prompt 
+        # rather than a separate system prompt, depending on the model version.
+        # Let's combine the instruction and context into the main prompt.
         
-        # model_used = "google/gemini-flash-1.5" # Keep this or choose another Gemini model
-        # Switch model name to just the Gemini model identifier
-        model_name = "gemini-2.5-flash-preview-04-17" # Or "gemini-1.5-pro-latest", etc.
+        prompt = REFINE_PROMPT_TEMPLATE.format(context=context, markdown_content=markdown_content)
+        
+        model_name = REFINE_MODEL_NAME
         logger.info(f"Using model: {model_name}")
         
         # Log a preview of the content being sent (using the combined prompt now)
         prompt_preview = prompt[:700] + "..." if len(prompt) > 700 else prompt # Show a bit more of the prompt
         logger.info(f"Prompt preview:\n{prompt_preview}")
         
-        # Create a client for the Gemini API
-        client = genai.Client(api_key=current_api_key)
-        
-        # Configure safety settings
-        safety_settings = [
-            types.SafetySetting(
-                category="HARM_CATEGORY_HARASSMENT", 
-                threshold="BLOCK_MEDIUM_AND_ABOVE"
-            ),
-            types.SafetySetting(
-                category="HARM_CATEGORY_HATE_SPEECH", 
-                threshold="BLOCK_MEDIUM_AND_ABOVE"
-            ),
-            types.SafetySetting(
-                category="HARM_CATEGORY_SEXUALLY_EXPLICIT", 
-                threshold="BLOCK_MEDIUM_AND_ABOVE"
-            ),
-            types.SafetySetting(
-                category="HARM_CATEGORY_DANGEROUS_CONTENT", 
-                threshold="BLOCK_MEDIUM_AND_ABOVE"
-            ),
-        ]
-        
-        # Define generation config using proper types format
-        generation_config = types.GenerateContentConfig(
-            temperature=0.1, # Low temperature for factual correction
-            # top_p=0.9, # Optional: control diversity
-            # top_k=40, # Optional: control diversity
-            candidate_count=1,
-            max_output_tokens=8192,
-            thinking_config=types.ThinkingConfig(thinking_budget=0),  # Disable thinking
-            safety_settings=safety_settings
-        )
-
-        # Send request to Gemini API using the async method
-        response = await client.aio.models.generate_content(
-            model=model_name,
-            contents=prompt,
-            config=generation_config
-        )
+        generation_config = GENERATION_CONFIGS["refine"]
+
+        # Send request to Gemini API through the rate-limited gateway
+        response = await generate_content(model_name, prompt, generation_config, current_api_key, background)
         
         # Extract the refined markdown text
         # Add checks for response validity and potential blocks
@@ -167,6 +174,11 @@ async def refine_markdown(markdown_content: str, context: str = "academic paper"
 
         # Check finish reason in the candidate
         candidate = response.candidates[0]
+        if candidate.finish_reason == 'MAX_TOKENS':
+             # A cut-off refinement would silently drop the end of the page
+             logger.warning(f"Gemini refinement hit the output limit, returning unrefined markdown (content length: {content_length})")
+             metrics.increment("refinement_truncated_fallbacks")
+             return markdown_content
         if candidate.finish_reason != 'STOP':
              logger.warning(f"Gemini generation finished with reason: {candidate.finish_reason}. Content might be incomplete.")
              # Log safety ratings if available
@@ -198,9 +210,17 @@ async def refine_markdown(markdown_content: str, context: str = "academic paper"
         if refined_images < original_images:
              logger.warning("Potential loss of image tags during refinement.")
 
+        # Output stopped for other reasons (e.g. safety filters) is returned but not cached
+        if candidate.finish_reason == 'STOP':
+            await save_refinement(cache_key, replace_image_targets(refined_markdown, placeholders))
         
         return refined_markdown
         
+    except LLMRateLimitError as e:
+        # Counted separately so quota exhaustion doesn't hide behind generic refinement errors
+        logger.error(f"Gemini rate limit exhausted, returning unrefined markdown: {e}")
+        metrics.increment("refinement_rate_limited_fallbacks")
+        return markdown_content
     except Exception as e:
         # Update logging message
         logger.error(f"Error refining markdown with Google Gemini: {str(e)}")
@@ -216,31 +236,8 @@ async def refine_markdown(markdown_content: str, context: str = "academic paper"
         # Return original content if refinement fails
         return markdown_content 
 
-async def summarize_text(text_content: str, context: str = "academic paper") -> str:
-    """
-    Summarize the given text content using Google Gemini models.
-    
-    Args:
-        text_content: The text content to summarize
-        context: Optional context about the document type (e.g., academic paper, cheatsheet)
-    
-    Returns:
-        Summarized markdown content
-    """
-    # Check if API key is available
-    current_api_key = google_api_key or settings.GOOGLE_API_KEY or os.getenv("GOOGLE_API_KEY") or settings.TOGETHER_API_KEY
-    if not current_api_key:
-        logger.warning("GOOGLE_API_KEY not configured - skipping text summarization")
-        return text_content
-    
-    if not text_content:
-        return ""
-    
-    try:
-        content_length = len(text_content)
-        logger.info(f"Summarizing text content with Google Gemini (content length: {content_length})")
-        
-        prompt = f"""
+# Prompt for the "summarize" rephrase mode, shared by the buffered and streaming paths
+SUMMARIZE_PROMPT_TEMPLATE = """
         Context: You are processing text from a {context}.
         Task: You are an expert in summarizing complex text. Create a concise, informative summary of the following content.
 
@@ -266,52 +263,44 @@ async def summarize_text(text_content: str, context: str = "academic paper") ->
         ---
         Summarized Content:
         """
+
+async def summarize_text(text_content: str, context: str = "academic paper") -> str:
+    """
+    Summarize the given text content using Google Gemini models.
+    
+    Args:
+        text_content: The text content to summarize
+        context: Optional context about the document type (e.g., academic paper, cheatsheet)
+    
+    Returns:
+        Summarized markdown content
+    """
+    # Check if API key is available
+    current_api_key = google_api_key or settings.GOOGLE_API_KEY or os.getenv("GOOGLE_API_KEY") or settings.TOGETHER_API_KEY
+    if not current_api_key:
+        logger.warning("GOOGLE_API_KEY not configured - skipping text summarization")
+        return text_content
+    
+    if not text_content:
+        return ""
+    
+    try:
+        content_length = len(text_content)
+        logger.info(f"Summarizing text content with Google Gemini (content length: {content_length})")
+        
+        prompt = SUMMARIZE_PROMPT_TEMPLATE.format(context=context, text_content=text_content)
         
-        model_name = "gemini-2.5-flash-preview-04-17"
+        model_name = REPHRASE_MODEL_NAME
         logger.info(f"Using model: {model_name}")
         
         # Log a preview of the content being sent
         prompt_preview = prompt[:700] + "..." if len(prompt) > 700 else prompt
         logger.info(f"Prompt preview:\n{prompt_preview}")
         
-        # Create a client for the Gemini API
-        client = genai.Client(api_key=current_api_key)
-        
-        # Configure safety settings
-        safety_settings = [
-            types.SafetySetting(
-                category="HARM_CATEGORY_HARASSMENT", 
-                threshold="BLOCK_MEDIUM_AND_ABOVE"
-            ),
-            types.SafetySetting(
-                category="HARM_CATEGORY_HATE_SPEECH", 
-                threshold="BLOCK_MEDIUM_AND_ABOVE"
-            ),
-            types.SafetySetting(
-                category="HARM_CATEGORY_SEXUALLY_EXPLICIT", 
-                threshold="BLOCK_MEDIUM_AND_ABOVE"
-            ),
-            types.SafetySetting(
-                category="HARM_CATEGORY_DANGEROUS_CONTENT", 
-                threshold="BLOCK_MEDIUM_AND_ABOVE"
-            ),
-        ]
-
-        # Define generation config
-        generation_config = types.GenerateContentConfig(
-            temperature=0.3,  # Slightly higher temperature for summarization
-            candidate_count=1,
-            max_output_tokens=3072,  # Limit output length for summaries
-            thinking_config=types.ThinkingConfig(thinking_budget=0),  # Disable thinking
-            safety_settings=safety_settings
-        )
-        
-        # Send request to Gemini API using the async method
-        response = await client.aio.models.generate_content(
-            model=model_name,
-            contents=prompt,
-            config=generation_config
-        )
+        generation_config = GENERATION_CONFIGS["summarize"]
+
+        # Send request to Gemini API through the rate-limited gateway
+        response = await generate_content(model_name, prompt, generation_config, current_api_key)
         
         if not response.candidates:
              logger.error("Gemini response blocked or empty for summarization.")
@@ -356,31 +345,8 @@ async def summarize_text(text_content: str, context: str = "academic paper") ->
             pass
         return text_content
 
-async def explain_like_im_five(text_content: str, context: str = "academic paper") -> str:
-    """
-    Simplify and explain the given text content in very simple terms (ELI5) using Google Gemini models.
-    
-    Args:
-        text_content: The text content to simplify and explain
-        context: Optional context about the document type (e.g., academic paper, cheatsheet)
-    
-    Returns:
-        Simplified markdown content that a child could understand
-    """
-    # Check if API key is available
-    current_api_key = google_api_key or settings.GOOGLE_API_KEY or os.getenv("GOOGLE_API_KEY") or settings.TOGETHER_API_KEY
-    if not current_api_key:
-        logger.warning("GOOGLE_API_KEY not configured - skipping ELI5 explanation")
-        return text_content
-    
-    if not text_content:
-        return ""
-    
-    try:
-        content_length = len(text_content)
-        logger.info(f"Creating ELI5 explanation with Google Gemini (content length: {content_length})")
-        
-        prompt = f"""
+# Prompt for the "eli5" rephrase mode, shared by the buffered and streaming paths
+ELI5_PROMPT_TEMPLATE = """
         Context: You are processing text from a {context}.
         Task: Explain the following content as if you were explaining it to a 5-year-old child.
 
@@ -405,52 +371,44 @@ async def explain_like_im_five(text_content: str, context: str = "academic paper
         ---
         Explanation for a 5-year-old:
         """
+
+async def explain_like_im_five(text_content: str, context: str = "academic paper") -> str:
+    """
+    Simplify and explain the given text content in very simple terms (ELI5) using Google Gemini models.
+    
+    Args:
+        text_content: The text content to simplify and explain
+        context: Optional context about the document type (e.g., academic paper, cheatsheet)
+    
+    Returns:
+        Simplified markdown content that a child could understand
+    """
+    # Check if API key is available
+    current_api_key = google_api_key or settings.GOOGLE_API_KEY or os.getenv("GOOGLE_API_KEY") or settings.TOGETHER_API_KEY
+    if not current_api_key:
+        logger.warning("GOOGLE_API_KEY not configured - skipping ELI5 explanation")
+        return text_content
+    
+    if not text_content:
+        return ""
+    
+    try:
+        content_length = len(text_content)
+        logger.info(f"Creating ELI5 explanation with Google Gemini (content length: {content_length})")
+        
+        prompt = ELI5_PROMPT_TEMPLATE.format(context=context, text_content=text_content)
         
-        model_name = "gemini-2.5-flash-preview-04-17"
+        model_name = REPHRASE_MODEL_NAME
         logger.info(f"Using model: {model_name}")
         
         # Log a preview of the content being sent
         prompt_preview = prompt[:700] + "..." if len(prompt) > 700 else prompt
         logger.info(f"Prompt preview:\n{prompt_preview}")
         
-        # Create a client for the Gemini API
-        client = genai.Client(api_key=current_api_key)
-        
-        # Configure safety settings
-        safety_settings = [
-            types.SafetySetting(
-                category="HARM_CATEGORY_HARASSMENT", 
-                threshold="BLOCK_MEDIUM_AND_ABOVE"
-            ),
-            types.SafetySetting(
-                category="HARM_CATEGORY_HATE_SPEECH", 
-                threshold="BLOCK_MEDIUM_AND_ABOVE"
-            ),
-            types.SafetySetting(
-                category="HARM_CATEGORY_SEXUALLY_EXPLICIT", 
-                threshold="BLOCK_MEDIUM_AND_ABOVE"
-            ),
-            types.SafetySetting(
-                category="HARM_CATEGORY_DANGEROUS_CONTENT", 
-                threshold="BLOCK_MEDIUM_AND_ABOVE"
-            ),
-        ]
-
-        # Define generation config with higher temperature for creative explanations
-        generation_config = types.GenerateContentConfig(
-            temperature=0.4,  # Higher temperature for more creative, simple language
-            candidate_count=1,
-            max_output_tokens=3072,
-            thinking_config=types.ThinkingConfig(thinking_budget=0),  # Disable thinking
-            safety_settings=safety_settings
-        )
-        
-        # Send request to Gemini API using the async method
-        response = await client.aio.models.generate_content(
-            model=model_name,
-            contents=prompt,
-            config=generation_config
-        )
+        generation_config = GENERATION_CONFIGS["eli5"]
+
+        # Send request to Gemini API through the rate-limited gateway
+        response = await generate_content(model_name, prompt, generation_config, current_api_key)
         
         if not response.candidates:
              logger.error("Gemini response blocked or empty for ELI5 explanation.")
@@ -495,6 +453,32 @@ async def explain_like_im_five(text_content: str, context: str = "academic paper
             pass
         return text_content
 
+# Prompt for the "remove_jargon" rephrase mode, shared by the buffered and streaming paths
+REMOVE_JARGON_PROMPT_TEMPLATE = """
+        Context: You are processing text from a {context}.
+        Task: Rewrite the following text to remove technical jargon and specialized terminology, making it accessible to a general audience.
+
+        Instructions:
+        1. Identify and replace field-specific jargon, technical terms, and acronyms with plain language equivalents.
+        2. When a technical term must be used, briefly define it in parentheses the first time it appears.
+        3. Break down complex concepts into simpler explanations without oversimplifying.
+        4. Maintain the original meaning, information density, and logical structure of the content.
+        5. Keep the same level of detail and accuracy as the original.
+        6. Preserve mathematical notation when necessary, but explain what the variables and symbols represent.
+        7. Use concrete examples to illustrate abstract concepts when helpful.
+        8. Maintain markdown formatting for headings, lists, emphasis, etc.
+        9. Preserve any references to images, tables, or figures in the text.
+        10. Use a friendly, accessible tone that welcomes non-experts.
+        
+        IMPORTANT: Return ONLY the jargon-free content in markdown format. Do not include any introductory sentences, explanations about what you're doing, or markdown code fences surrounding the entire response.
+
+        Content to Remove Jargon From:
+        ---
+        {text_content}
+        ---
+        Jargon-Free Content:
+        """
+
 async def remove_jargon(text_content: str, context: str = "academic paper") -> str:
     """
     Remove technical jargon from the given text content using Google Gemini models.
@@ -519,76 +503,19 @@ async def remove_jargon(text_content: str, context: str = "academic paper") -> s
         content_length = len(text_content)
         logger.info(f"Removing jargon with Google Gemini (content length: {content_length})")
         
-        prompt = f"""
-        Context: You are processing text from a {context}.
-        Task: Rewrite the following text to remove technical jargon and specialized terminology, making it accessible to a general audience.
-
-        Instructions:
-        1. Identify and replace field-specific jargon, technical terms, and acronyms with plain language equivalents.
-        2. When a technical term must be used, briefly define it in parentheses the first time it appears.
-        3. Break down complex concepts into simpler explanations without oversimplifying.
-        4. Maintain the original meaning, information density, and logical structure of the content.
-        5. Keep the same level of detail and accuracy as the original.
-        6. Preserve mathematical notation when necessary, but explain what the variables and symbols represent.
-        7. Use concrete examples to illustrate abstract concepts when helpful.
-        8. Maintain markdown formatting for headings, lists, emphasis, etc.
-        9. Preserve any references to images, tables, or figures in the text.
-        10. Use a friendly, accessible tone that welcomes non-experts.
+        prompt = REMOVE_JARGON_PROMPT_TEMPLATE.format(context=context, text_content=text_content)
         
-        IMPORTANT: Return ONLY the jargon-free content in markdown format. Do not include any introductory sentences, explanations about what you're doing, or markdown code fences surrounding the entire response.
-
-        Content to Remove Jargon From:
-        ---
-        {text_content}
-        ---
-        Jargon-Free Content:
-        """
-        
-        model_name = "gemini-2.5-flash-preview-04-17"
+        model_name = REPHRASE_MODEL_NAME
         logger.info(f"Using model: {model_name}")
         
         # Log a preview of the content being sent
         prompt_preview = prompt[:700] + "..." if len(prompt) > 700 else prompt
         logger.info(f"Prompt preview:\n{prompt_preview}")
         
-        # Create a client for the Gemini API
-        client = genai.Client(api_key=current_api_key)
-        
-        # Configure safety settings consistent with other methods
-        safety_settings = [
-            types.SafetySetting(
-                category="HARM_CATEGORY_HARASSMENT", 
-                threshold="BLOCK_MEDIUM_AND_ABOVE"
-            ),
-            types.SafetySetting(
-                category="HARM_CATEGORY_HATE_SPEECH", 
-                threshold="BLOCK_MEDIUM_AND_ABOVE"
-            ),
-            types.SafetySetting(
-                category="HARM_CATEGORY_SEXUALLY_EXPLICIT", 
-                threshold="BLOCK_MEDIUM_AND_ABOVE"
-            ),
-            types.SafetySetting(
-                category="HARM_CATEGORY_DANGEROUS_CONTENT", 
-                threshold="BLOCK_MEDIUM_AND_ABOVE"
-            ),
-        ]
-
-        # Define generation config for jargon simplification
-        generation_config = types.GenerateContentConfig(
-            temperature=0.2,  # Low temperature for accurate simplification
-            candidate_count=1,
-            max_output_tokens=4096,
-            thinking_config=types.ThinkingConfig(thinking_budget=0),  # Disable thinking
-            safety_settings=safety_settings
-        )
-        
-        # Send request to Gemini API using the async method
-        response = await client.aio.models.generate_content(
-            model=model_name,
-            contents=prompt,
-            config=generation_config
-        )
+        generation_config = GENERATION_CONFIGS["remove_jargon"]
+
+        # Send request to Gemini API through the rate-limited gateway
+        response = await generate_content(model_name, prompt, generation_config, current_api_key)
         
         if not response.candidates:
              logger.error("Gemini response blocked or empty for jargon removal.")
@@ -631,4 +558,121 @@ async def remove_jargon(text_content: str, context: str = "academic paper") -> s
             logger.error(f"Error details: {error_details}")
         except:
             pass
-        return text_content 
\ No newline at end of file
+        return text_content 
+
+REPHRASE_PROMPT_TEMPLATES = {
+    "summarize": SUMMARIZE_PROMPT_TEMPLATE,
+    "eli5": ELI5_PROMPT_TEMPLATE,
+    "remove_jargon": REMOVE_JARGON_PROMPT_TEMPLATE,
+}
+
+
+class MarkdownFenceStripper:
+    """
+    Strips a code fence wrapped around a streamed response, matching what the buffered
+    rephrase functions do with the full text. Only a few characters are held back at
+    each end, so chunks are forwarded almost as soon as they arrive.
+    """
+
+    OPENING_FENCE = "```markdown\n"
+    CLOSING_FENCE = "\n```"
+
+    def __init__(self):
+        self._started = False
+        self._buffer = ""
+
+    def _strip_opening(self, final: bool) -> bool:
+        text = self._buffer.lstrip()
+        # Wait until we can tell whether the response opens with a fence
+        if not final and len(text) < len(self.OPENING_FENCE) and self.OPENING_FENCE.startswith(text):
+            return False
+        if text.startswith(self.OPENING_FENCE):
+            text = text[len(self.OPENING_FENCE):]
+        elif text.startswith("```"):
+            text = text[len("```"):]
+        self._buffer = text.lstrip()
+        self._started = True
+        return True
+
+    def feed(self, chunk: str) -> str:
+        """Add a chunk and return the text that is safe to forward."""
+        self._buffer += chunk
+        if not self._started and not self._strip_opening(final=False):
+            return ""
+        # Hold back trailing whitespace and anything that might turn out to be the closing fence
+        safe_length = max(0, len(self._buffer.rstrip()) - len(self.CLOSING_FENCE))
+        text, self._buffer = self._buffer[:safe_length], self._buffer[safe_length:]
+        return text
+
+    def finish(self) -> str:
+        """Return the remaining text once the stream has ended."""
+        if not self._started:
+            self._strip_opening(final=True)
+        text = self._buffer
+        if text.endswith(self.CLOSING_FENCE):
+            text = text[:-len(self.CLOSING_FENCE)]
+        if text.endswith("```"):
+            text = text[:-len("```")]
+        self._buffer = ""
+        return text.rstrip()
+
+
+async def stream_rephrase(text_content: str, mode: str, context: str = "academic paper") -> AsyncIterator[str]:
+    """
+    Streaming variant of summarize_text / explain_like_im_five / remove_jargon.
+    Yields the rephrased markdown in chunks as Gemini produces it.
+    """
+    current_api_key = google_api_key or settings.GOOGLE_API_KEY or os.getenv("GOOGLE_API_KEY") or settings.TOGETHER_API_KEY
+    if not current_api_key:
+        logger.warning("GOOGLE_API_KEY not configured - skipping text rephrasing")
+        yield text_content
+        return
+
+    if not text_content:
+        return
+
+    logger.info(f"Streaming {mode} rephrase with Google Gemini (content length: {len(text_content)})")
+    prompt = REPHRASE_PROMPT_TEMPLATES[mode].format(context=context, text_content=text_content)
+    stripper = MarkdownFenceStripper()
+    async for chunk in stream_content(REPHRASE_MODEL_NAME, prompt, GENERATION_CONFIGS[mode], current_api_key):
+        text = stripper.feed(chunk)
+        if text:
+            yield text
+    text = stripper.finish()
+    if text:
+        yield text
+
+
+PACKED_REPHRASE_INSTRUCTIONS = """
+        The content below is a JSON array of separate passages. Apply the instructions to each
+        passage independently and answer with a JSON array of strings holding one result per
+        passage, in the same order.
+        """
+
+
+async def rephrase_packed(text_contents: list[str], mode: str, context: str = "academic paper") -> list[str] | None:
+    """
+    Rephrase several short passages with a single Gemini call using structured JSON output.
+    Returns None if the call fails or the answer doesn't line up with the passages, so the
+    caller can fall back to one call per passage.
+    """
+    current_api_key = google_api_key or settings.GOOGLE_API_KEY or os.getenv("GOOGLE_API_KEY") or settings.TOGETHER_API_KEY
+    if not current_api_key:
+        return None
+
+    prompt = PACKED_REPHRASE_INSTRUCTIONS + REPHRASE_PROMPT_TEMPLATES[mode].format(
+        context=context, text_content=json.dumps(text_contents, ensure_ascii=False)
+    )
+    try:
+        logger.info(f"Rephrasing {len(text_contents)} passages in one {mode} call")
+        response = await generate_content(REPHRASE_MODEL_NAME, prompt, PACKED_GENERATION_CONFIGS[mode], current_api_key)
+        rephrased_texts = json.loads(response.text)
+    except Exception as e:
+        logger.warning(f"Packed {mode} rephrase failed: {e}")
+        return None
+
+    if (not isinstance(rephrased_texts, list) or len(rephrased_texts) != len(text_contents)
+            or not all(isinstance(text, str) and text.strip() for text in rephrased_texts)):
+        logger.warning(f"Packed {mode} rephrase returned {len(rephrased_texts) if isinstance(rephrased_texts, list) else 'no'} results for {len(text_contents)} passages")
+        return None
+    return [text.strip() for text in rephrased_texts]
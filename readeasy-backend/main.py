@@ -2,6 +2,7 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from contextlib import asynccontextmanager
+import asyncio
 import logging
 import os
 from pathlib import Path
@@ -10,6 +11,9 @@ import json # Import json module
 # Import API router for better organization
 from app.api.api import api_router
 from app.core.redis_client import redis_client, close_redis_client
+from app.core import metrics
+from app.services.llm_client import start_llm_client, close_llm_client
+from app.services.text_refiner import google_api_key
 
 # Configure logging
 logging.basicConfig(
@@ -88,11 +92,22 @@ async def lifespan(app: FastAPI):
 
     # --- End Firebase Initialization ---
 
+    # Shared Gemini client, so rephrase/refinement calls reuse pooled connections
+    start_llm_client(google_api_key)
+
+    # Add this process's counters to the totals reported by /api/metrics
+    metrics_flusher = asyncio.create_task(
+        metrics.flush_periodically(redis_client, settings.METRICS_FLUSH_INTERVAL_SECONDS)
+    )
+
     yield
 
     # Shutdown: Close Redis connection and perform cleanup
+    metrics_flusher.cancel()
+    await asyncio.gather(metrics_flusher, return_exceptions=True)
     logger.info("Closing Redis connection")
     await close_redis_client()
+    await close_llm_client()
 
 # Initialize FastAPI app with proper metadata
 app = FastAPI(
@@ -134,6 +149,26 @@ async def health_check():
     """Health check endpoint for monitoring systems."""
     return {"status": "healthy"}
 
+@app.get("/api/metrics")
+async def metrics_endpoint():
+    """
+    Counters summed over all API and worker processes (cache hit rates, bytes saved...),
+    up to METRICS_FLUSH_INTERVAL_SECONDS behind, plus this process's own counters and gauges.
+    """
+    process_counters = metrics.snapshot()
+    try:
+        await metrics.flush(redis_client)
+        counters = await metrics.shared_snapshot(redis_client)
+    except Exception as e:
+        logger.warning(f"Could not read shared metrics: {e}")
+        counters = process_counters
+    lookups = counters.get("refinement_cache_hits", 0) + counters.get("refinement_cache_misses", 0)
+    return {
+        "counters": counters,
+        "process": process_counters,
+        "refinement_cache_hit_rate": counters.get("refinement_cache_hits", 0) / lookups if lookups else None,
+    }
+
 
 # Run directly with uvicorn when executed as script
 if __name__ == "__main__":
@@ -0,0 +1,106 @@
+"""Stand-ins for the PDFs and OCR service the pipeline works with."""
+import asyncio
+import base64
+import io
+
+from mistralai.models import OCRImageObject, OCRPageObject, OCRResponse, OCRUsageInfo
+
+PNG_BASE64 = base64.b64encode(b"\x89PNG\r\n\x1a\n" + bytes(16)).decode("ascii")
+
+
+def blank_pdf(page_count: int) -> bytes:
+    from PyPDF2 import PdfWriter
+    writer = PdfWriter()
+    for _ in range(page_count):
+        writer.add_blank_page(612, 792)
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+
+class FakeOCR:
+    """
+    Implements the MistralOCRClient interface. Every page of an uploaded chunk comes back
+    with one image after delay seconds; fail_on makes the n-th process call raise after
+    fail_delay seconds.
+    """
+
+    def __init__(self, delay: float = 0.05, fail_on: int | None = None, fail_delay: float = 0.05):
+        self.delay = delay
+        self.fail_on = fail_on
+        self.fail_delay = fail_delay
+        self.process_calls = 0
+        self.uploads: dict[str, int] = {}
+        self.deleted: list[str] = []
+
+    async def upload(self, file_name: str, content) -> str:
+        from PyPDF2 import PdfReader
+        data = content if isinstance(content, bytes) else content.read()
+        file_id = f"file-{len(self.uploads)}"
+        self.uploads[file_id] = len(PdfReader(io.BytesIO(data)).pages)
+        return file_id
+
+    async def get_signed_url(self, file_id: str) -> str:
+        return file_id
+
+    async def process(self, document_url: str) -> OCRResponse:
+        self.process_calls += 1
+        if self.process_calls == self.fail_on:
+            await asyncio.sleep(self.fail_delay)
+            raise RuntimeError("OCR service unavailable")
+        await asyncio.sleep(self.delay)
+        page_count = self.uploads[document_url]
+        return OCRResponse(
+            pages=[
+                OCRPageObject(
+                    index=index,
+                    markdown=f"# Section {index}\n\nText of page {index} from {document_url}.\n\n![img-0.png](img-0.png)",
+                    images=[OCRImageObject(id="img-0.png", image_base64=PNG_BASE64, top_left_x=0,
+                                           top_left_y=0, bottom_right_x=1, bottom_right_y=1)],
+                    dimensions=None,
+                )
+                for index in range(page_count)
+            ],
+            model="mistral-ocr-latest",
+            usage_info=OCRUsageInfo(pages_processed=page_count),
+        )
+
+    async def delete(self, file_id: str) -> None:
+        self.deleted.append(file_id)
+
+
+def text_pdf(pages: list[list[str]]) -> bytes:
+    """
+    A born-digital PDF whose pages draw the given lines in Helvetica, one text line per
+    entry, so the pages carry a text layer. Empty pages have no text (like scans).
+    """
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for lines in pages:
+        commands = [b"BT /F1 10 Tf 12 TL 50 750 Td"]
+        for line in lines:
+            escaped = line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+            commands.append(b"(" + escaped.encode("latin-1") + b") Tj T*")
+        commands.append(b"ET")
+        stream = b"\n".join(commands)
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents %d 0 R "
+            b"/Resources << /Font << /F1 3 0 R >> >> >>" % len(objects)
+        )
+        page_ids.append(len(objects))
+    kids = b" ".join(b"%d 0 R" % page_id for page_id in page_ids)
+    objects[1] = b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % len(page_ids)
+
+    output = io.BytesIO()
+    output.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(output.tell())
+        output.write(b"%d 0 obj\n" % number + body + b"\nendobj\n")
+    xref_offset = output.tell()
+    output.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for offset in offsets:
+        output.write(b"%010d 00000 n \n" % offset)
+    output.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset))
+    return output.getvalue()
@@ -0,0 +1,49 @@
+"""A 304 must carry the ETag of the representation the client holds, not the plain one."""
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from app.auth.service import get_current_active_user
+from app.core.config import settings
+from app.core.redis_client import get_redis_client
+from app.schemas.auth import User
+from app.services import job_store
+
+
+@pytest.fixture
+def client(workdir, redis_client, monkeypatch):
+    monkeypatch.setattr(settings, "RESULT_COMPRESSION", "gzip")
+    asyncio.run(job_store.create_job(redis_client, "job", status="completed", user_id="alice",
+                                     file_name="notes.pdf", total_pages=2))
+    asyncio.run(job_store.save_pages(redis_client, "job", [
+        {"page_number": number, "markdown_content": f"# Page {number}\n\nSome text.", "refined": True, "version": 1}
+        for number in (1, 2)
+    ]))
+    main.app.dependency_overrides[get_current_active_user] = lambda: User(id="alice", username="alice")
+    main.app.dependency_overrides[get_redis_client] = lambda: redis_client
+    yield TestClient(main.app)
+    main.app.dependency_overrides.clear()
+
+
+@pytest.mark.parametrize("path", ["/api/v1/process/job", "/api/v1/process/job/pages", "/api/v1/process/job/pages/1"])
+@pytest.mark.parametrize("accept_encoding", ["gzip", "identity"])
+def test_not_modified_returns_the_matched_etag(client, path, accept_encoding):
+    response = client.get(path, headers={"Accept-Encoding": accept_encoding})
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+    assert etag.endswith('-gzip"') == (accept_encoding == "gzip")
+
+    # Proxies that recompress the body may weaken the ETag
+    for if_none_match in (etag, f"W/{etag}", f'"stale", {etag}'):
+        revalidated = client.get(path, headers={"Accept-Encoding": accept_encoding, "If-None-Match": if_none_match})
+        assert revalidated.status_code == 304
+        assert revalidated.headers["ETag"] == etag
+
+
+def test_manifest_not_modified_returns_the_plain_etag(client):
+    etag = client.get("/api/v1/process/job/manifest").headers["ETag"]
+    revalidated = client.get("/api/v1/process/job/manifest", headers={"If-None-Match": "*"})
+    assert revalidated.status_code == 304
+    assert revalidated.headers["ETag"] == etag
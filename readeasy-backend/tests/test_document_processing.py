@@ -0,0 +1,103 @@
+"""The OCR and refinement pipeline run by the workers, with stubbed OCR and LLM calls."""
+import asyncio
+import os
+
+import pytest
+
+from app.core.config import settings
+from app.services import document_processing, job_store
+from helpers import FakeOCR, blank_pdf
+
+
+@pytest.fixture
+def pipeline_settings(monkeypatch):
+    monkeypatch.setattr(settings, "OCR_CHUNK_PAGES", 2)
+    monkeypatch.setattr(settings, "OCR_CHUNK_CONCURRENCY", 2)
+    monkeypatch.setattr(settings, "TEXT_LAYER_FAST_PATH", False)
+    monkeypatch.setattr(settings, "GOOGLE_API_KEY", None)
+
+
+def test_failed_ocr_chunk_stops_the_other_chunks(workdir, redis_client, pipeline_settings):
+    (workdir / "doc.pdf").write_bytes(blank_pdf(12))
+    # Six chunks, two at a time: chunks 1 and 3 finish, chunk 2 fails while chunk 4 is running
+    ocr = FakeOCR(delay=0.1, fail_on=2, fail_delay=0.25)
+
+    async def scenario():
+        await job_store.create_job(redis_client, "job", status="queued")
+        await document_processing.run_mistral_ocr_processing(
+            "job", workdir / "doc.pdf", "doc.pdf", redis_client, ocr=ocr
+        )
+        # Give chunks that weren't stopped time to write images and checkpoints
+        await asyncio.sleep(0.3)
+        return (
+            await job_store.get_job(redis_client, "job"),
+            await redis_client.exists(job_store.checkpoint_key("job"), job_store.pages_key("job")),
+        )
+
+    job, leftover_keys = asyncio.run(scenario())
+    assert job["status"] == "error"
+    assert "OCR service unavailable" in job["detail"]
+    # Chunks 5 and 6 never started, and chunk 4 was stopped mid-call
+    assert ocr.process_calls == 4
+    assert len(ocr.deleted) == 4
+    assert leftover_keys == 0
+    assert os.listdir(workdir / "static" / "temp_images") == []
+
+
+def test_fast_first_view_publishes_pages_chunk_by_chunk(workdir, redis_client, pipeline_settings, monkeypatch):
+    monkeypatch.setattr(settings, "OCR_CHUNK_CONCURRENCY", 1)
+    (workdir / "doc.pdf").write_bytes(blank_pdf(6))
+    ocr = FakeOCR(delay=0.05)
+    readable_during_call = []
+    process = ocr.process
+
+    async def process_and_record(document_url):
+        response = await process(document_url)
+        readable_during_call.append(len(await job_store.get_pages(redis_client, "job")))
+        return response
+
+    ocr.process = process_and_record
+
+    async def scenario():
+        await job_store.create_job(redis_client, "job", status="queued")
+        await document_processing.run_mistral_ocr_processing(
+            "job", workdir / "doc.pdf", "doc.pdf", redis_client, ocr=ocr, fast_first_view=True
+        )
+        return await job_store.get_job(redis_client, "job")
+
+    job = asyncio.run(scenario())
+    # Each chunk's pages were readable while the next chunk was being OCR'd
+    assert readable_during_call == [0, 2, 4]
+    assert job["status"] == "completed"
+    assert job["first_view_pages"] == 6
+    assert job["first_view"] == "ready"
+
+
+def test_cancellation_lost_inside_a_redis_call_is_repeated(workdir, redis_client, monkeypatch):
+    monkeypatch.setattr(document_processing, "CANCEL_REPEAT_SECONDS", 0.05)
+    steps = []
+
+    async def process_document(job_id, *args):
+        # Like a Redis command that swallows the CancelledError and completes normally
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            steps.append("first cancellation lost")
+        await asyncio.sleep(1)
+        steps.append("completed")
+
+    monkeypatch.setattr(document_processing, "process_document", process_document)
+
+    async def scenario():
+        await job_store.create_job(redis_client, "job", status="processing")
+        run = asyncio.create_task(document_processing.run_mistral_ocr_processing(
+            "job", workdir / "doc.pdf", "doc.pdf", redis_client
+        ))
+        await asyncio.sleep(0.05)
+        await job_store.request_cancellation(redis_client, "job")
+        await asyncio.wait_for(run, timeout=0.5)
+        return await job_store.get_job(redis_client, "job")
+
+    job = asyncio.run(scenario())
+    assert steps == ["first cancellation lost"]
+    assert job["status"] == "cancelled"
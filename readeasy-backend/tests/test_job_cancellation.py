@@ -0,0 +1,71 @@
+"""Cancelling a job that other users' uploads are attached to must not cancel theirs."""
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from app.auth.service import get_current_active_user
+from app.core.redis_client import get_redis_client
+from app.schemas.auth import User
+from app.services import job_store
+from app.services.job_queue import JOB_STREAM_KEY, JOB_CONSUMER_GROUP
+from helpers import blank_pdf
+
+PDF = blank_pdf(2)
+
+
+@pytest.fixture
+def api(workdir, redis_client):
+    """A client per user, all talking to the same API and Redis."""
+    # Workers are up, so uploads are dispatched to the stream straight away
+    asyncio.run(redis_client.xgroup_create(JOB_STREAM_KEY, JOB_CONSUMER_GROUP, mkstream=True))
+    current_user = {}
+    main.app.dependency_overrides[get_current_active_user] = lambda: current_user["user"]
+    main.app.dependency_overrides[get_redis_client] = lambda: redis_client
+    client = TestClient(main.app)
+
+    def as_user(name: str) -> TestClient:
+        current_user["user"] = User(id=name, username=name)
+        return client
+
+    yield as_user
+    main.app.dependency_overrides.clear()
+
+
+def upload(client: TestClient) -> str:
+    response = client.post("/api/v1/process/", files={"file": ("notes.pdf", PDF, "application/pdf")})
+    assert response.status_code == 202
+    return response.json()["job_id"]
+
+
+def test_owner_cancelling_keeps_the_job_running_for_attached_uploads(api, redis_client):
+    alice_job = upload(api("alice"))
+    bob_job = upload(api("bob"))
+
+    cancelled = api("alice").delete(f"/api/v1/process/{alice_job}")
+    assert cancelled.json()["status"] == "cancelled"
+    assert api("alice").get(f"/api/v1/process/{alice_job}").json()["status"] == "cancelled"
+    # Bob still follows the run, which nobody asked to stop
+    assert api("bob").get(f"/api/v1/process/{bob_job}").json()["status"] == "queued"
+    assert not asyncio.run(job_store.is_cancellation_requested(redis_client, alice_job))
+
+    # Once Bob cancels too, nothing needs the run any more
+    assert api("bob").delete(f"/api/v1/process/{bob_job}").json()["status"] == "cancelled"
+    assert asyncio.run(job_store.is_cancellation_requested(redis_client, alice_job))
+    # A new upload of the document starts its own job instead of attaching to the stopped one
+    carol_job = upload(api("carol"))
+    assert "source_job_id" not in asyncio.run(job_store.get_job(redis_client, carol_job))
+
+
+def test_attached_upload_cancelling_leaves_the_owner_alone(api, redis_client):
+    alice_job = upload(api("alice"))
+    bob_job = upload(api("bob"))
+
+    assert api("bob").delete(f"/api/v1/process/{bob_job}").json()["status"] == "cancelled"
+
+    assert api("alice").get(f"/api/v1/process/{alice_job}").json()["status"] == "queued"
+    assert not asyncio.run(job_store.is_cancellation_requested(redis_client, alice_job))
+    # Alice is the last one left, so her cancellation stops the run
+    assert api("alice").delete(f"/api/v1/process/{alice_job}").json()["status"] == "cancelling"
+    assert asyncio.run(job_store.is_cancellation_requested(redis_client, alice_job))
@@ -0,0 +1,29 @@
+"""The fair scheduler keeps state only for users with jobs waiting."""
+import asyncio
+
+from app.core.config import settings
+from app.services import job_scheduler
+from app.services.job_queue import JOB_STREAM_KEY, JOB_CONSUMER_GROUP
+
+
+def test_flow_tags_are_dropped_once_a_user_has_nothing_waiting(redis_client, monkeypatch):
+    monkeypatch.setattr(settings, "SCHEDULER_DISPATCH_AHEAD", 1)
+    monkeypatch.setattr(settings, "SCHEDULER_USER_MAX_CONCURRENCY", 10)
+
+    async def scenario():
+        await redis_client.xgroup_create(JOB_STREAM_KEY, JOB_CONSUMER_GROUP, mkstream=True)
+        # With one undelivered entry allowed on the stream, only the first job is dispatched,
+        # leaving Alice with nothing waiting until her second job comes in
+        for job_id, user_id, priority in (("a1", "alice", "interactive"), ("a2", "alice", "bulk"), ("b1", "bob", "interactive")):
+            await job_scheduler.schedule_job(redis_client, {"job_id": job_id, "user_id": user_id}, priority, 3)
+        waiting_tags = await redis_client.hgetall(job_scheduler.FLOW_TAGS_KEY)
+
+        await job_scheduler.unschedule_job(redis_client, "b1")
+        await redis_client.xreadgroup(JOB_CONSUMER_GROUP, "worker", {JOB_STREAM_KEY: ">"})
+        await job_scheduler.dispatch_next_job(redis_client)
+        return waiting_tags, await redis_client.hgetall(job_scheduler.FLOW_TAGS_KEY)
+
+    waiting_tags, final_tags = asyncio.run(scenario())
+    assert set(waiting_tags) == {"alice:bulk", "bob:interactive"}
+    # Bob's job was cancelled and Alice's last one dispatched
+    assert final_tags == {}
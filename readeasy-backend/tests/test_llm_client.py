@@ -0,0 +1,82 @@
+"""Gemini calls must reuse the shared client's connections instead of opening one per call."""
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from google import genai
+from google.genai import types
+
+from app.services import llm_client
+
+CALLS = 20
+REPLY = json.dumps({
+    "candidates": [{"content": {"role": "model", "parts": [{"text": "ok"}]}, "finishReason": "STOP"}],
+}).encode()
+
+
+class StubGemini(BaseHTTPRequestHandler):
+    """Answers every generateContent call with "ok". One handler instance serves one connection."""
+    protocol_version = "HTTP/1.1"
+    connections = 0
+
+    def setup(self):
+        super().setup()
+        type(self).connections += 1
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(REPLY)))
+        self.end_headers()
+        self.wfile.write(REPLY)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def stub_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubGemini)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    StubGemini.connections = 0
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+async def timed_calls(get_client) -> float:
+    started = time.perf_counter()
+    for _ in range(CALLS):
+        client = get_client()
+        response = await client.aio.models.generate_content(model="gemini-2.0-flash", contents="text")
+        assert response.text == "ok"
+    return time.perf_counter() - started
+
+
+def test_shared_client_reuses_one_connection(stub_url, monkeypatch):
+    build_options = llm_client._http_options
+    monkeypatch.setattr(llm_client, "_http_options", lambda: build_options().model_copy(update={"base_url": stub_url}))
+
+    async def scenario():
+        # What every rephrase/refinement call used to do
+        per_call = await timed_calls(lambda: genai.Client(
+            api_key="test", http_options=types.HttpOptions(base_url=stub_url)))
+        per_call_connections = StubGemini.connections
+
+        StubGemini.connections = 0
+        try:
+            shared = await timed_calls(lambda: llm_client.get_llm_client("test"))
+        finally:
+            await llm_client.close_llm_client()
+        return per_call, per_call_connections, shared, StubGemini.connections
+
+    per_call, per_call_connections, shared, shared_connections = asyncio.run(scenario())
+    print(f"{CALLS} calls: client per call {per_call * 1000:.0f}ms / {per_call_connections} connections, "
+          f"shared client {shared * 1000:.0f}ms / {shared_connections} connections")
+    assert per_call_connections == CALLS
+    assert shared_connections == 1
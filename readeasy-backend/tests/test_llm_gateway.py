@@ -0,0 +1,184 @@
+"""
+Gemini calls share the quota across processes, back off when throttled, and calls
+nobody is waiting for must not hold up the ones somebody is.
+"""
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from google.genai import types
+
+from app.core import metrics
+from app.core.config import settings
+from app.services import llm_client, llm_gateway
+from app.services.llm_gateway import AdaptiveConcurrencyLimiter, LLMRateLimitError
+
+MODEL = "gemini-2.0-flash"
+REPLY = json.dumps({
+    "candidates": [{"content": {"role": "model", "parts": [{"text": "ok"}]}, "finishReason": "STOP"}],
+}).encode()
+
+
+class ThrottlingGemini(BaseHTTPRequestHandler):
+    """
+    Answers generateContent calls with the queued failures first, e.g. (429, {"Retry-After": "0.3"}),
+    then "ok". Records when each call arrived.
+    """
+    protocol_version = "HTTP/1.1"
+    failures: list[tuple[int, dict]] = []
+    arrivals: list[float] = []
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        type(self).arrivals.append(time.monotonic())
+        status, headers = type(self).failures.pop(0) if type(self).failures else (200, {})
+        body = REPLY if status == 200 else json.dumps({"error": {"code": status, "message": "throttled", "status": "UNAVAILABLE"}}).encode()
+        self.send_response(status)
+        for name, value in {"Content-Type": "application/json", **headers}.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def gemini(redis_client, monkeypatch):
+    """Points the gateway at a local ThrottlingGemini, with the shared bucket in fakeredis and a fresh limiter."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ThrottlingGemini)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    ThrottlingGemini.failures, ThrottlingGemini.arrivals = [], []
+    stub_url = f"http://127.0.0.1:{server.server_port}"
+    build_options = llm_client._http_options
+    monkeypatch.setattr(llm_client, "_http_options", lambda: build_options().model_copy(update={"base_url": stub_url}))
+    monkeypatch.setattr(llm_gateway, "redis_client", redis_client)
+    monkeypatch.setattr(llm_gateway, "_limiter", None)
+    monkeypatch.setattr(settings, "LLM_INITIAL_CONCURRENCY", 8)
+    monkeypatch.setattr(settings, "LLM_RETRY_BASE_DELAY_SECONDS", 0.01)
+    yield ThrottlingGemini
+    server.shutdown()
+    server.server_close()
+
+
+async def call_gemini() -> str:
+    try:
+        response = await llm_gateway.generate_content(MODEL, "text", types.GenerateContentConfig(), "test")
+        return response.text
+    finally:
+        await llm_client.close_llm_client()
+
+
+def counter(name: str) -> float:
+    return metrics.snapshot().get(name, 0)
+
+
+def test_throttled_call_waits_for_retry_after_and_halves_the_limit(gemini):
+    gemini.failures = [(429, {"Retry-After": "0.3"}), (429, {"Retry-After": "0.3"})]
+    throttled_before = counter("llm_throttled_calls")
+
+    assert asyncio.run(call_gemini()) == "ok"
+
+    gaps = [later - earlier for earlier, later in zip(gemini.arrivals, gemini.arrivals[1:])]
+    assert len(gemini.arrivals) == 3
+    assert all(gap >= 0.28 for gap in gaps), gaps
+    assert counter("llm_throttled_calls") - throttled_before == 2
+    # Halved twice from 8, then one fast success adds 1 / limit
+    assert llm_gateway._limiter.limit == 2.5
+
+
+def test_server_errors_are_retried_without_shrinking_the_limit(gemini):
+    gemini.failures = [(503, {}), (500, {})]
+    server_errors_before = counter("llm_server_errors")
+
+    assert asyncio.run(call_gemini()) == "ok"
+
+    assert len(gemini.arrivals) == 3
+    assert counter("llm_server_errors") - server_errors_before == 2
+    assert llm_gateway._limiter.limit == 8 + 1 / 8
+
+
+def test_rate_limit_error_once_retries_run_out(gemini, monkeypatch):
+    monkeypatch.setattr(settings, "LLM_MAX_RETRIES", 2)
+    gemini.failures = [(429, {"Retry-After": "0"})] * 5
+
+    with pytest.raises(LLMRateLimitError):
+        asyncio.run(call_gemini())
+
+    assert len(gemini.arrivals) == 3
+    assert llm_gateway._limiter.limit == 1
+
+
+def test_retry_after_pauses_the_shared_bucket_for_every_process(redis_client, monkeypatch):
+    monkeypatch.setattr(llm_gateway, "redis_client", redis_client)
+
+    async def scenario():
+        # One process is told to back off; another one's next call has to wait too
+        await llm_gateway._pause_bucket(MODEL, 0.3)
+        started = time.monotonic()
+        await llm_gateway._take_from_bucket(MODEL, 10)
+        return time.monotonic() - started
+
+    assert asyncio.run(scenario()) >= 0.25
+
+
+def test_bucket_is_shared_by_all_processes(redis_client, monkeypatch):
+    monkeypatch.setattr(llm_gateway, "redis_client", redis_client)
+    monkeypatch.setattr(settings, "LLM_REQUESTS_PER_MINUTE", 2)
+
+    async def scenario():
+        # The first process uses up the two requests the bucket holds
+        for _ in range(2):
+            await asyncio.wait_for(llm_gateway._take_from_bucket(MODEL, 10), timeout=1)
+        # A second process (no local state in common) finds it empty: the next request is 30s away
+        monkeypatch.setattr(llm_gateway, "_limiter", None)
+        waits_before = counter("llm_bucket_waits")
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(llm_gateway._take_from_bucket(MODEL, 10), timeout=0.2)
+        return counter("llm_bucket_waits") - waits_before
+
+    assert asyncio.run(scenario()) == 1
+
+
+def test_waiting_foreground_calls_start_before_background_calls():
+    async def scenario():
+        limiter = AdaptiveConcurrencyLimiter(initial=1, minimum=1, maximum=1, latency_target=10)
+        started = []
+
+        async def call(name, background):
+            await limiter.acquire(background)
+            started.append(name)
+            await asyncio.sleep(0.01)
+            await limiter.release(latency=0.01, background=background)
+
+        await limiter.acquire()
+        calls = [asyncio.create_task(call(f"background {n}", True)) for n in range(3)]
+        await asyncio.sleep(0)
+        calls += [asyncio.create_task(call(f"foreground {n}", False)) for n in range(2)]
+        await asyncio.sleep(0)
+        await limiter.release(latency=0.01)
+        await asyncio.gather(*calls)
+        return started
+
+    assert asyncio.run(scenario()) == ["foreground 0", "foreground 1", "background 0", "background 1", "background 2"]
+
+
+def test_background_calls_leave_a_slot_free():
+    async def scenario():
+        limiter = AdaptiveConcurrencyLimiter(initial=3, minimum=1, maximum=3, latency_target=10)
+        for _ in range(2):
+            await limiter.acquire(background=True)
+        third_background = asyncio.create_task(limiter.acquire(background=True))
+        await asyncio.sleep(0.01)
+        blocked = not third_background.done()
+        # The free slot goes to a foreground call straight away
+        await asyncio.wait_for(limiter.acquire(), timeout=0.1)
+        third_background.cancel()
+        return blocked
+
+    assert asyncio.run(scenario())
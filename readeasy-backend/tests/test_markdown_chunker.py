@@ -0,0 +1,104 @@
+"""Oversized pages are refined in chunks that keep blocks whole and stitch back into the page."""
+import asyncio
+import re
+from types import SimpleNamespace
+
+import pytest
+
+from app.core import metrics
+from app.core.config import settings
+from app.services import text_refiner
+from app.services.markdown_chunker import chunk_markdown, estimate_tokens, stitch_chunks
+
+BUDGET = 120
+PARAGRAPH = "Attention weights are computed from queries and keys, then used to mix the values of every position."
+TABLE = "\n".join(["| Model | Layers | Accuracy |", "|---|---|---|"] + [f"| model-{n} | {n} | 0.{n}1 |" for n in range(8)])
+MATH = "$$\n\\mathrm{softmax}(x)_i = \\frac{e^{x_i}}{\\sum_j e^{x_j}}\n$$"
+IMAGE = "See the plot ![Loss curve](http://localhost:8001/api/v1/images/img-0-abc.png) for the loss."
+
+DOCUMENTS = {
+    "sections": "\n\n".join(["# Results", PARAGRAPH, TABLE, "## Softmax", MATH, IMAGE, PARAGRAPH, "## Notes", PARAGRAPH] * 2),
+    "irregular spacing": f"\n{PARAGRAPH}\n{TABLE}\n\n\n{MATH}\n{IMAGE}\n\n" + "\n\n\n".join([PARAGRAPH] * 6) + "\n",
+    "oversized table": "\n".join(["# Appendix", "", PARAGRAPH, TABLE.split("\n")[0], TABLE.split("\n")[1]]
+                                 + [f"| model-{n} | {n} | 0.{n}1 |" for n in range(60)] + ["", PARAGRAPH]),
+    "oversized math": "\n\n".join([PARAGRAPH, "$$\n" + " + ".join(f"x_{{{n}}}^2" for n in range(80)) + "\n$$", PARAGRAPH]),
+}
+
+
+@pytest.mark.parametrize("name", DOCUMENTS)
+def test_stitching_the_chunks_gives_the_original_document(name):
+    chunks = chunk_markdown(DOCUMENTS[name], BUDGET)
+    assert len(chunks) > 1
+    assert stitch_chunks(chunks) == DOCUMENTS[name]
+
+
+@pytest.mark.parametrize("name", ["sections", "irregular spacing"])
+def test_tables_math_and_image_tags_are_never_split(name):
+    chunks = chunk_markdown(DOCUMENTS[name], BUDGET)
+    for block in (TABLE, MATH, IMAGE):
+        occurrences = DOCUMENTS[name].count(block)
+        assert sum(chunk.count(block) for chunk in chunks) == occurrences
+    assert all(estimate_tokens(chunk) <= BUDGET for chunk in chunks)
+
+
+def test_oversized_table_is_split_between_rows_with_the_header_repeated():
+    chunks = chunk_markdown(DOCUMENTS["oversized table"], BUDGET)
+    table_chunks = [chunk for chunk in chunks if "| model-" in chunk]
+
+    assert len(table_chunks) > 2
+    assert all(estimate_tokens(chunk) <= BUDGET for chunk in chunks)
+    for chunk in table_chunks:
+        rows = [line for line in chunk.split("\n") if line.startswith("|")]
+        assert rows[:2] == TABLE.split("\n")[:2]
+        assert all(re.fullmatch(r"\| model-\d+ \| \d+ \| 0\.\d+1 \|", row) for row in rows[2:])
+
+
+def test_other_blocks_over_the_budget_stay_whole():
+    chunks = chunk_markdown(DOCUMENTS["oversized math"], BUDGET)
+    [math_chunk] = [chunk for chunk in chunks if "$$" in chunk]
+
+    assert estimate_tokens(math_chunk) > BUDGET
+    assert math_chunk.strip().startswith("$$") and math_chunk.strip().endswith("$$")
+
+
+def refinement_stub(monkeypatch, finish_reason: str):
+    """Gemini answering every refinement with the page unchanged (cut short for MAX_TOKENS)."""
+    monkeypatch.setattr(settings, "GOOGLE_API_KEY", "test")
+    monkeypatch.setattr(settings, "REFINEMENT_CACHE_ENABLED", False)
+    monkeypatch.setattr(settings, "REFINE_CHUNK_MAX_TOKENS", BUDGET)
+    prefix, suffix = text_refiner.REFINE_PROMPT_TEMPLATE.format(context="paper", markdown_content="\0").split("\0")
+    calls = []
+
+    async def generate_content(model_name, prompt, generation_config, api_key, background=False):
+        markdown = prompt[len(prefix):len(prompt) - len(suffix)]
+        calls.append(markdown)
+        text = markdown[:len(markdown) // 2] if finish_reason == "MAX_TOKENS" else markdown
+        return SimpleNamespace(candidates=[SimpleNamespace(
+            finish_reason=finish_reason, safety_ratings=None,
+            content=SimpleNamespace(parts=[SimpleNamespace(text=text)]),
+        )])
+
+    monkeypatch.setattr(text_refiner, "generate_content", generate_content)
+    return calls
+
+
+def test_chunked_refinement_rebuilds_the_page(monkeypatch):
+    calls = refinement_stub(monkeypatch, "STOP")
+    document = DOCUMENTS["oversized table"]
+
+    refined = asyncio.run(text_refiner.refine_markdown(document, "paper"))
+
+    assert len(calls) > 2
+    # The split table comes back as one table
+    assert refined == document.strip()
+
+
+def test_truncated_refinement_falls_back_to_the_unrefined_chunk(monkeypatch):
+    calls = refinement_stub(monkeypatch, "MAX_TOKENS")
+    fallbacks_before = metrics.snapshot().get("refinement_truncated_fallbacks", 0)
+
+    refined = asyncio.run(text_refiner.refine_markdown(PARAGRAPH, "paper"))
+
+    assert len(calls) == 1
+    assert refined == PARAGRAPH
+    assert metrics.snapshot().get("refinement_truncated_fallbacks", 0) - fallbacks_before == 1
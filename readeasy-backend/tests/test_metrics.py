@@ -0,0 +1,35 @@
+"""Counters from every process add up in /api/metrics."""
+import asyncio
+
+from fastapi.testclient import TestClient
+
+import main
+from app.core import metrics
+
+
+def test_metrics_endpoint_reports_counters_of_all_processes(redis_client, monkeypatch):
+    monkeypatch.setattr(main, "redis_client", redis_client)
+    # Another worker process already flushed its counters
+    asyncio.run(redis_client.hincrbyfloat(metrics.METRICS_KEY, "test_refinement_cache_hits", 5))
+    metrics.increment("test_refinement_cache_hits", 2)
+
+    client = TestClient(main.app)
+    first = client.get("/api/metrics").json()
+    second = client.get("/api/metrics").json()
+
+    assert first["counters"]["test_refinement_cache_hits"] == 7
+    # Increments are added to the shared totals once
+    assert second["counters"]["test_refinement_cache_hits"] == 7
+    assert second["process"]["test_refinement_cache_hits"] == 2
+
+
+def test_failed_flush_keeps_increments(redis_client):
+    class UnavailableRedis:
+        async def hincrbyfloat(self, *args):
+            raise ConnectionError("Redis is down")
+
+    metrics.increment("test_jobs_resumed")
+    asyncio.run(metrics.flush(UnavailableRedis()))
+    asyncio.run(metrics.flush(redis_client))
+
+    assert asyncio.run(metrics.shared_snapshot(redis_client))["test_jobs_resumed"] == 1
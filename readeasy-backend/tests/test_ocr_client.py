@@ -0,0 +1,61 @@
+"""OCR calls must not stall the event loop that serves polling and health checks."""
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+
+from app.services.ocr_client import MistralOCRClient
+
+
+def fake_sdk(in_flight: list[int], release: asyncio.Event) -> SimpleNamespace:
+    """The async half of the Mistral SDK, with OCR calls held open until release is set."""
+    async def remote_call(result):
+        in_flight[0] += 1
+        in_flight[1] = max(in_flight[1], in_flight[0])
+        try:
+            await release.wait()
+            return result
+        finally:
+            in_flight[0] -= 1
+
+    return SimpleNamespace(
+        files=SimpleNamespace(
+            upload_async=lambda file, purpose: remote_call(SimpleNamespace(id="file-1")),
+            get_signed_url_async=lambda file_id: remote_call(SimpleNamespace(url="https://files/1")),
+            delete_async=lambda file_id: remote_call(None),
+        ),
+        ocr=SimpleNamespace(process_async=lambda **kwargs: remote_call(SimpleNamespace(pages=[]))),
+    )
+
+
+async def ocr_job(ocr: MistralOCRClient):
+    file_id = await ocr.upload("doc.pdf", b"%PDF")
+    await ocr.process(await ocr.get_signed_url(file_id))
+    await ocr.delete(file_id)
+
+
+def test_health_checks_are_served_while_ocr_calls_are_open():
+    from main import app
+
+    async def scenario():
+        in_flight = [0, 0]
+        release = asyncio.Event()
+        ocr = MistralOCRClient(api_key="test", max_concurrency=3)
+        ocr.client = fake_sdk(in_flight, release)
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            jobs = asyncio.gather(*(ocr_job(ocr) for _ in range(6)))
+            while in_flight[0] < 3:
+                await asyncio.sleep(0.01)
+            # A blocking OCR call would hold the event loop, so no health check could finish now
+            statuses = [(await client.get("/api/health")).status_code for _ in range(10)]
+            still_open = in_flight[0]
+            release.set()
+            await jobs
+        return statuses, still_open, in_flight[1]
+
+    statuses, still_open, max_in_flight = asyncio.run(scenario())
+    assert statuses == [200] * 10
+    assert still_open == 3
+    # OCR_MAX_CONCURRENCY bounds the calls made at once
+    assert max_in_flight == 3
@@ -0,0 +1,37 @@
+"""
+The refinement threshold must separate the labelled pages in fixtures/ocr_pages:
+clean_*.md are correct OCR output, broken_*.md need the LLM.
+"""
+from pathlib import Path
+
+from app.core.config import settings
+from app.services.document_processing import fix_markdown_tables
+from app.services.ocr_quality import needs_refinement, score_ocr_markdown
+
+PAGES_DIR = Path(__file__).parent / "fixtures" / "ocr_pages"
+
+
+def labelled_pages(prefix: str) -> dict[str, str]:
+    return {path.stem: path.read_text() for path in sorted(PAGES_DIR.glob(f"{prefix}_*.md"))}
+
+
+def test_default_threshold_separates_labelled_pages():
+    clean = {name: score_ocr_markdown(page) for name, page in labelled_pages("clean").items()}
+    broken = {name: score_ocr_markdown(page) for name, page in labelled_pages("broken").items()}
+    threshold = settings.OCR_REFINEMENT_THRESHOLD
+
+    print(f"threshold {threshold}: clean pages score at most {max(clean.values()):.3f}, "
+          f"broken pages at least {min(broken.values()):.3f}; "
+          f"{len(clean)}/{len(clean) + len(broken)} LLM calls avoided")
+    assert [name for name, page in labelled_pages("clean").items() if needs_refinement(page, threshold)] == []
+    assert [name for name, page in labelled_pages("broken").items() if not needs_refinement(page, threshold)] == []
+    # Neither side sits right at the threshold
+    assert max(clean.values()) < threshold / 2
+    assert min(broken.values()) > threshold * 1.5
+
+
+def test_broken_tables_are_only_visible_before_they_are_fixed():
+    page = (PAGES_DIR / "broken_table.md").read_text()
+
+    assert score_ocr_markdown(page) == 1.0
+    assert score_ocr_markdown(fix_markdown_tables(page)) < settings.OCR_REFINEMENT_THRESHOLD
@@ -0,0 +1,54 @@
+"""Reprocessing a document refines its pages from the cache, even though its images are saved under new names."""
+import asyncio
+from types import SimpleNamespace
+
+from app.core.config import settings
+from app.services import document_processing, job_store, refinement_cache, text_refiner
+from helpers import FakeOCR, blank_pdf
+
+
+def test_pages_with_images_hit_the_cache_when_reprocessed(workdir, redis_client, monkeypatch):
+    monkeypatch.setattr(settings, "OCR_CHUNK_PAGES", 2)
+    monkeypatch.setattr(settings, "TEXT_LAYER_FAST_PATH", False)
+    monkeypatch.setattr(settings, "GOOGLE_API_KEY", "test")
+    monkeypatch.setattr(settings, "OCR_REFINEMENT_THRESHOLD", 0)
+    monkeypatch.setattr(refinement_cache, "redis_client", redis_client)
+    monkeypatch.setattr(refinement_cache, "_local_cache", refinement_cache.LocalLRUCache(1024 * 1024))
+    (workdir / "doc.pdf").write_bytes(blank_pdf(2))
+    gemini_calls = []
+
+    async def generate_content(model_name, prompt, generation_config, api_key, background=False):
+        gemini_calls.append(prompt)
+        # Keep the page's image tags, not the prompt's "![alt text](url)" example
+        images = [match.group(0) for match in refinement_cache.IMAGE_TARGET_PATTERN.finditer(prompt)
+                  if match.group(2).startswith("http")]
+        return SimpleNamespace(candidates=[SimpleNamespace(
+            finish_reason="STOP", safety_ratings=None,
+            content=SimpleNamespace(parts=[SimpleNamespace(text="\n\n".join(["Refined page.", *images]))]),
+        )])
+
+    monkeypatch.setattr(text_refiner, "generate_content", generate_content)
+
+    async def process(job_id: str) -> list[dict]:
+        await job_store.create_job(redis_client, job_id, status="queued")
+        # A fresh OCR stand-in returns the same markdown and images as the first run
+        await document_processing.run_mistral_ocr_processing(
+            job_id, workdir / "doc.pdf", "doc.pdf", redis_client, ocr=FakeOCR()
+        )
+        return await job_store.get_pages(redis_client, job_id)
+
+    first_pages = asyncio.run(process("first"))
+    calls_after_first_run = len(gemini_calls)
+    # Another worker process: only the Redis tier is shared
+    refinement_cache._local_cache = refinement_cache.LocalLRUCache(1024 * 1024)
+    second_pages = asyncio.run(process("second"))
+
+    assert calls_after_first_run == 2
+    assert len(gemini_calls) == 2, "the second run should have been refined from the cache"
+    for first_page, second_page in zip(first_pages, second_pages):
+        first_images = refinement_cache.image_targets(first_page["markdown_content"])
+        second_images = refinement_cache.image_targets(second_page["markdown_content"])
+        assert second_page["markdown_content"].startswith("Refined page.")
+        # Cached refinements point at the images this run saved
+        assert len(second_images) == 1 and second_images != first_images
+        assert (workdir / "static" / "temp_images" / second_images[0].rsplit("/", 1)[1]).exists()
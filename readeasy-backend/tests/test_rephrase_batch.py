@@ -0,0 +1,26 @@
+"""Batch rephrasing counts each cache miss once, whichever way the item is answered."""
+import asyncio
+
+from app.core import metrics
+from app.services import rephrase_batch
+
+
+async def collect(r, items, rephrase_functions):
+    return [result async for result in rephrase_batch.run_rephrase_batch(r, items, rephrase_functions)]
+
+
+def test_pack_fallback_counts_each_miss_once(redis_client, monkeypatch):
+    async def failed_pack(text_contents, mode, context):
+        return None
+
+    async def summarize(text, context):
+        return f"summary of {text}"
+
+    monkeypatch.setattr(rephrase_batch, "rephrase_packed", failed_pack)
+    items = [{"text_content": f"passage {n}", "mode": "summarize", "document_type": "paper"} for n in range(3)]
+    misses = metrics.snapshot().get("rephrase_cache_misses", 0)
+
+    results = asyncio.run(collect(redis_client, items, {"summarize": summarize}))
+
+    assert sorted(result["rephrased_text"] for result in results) == [f"summary of passage {n}" for n in range(3)]
+    assert metrics.snapshot()["rephrase_cache_misses"] - misses == 3
@@ -0,0 +1,25 @@
+"""Rephrase cache keys ignore formatting noise, but not content, and change with the prompts."""
+from app.services import rephrase_cache, text_refiner
+from app.services.refinement_cache import prompt_version
+from app.services.rephrase_cache import normalize_rephrase_text, rephrase_cache_key
+
+
+def test_formatting_noise_is_ignored():
+    assert normalize_rephrase_text("## The **attention**  *layer*\n- uses `softmax`") == "The attention layer uses softmax"
+    assert normalize_rephrase_text("***key*** point") == "key point"
+
+
+def test_lone_markers_are_content():
+    assert rephrase_cache_key("eli5", "paper", "2 * 3") != rephrase_cache_key("eli5", "paper", "2 3")
+    assert normalize_rephrase_text("x_i * y_i") == "x_i * y_i"
+
+
+def test_editing_a_prompt_changes_its_modes_keys(monkeypatch):
+    eli5_key = rephrase_cache_key("eli5", "paper", "text")
+    summarize_key = rephrase_cache_key("summarize", "paper", "text")
+    edited = text_refiner.ELI5_PROMPT_TEMPLATE + "\nUse short sentences."
+    monkeypatch.setitem(rephrase_cache.REPHRASE_PROMPT_VERSIONS, "eli5",
+                        prompt_version(edited + text_refiner.PACKED_REPHRASE_INSTRUCTIONS))
+
+    assert rephrase_cache_key("eli5", "paper", "text") != eli5_key
+    assert rephrase_cache_key("summarize", "paper", "text") == summarize_key
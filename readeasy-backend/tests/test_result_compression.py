@@ -0,0 +1,106 @@
+"""Stored pages must take less Redis memory and go out smaller, without serving them getting slower (a benchmark)."""
+import asyncio
+import gzip
+import json
+import time
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from app.auth.service import get_current_active_user
+from app.core.config import settings
+from app.core.redis_client import get_redis_client
+from app.schemas.auth import User
+from app.services import job_store
+
+PAGE_COUNT = 30
+REQUESTS = 20
+FIXTURES = sorted((Path(__file__).parent / "fixtures" / "ocr_pages").glob("clean_*.md"))
+
+
+def document_pages() -> list[dict]:
+    """Pages of a few KB of markdown each, like refined OCR output, built from the clean OCR fixtures."""
+    sections = [fixture.read_text() for fixture in FIXTURES]
+    return [
+        {
+            "page_number": number,
+            "markdown_content": "\n\n".join(sections[number % len(sections):] + sections[:number % len(sections)]),
+            "refined": True,
+            "version": 1,
+        }
+        for number in range(1, PAGE_COUNT + 1)
+    ]
+
+
+@pytest.fixture
+def client(workdir, redis_client):
+    main.app.dependency_overrides[get_current_active_user] = lambda: User(id="alice", username="alice")
+    main.app.dependency_overrides[get_redis_client] = lambda: redis_client
+    yield TestClient(main.app)
+    main.app.dependency_overrides.clear()
+
+
+def store_document(redis_client, job_id: str) -> int:
+    """Stores the pages with the configured codec and returns the bytes they take in Redis."""
+    async def store():
+        await job_store.create_job(redis_client, job_id, status="completed", user_id="alice",
+                                   file_name="notes.pdf", total_pages=PAGE_COUNT)
+        await job_store.save_pages(redis_client, job_id, document_pages())
+        return sum(len(value) for value in (await redis_client.hgetall(job_store.pages_key(job_id))).values())
+    return asyncio.run(store())
+
+
+def serve(client: TestClient, job_id: str, accept_encoding: str, requests: int = 1) -> tuple[float, int, list[dict]]:
+    """Median latency, wire size and decoded pages of the page range endpoint."""
+    url = f"/api/v1/process/{job_id}/pages?start=1&count={PAGE_COUNT}"
+    timings = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        # stream=True keeps the body as sent, so its wire size can be measured
+        with client.stream("GET", url, headers={"Accept-Encoding": accept_encoding}) as response:
+            body = b"".join(response.iter_raw())
+        timings.append(time.perf_counter() - started)
+    assert response.status_code == 200
+    if response.headers.get("content-encoding") == "gzip":
+        pages = json.loads(gzip.decompress(body))["pages"]
+    else:
+        pages = json.loads(body)["pages"]
+    return sorted(timings)[len(timings) // 2], len(body), pages
+
+
+@pytest.fixture
+def stored(redis_client, monkeypatch) -> tuple[int, int]:
+    """The document stored as plain JSON (job "plain") and gzipped (job "gzip"), and the bytes each takes."""
+    monkeypatch.setattr(settings, "RESULT_COMPRESSION", "none")
+    plain_bytes = store_document(redis_client, "plain")
+    monkeypatch.setattr(settings, "RESULT_COMPRESSION", "gzip")
+    return plain_bytes, store_document(redis_client, "gzip")
+
+
+def test_compressed_pages_are_smaller(client, stored):
+    plain_bytes, gzip_bytes = stored
+    _, plain_wire, plain_pages = serve(client, "plain", "identity")
+    _, passthrough_wire, passthrough_pages = serve(client, "gzip", "gzip")
+    _, decoded_wire, decoded_pages = serve(client, "gzip", "identity")
+
+    print(f"{PAGE_COUNT} pages stored: plain {plain_bytes / 1024:.0f} KB, gzip {gzip_bytes / 1024:.0f} KB "
+          f"({plain_bytes / gzip_bytes:.1f}x); sent gzipped: {passthrough_wire / 1024:.0f} KB")
+    assert plain_pages == passthrough_pages == decoded_pages == document_pages()
+    assert decoded_wire == plain_wire
+    # Compression is deterministic; base64 costs a third of the stored savings
+    assert plain_bytes / gzip_bytes > 1.4
+    assert passthrough_wire < plain_wire / 1.9
+
+
+@pytest.mark.benchmark
+def test_compressed_pages_are_served_as_fast(client, stored):
+    plain_latency, _, _ = serve(client, "plain", "identity", REQUESTS)
+    passthrough_latency, _, _ = serve(client, "gzip", "gzip", REQUESTS)
+    decoded_latency, _, _ = serve(client, "gzip", "identity", REQUESTS)
+
+    print(f"served: plain {plain_latency * 1000:.1f}ms, gzip passthrough {passthrough_latency * 1000:.1f}ms, "
+          f"gzip decoded for identity clients {decoded_latency * 1000:.1f}ms")
+    # Passthrough copies the stored bytes; allow for scheduling noise
+    assert passthrough_latency < plain_latency * 1.5 + 0.005
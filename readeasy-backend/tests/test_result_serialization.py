@@ -0,0 +1,72 @@
+"""Sending stored pages as-is must give the same result as parsing, validating and re-encoding them, only faster."""
+import json
+import time
+
+import pytest
+from fastapi.encoders import jsonable_encoder
+
+from app.api.endpoints.process import PAGES_PLACEHOLDER, stored_pages_response
+from app.core.config import settings
+from app.schemas.processing import ProcessingResult
+from app.services.result_codec import decode_stored, encode_stored
+
+ROUNDS = 10
+WORDS = "the model uses attention | $x_i$ layer softmax ![figure](/api/v1/images/fig.png) über".split()
+
+
+def stored_document(page_count: int) -> list[str]:
+    pages = [
+        {
+            "page_number": number,
+            "markdown_content": " ".join(WORDS[(number + position) % len(WORDS)] for position in range(500)),
+            "refined": True,
+            "version": 1,
+        }
+        for number in range(1, page_count + 1)
+    ]
+    return [encode_stored(json.dumps(page)) for page in pages]
+
+
+def revalidated_body(stored_pages: list[str]) -> bytes:
+    """How the completed result used to be built: every page parsed into the response model and encoded again."""
+    pages = [json.loads(decode_stored(stored_page)) for stored_page in stored_pages]
+    result = ProcessingResult(file_name="notes.pdf", total_pages=len(pages), pages=pages)
+    return json.dumps(jsonable_encoder({"status": "completed", "result": result})).encode("utf-8")
+
+
+def passthrough_body(stored_pages: list[str]) -> bytes:
+    envelope = {"status": "completed", "result": {
+        "file_name": "notes.pdf", "total_pages": len(stored_pages), "pages": PAGES_PLACEHOLDER,
+    }}
+    return stored_pages_response(envelope, stored_pages, None).body
+
+
+def timed(build, stored_pages: list[str]) -> float:
+    build(stored_pages)
+    started = time.perf_counter()
+    for _ in range(ROUNDS):
+        build(stored_pages)
+    return (time.perf_counter() - started) / ROUNDS
+
+
+@pytest.fixture
+def plain_storage(monkeypatch):
+    # Plain stored pages, so both paths send the same uncompressed JSON
+    monkeypatch.setattr(settings, "RESULT_COMPRESSION", "none")
+
+
+@pytest.mark.parametrize("page_count", [10, 100, 500])
+def test_passthrough_sends_the_same_result(page_count, plain_storage):
+    stored_pages = stored_document(page_count)
+    assert json.loads(passthrough_body(stored_pages)) == json.loads(revalidated_body(stored_pages))
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("page_count", [10, 100, 500])
+def test_passthrough_beats_revalidating_pages(page_count, plain_storage):
+    stored_pages = stored_document(page_count)
+    revalidated = timed(revalidated_body, stored_pages)
+    passthrough = timed(passthrough_body, stored_pages)
+    assert passthrough < revalidated / 5, (
+        f"{page_count} pages: revalidated {revalidated * 1000:.2f}ms, passthrough {passthrough * 1000:.2f}ms"
+    )
@@ -0,0 +1,60 @@
+"""A job redelivered after its worker died redoes as little OCR and LLM work as possible."""
+import asyncio
+
+from app.core.config import settings
+from app.services import document_processing, job_store
+from helpers import FakeOCR, blank_pdf
+
+PAGES = 6
+
+
+def test_resumed_job_skips_finished_ocr_and_refinement(workdir, redis_client, monkeypatch):
+    monkeypatch.setattr(settings, "OCR_CHUNK_PAGES", 2)
+    monkeypatch.setattr(settings, "OCR_CHUNK_CONCURRENCY", 3)
+    monkeypatch.setattr(settings, "PAGE_REFINEMENT_CONCURRENCY", 2)
+    monkeypatch.setattr(settings, "TEXT_LAYER_FAST_PATH", False)
+    monkeypatch.setattr(settings, "GOOGLE_API_KEY", "test")
+    monkeypatch.setattr(settings, "OCR_REFINEMENT_THRESHOLD", 0)
+    monkeypatch.setattr(document_processing, "CANCEL_REPEAT_SECONDS", 0.05)
+    (workdir / "doc.pdf").write_bytes(blank_pdf(PAGES))
+    refined = []
+
+    async def refine_markdown(markdown, context, background=False):
+        await asyncio.sleep(0.2)
+        refined.append(markdown)
+        return f"Refined: {markdown}"
+
+    monkeypatch.setattr(document_processing, "refine_markdown", refine_markdown)
+
+    async def run(ocr):
+        await document_processing.run_mistral_ocr_processing("job", workdir / "doc.pdf", "doc.pdf", redis_client, ocr=ocr)
+
+    async def scenario():
+        await job_store.create_job(redis_client, "job", status="queued")
+        first_ocr = FakeOCR(delay=0.05)
+        worker = asyncio.create_task(run(first_ocr))
+        # Kill the worker once OCR is done and the first pages are refined
+        while len(await job_store.get_pages(redis_client, "job")) < 2:
+            await asyncio.sleep(0.01)
+        worker.cancel()
+        await asyncio.gather(worker, return_exceptions=True)
+        refined_before_crash = len(refined)
+
+        second_ocr = FakeOCR(delay=0.05)
+        await run(second_ocr)
+        return first_ocr, second_ocr, refined_before_crash
+
+    first_ocr, second_ocr, refined_before_crash = asyncio.run(scenario())
+    job = asyncio.run(job_store.get_job(redis_client, "job"))
+    pages = asyncio.run(job_store.get_pages(redis_client, "job"))
+    assert job["status"] == "completed"
+    assert [page["page_number"] for page in pages] == list(range(1, PAGES + 1))
+    assert all(page["markdown_content"].startswith("Refined: ") for page in pages)
+    # Every page was OCR'd before the crash, so the resumed run needs no OCR at all
+    assert first_ocr.process_calls == PAGES // 2
+    assert second_ocr.process_calls == 0, f"resumed run made {second_ocr.process_calls} OCR calls"
+    # Only pages without a stored refinement were refined again
+    assert len(refined) - refined_before_crash == PAGES - 2, (
+        f"{refined_before_crash} refinements before the crash, {len(refined) - refined_before_crash} after"
+    )
+    assert not asyncio.run(redis_client.exists(job_store.checkpoint_key("job")))
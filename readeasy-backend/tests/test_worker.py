@@ -0,0 +1,108 @@
+"""Jobs a worker took but never acknowledged must be retried, given up on, or released, never stuck."""
+import asyncio
+import functools
+
+import pytest
+
+import worker
+from app.core.config import settings
+from app.services import job_queue, job_scheduler, job_store
+from helpers import FakeOCR, blank_pdf
+
+
+@pytest.fixture
+def queue_settings(workdir, monkeypatch):
+    monkeypatch.setattr(settings, "UPLOAD_SPOOL_DIR", str(workdir / "spool"))
+    monkeypatch.setattr(settings, "OCR_CHUNK_PAGES", 2)
+    monkeypatch.setattr(settings, "TEXT_LAYER_FAST_PATH", False)
+    monkeypatch.setattr(settings, "GOOGLE_API_KEY", None)
+    # An empty stream would otherwise hold the worker loop for the default five seconds
+    monkeypatch.setattr(worker, "read_jobs", functools.partial(job_queue.read_jobs, block_ms=20))
+
+
+async def enqueue(r, job_id: str, user_id: str = "alice") -> dict:
+    """Upload a two-page PDF and dispatch it onto the stream, as the API does."""
+    await job_queue.ensure_consumer_group(r)
+    fields = job_queue.build_job_fields(job_id, "notes.pdf", "cheatsheet", user_id)
+    job_queue.spool_path_for_job(job_id).write_bytes(blank_pdf(2))
+    await job_store.create_job(r, job_id, status="queued", user_id=user_id, file_name="notes.pdf")
+    await job_scheduler.schedule_job(r, fields, "interactive", 2)
+    return fields
+
+
+async def crashed_worker_takes(r, job_id: str) -> str:
+    """A worker reads the job and dies before acknowledging it. Returns the stream entry ID."""
+    [(message_id, fields)] = await job_queue.read_jobs(r, "crashed", block_ms=20)
+    assert fields["job_id"] == job_id
+    return message_id
+
+
+async def queue_state(r) -> tuple[int, dict]:
+    pending = (await r.xpending(job_queue.JOB_STREAM_KEY, job_queue.JOB_CONSUMER_GROUP))["pending"]
+    return pending, await r.hgetall(job_scheduler.RUNNING_COUNTS_KEY)
+
+
+def test_unacknowledged_job_is_reclaimed_after_the_visibility_timeout(redis_client, queue_settings, monkeypatch):
+    monkeypatch.setattr(settings, "JOB_VISIBILITY_TIMEOUT_SECONDS", 1)
+    ocr = FakeOCR()
+
+    async def scenario():
+        await enqueue(redis_client, "job")
+        await crashed_worker_takes(redis_client, "job")
+        # Still within the crashed worker's visibility timeout
+        assert await job_queue.claim_stale_jobs(redis_client, "alive") == []
+        await asyncio.sleep(1.1)
+
+        stop_event = asyncio.Event()
+        worker_task = asyncio.create_task(worker.run_worker("alive", 1, ocr=ocr, r=redis_client, stop_event=stop_event))
+        for _ in range(200):
+            if (await job_store.get_job(redis_client, "job"))["status"] == "completed":
+                break
+            await asyncio.sleep(0.05)
+        stop_event.set()
+        await worker_task
+        return await job_store.get_job(redis_client, "job"), await queue_state(redis_client)
+
+    job, (pending, running) = asyncio.run(scenario())
+    assert job["status"] == "completed"
+    assert ocr.process_calls == 1
+    assert pending == 0
+    assert running == {}
+    assert not job_queue.spool_path_for_job("job").exists()
+
+
+def test_job_over_the_delivery_limit_fails(redis_client, queue_settings, monkeypatch):
+    monkeypatch.setattr(settings, "JOB_VISIBILITY_TIMEOUT_SECONDS", 0)
+    monkeypatch.setattr(settings, "JOB_MAX_DELIVERIES", 1)
+
+    async def scenario():
+        await enqueue(redis_client, "job")
+        await crashed_worker_takes(redis_client, "job")
+        # Reclaiming is the second delivery
+        assert await worker._next_job(redis_client, "alive") is None
+        return await job_store.get_job(redis_client, "job"), await queue_state(redis_client)
+
+    job, (pending, running) = asyncio.run(scenario())
+    assert job["status"] == "error"
+    assert "failed repeatedly" in job["detail"]
+    assert pending == 0
+    assert running == {}
+    assert not job_queue.spool_path_for_job("job").exists()
+
+
+def test_trimmed_entry_frees_its_users_slot(redis_client, queue_settings, monkeypatch):
+    monkeypatch.setattr(settings, "JOB_VISIBILITY_TIMEOUT_SECONDS", 0)
+
+    async def scenario():
+        await enqueue(redis_client, "job")
+        message_id = await crashed_worker_takes(redis_client, "job")
+        running_before = await redis_client.hgetall(job_scheduler.RUNNING_COUNTS_KEY)
+        await redis_client.xdel(job_queue.JOB_STREAM_KEY, message_id)
+        assert await worker._next_job(redis_client, "alive") is None
+        return running_before, await queue_state(redis_client), await redis_client.hgetall(job_scheduler.ENTRY_USERS_KEY)
+
+    running_before, (pending, running), entry_users = asyncio.run(scenario())
+    assert running_before == {"alice": "1"}
+    assert pending == 0
+    assert running == {}
+    assert entry_users == {}
@@ -0,0 +1,219 @@
+"""
+OCR worker entry point.
+
+Workers consume processing jobs enqueued by the API from the Redis stream (see
+app/services/job_queue.py) and run the OCR + refinement pipeline outside the web
+process. Scale out by running more processes on a machine or more machines pointed
+at the same Redis instance and upload spool directory:
+
+    python worker.py --processes 4
+
+Each process runs up to WORKER_CONCURRENCY jobs at a time.
+
+Workers need a native Redis connection: consumer groups and pub/sub aren't available
+over Upstash's REST API. With Upstash, run the API with USE_UPSTASH=true and the workers
+without it, pointing REDIS_HOST, REDIS_PORT, REDIS_PASSWORD and REDIS_SSL=true at the
+same database's Redis endpoint.
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import time
+from pathlib import Path
+
+from app.core import metrics
+from app.core.config import settings
+from app.core.redis_client import redis_client, close_redis_client, UpstashRedisWrapper
+from app.services.document_processing import run_mistral_ocr_processing
+from app.services.job_store import update_job
+from app.services.job_scheduler import dispatch_next_job, release_user_slot, record_job_duration
+from app.services.llm_client import close_llm_client
+from app.services.job_queue import (
+    ensure_consumer_group,
+    read_jobs,
+    claim_stale_jobs,
+    heartbeat_job,
+    ack_job,
+)
+from app.services.ocr_client import MistralOCRClient
+from app.services.result_cache import release_fingerprint
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    handlers=[
+        logging.StreamHandler()
+    ]
+)
+
+logger = logging.getLogger(__name__)
+
+
+async def _heartbeat(r, consumer: str, message_id: str):
+    """Keep claiming the job while it runs so it isn't redelivered to another worker."""
+    interval = max(1, settings.JOB_VISIBILITY_TIMEOUT_SECONDS // 3)
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await heartbeat_job(r, consumer, message_id)
+        except Exception as e:
+            logger.warning(f"Heartbeat for stream entry {message_id} failed: {e}")
+
+
+async def _fail_job(r, message_id: str, fields: dict, detail: str):
+    """Mark a job as failed, acknowledge it and remove its spooled upload."""
+    await update_job(r, fields["job_id"], status="error", detail=detail)
+    if fields.get("fingerprint"):
+        await release_fingerprint(r, fields["fingerprint"], fields["job_id"])
+    await ack_job(r, message_id)
+    await release_user_slot(r, message_id, fields.get("user_id", ""))
+    Path(fields["file_path"]).unlink(missing_ok=True)
+
+
+async def handle_job(r, consumer: str, message_id: str, fields: dict, ocr: MistralOCRClient | None = None):
+    """Run a single queued job and acknowledge it once it reached a final state."""
+    job_id = fields["job_id"]
+    file_path = Path(fields["file_path"])
+    logger.info(f"Worker {consumer}: Picked up job {job_id} (stream entry {message_id})")
+
+    if not file_path.exists():
+        logger.error(f"Job {job_id}: Uploaded file {file_path} is missing")
+        await _fail_job(r, message_id, fields, "The uploaded file is no longer available. Please upload it again.")
+        return
+
+    heartbeat_task = asyncio.create_task(_heartbeat(r, consumer, message_id))
+    started = time.monotonic()
+    try:
+        # Errors inside the pipeline are recorded on the job itself, so returning means it is final
+        await run_mistral_ocr_processing(
+            job_id, file_path, fields.get("file_name", ""), r, fields.get("document_type", "cheatsheet"),
+            ocr=ocr, fingerprint=fields.get("fingerprint") or None,
+            fast_first_view=fields.get("fast_first_view") == "1"
+        )
+    finally:
+        heartbeat_task.cancel()
+
+    await ack_job(r, message_id)
+    await release_user_slot(r, message_id, fields.get("user_id", ""))
+    file_path.unlink(missing_ok=True)
+    # Keeps queue ETAs (see job_scheduler.get_queue_position) in line with real throughput
+    await record_job_duration(r, time.monotonic() - started, int(fields.get("page_count") or 0))
+
+
+async def _next_job(r, consumer: str):
+    """Prefer reclaiming stuck jobs over reading new ones so crashed work is retried promptly."""
+    for message_id, fields, times_delivered in await claim_stale_jobs(r, consumer, count=1):
+        if not fields:
+            logger.warning(f"Stream entry {message_id} was trimmed before it finished; freeing its user's slot")
+            await release_user_slot(r, message_id)
+            continue
+        if times_delivered > settings.JOB_MAX_DELIVERIES:
+            logger.error(f"Job {fields.get('job_id')}: Giving up after {times_delivered} deliveries")
+            await _fail_job(r, message_id, fields, "Processing failed repeatedly. Please try uploading the file again.")
+            continue
+        logger.warning(f"Job {fields.get('job_id')}: Reclaimed stuck job (delivery {times_delivered})")
+        return message_id, fields
+
+    # This worker has a free slot, so let the scheduler release the next fair job onto the stream
+    await dispatch_next_job(r)
+    jobs = await read_jobs(r, consumer, count=1)
+    return jobs[0] if jobs else None
+
+
+async def run_worker(consumer: str | None = None, concurrency: int | None = None,
+                     ocr: MistralOCRClient | None = None, r=None, stop_event: asyncio.Event | None = None):
+    """Consume jobs until stop_event is set, running up to concurrency jobs at once."""
+    r = r or redis_client
+    if isinstance(r, UpstashRedisWrapper):
+        raise RuntimeError(
+            "OCR workers need a native Redis connection (streams and pub/sub don't work over Upstash's REST API). "
+            "Run workers without USE_UPSTASH and point REDIS_HOST/REDIS_PORT/REDIS_PASSWORD with REDIS_SSL=true "
+            "at the database's Redis endpoint."
+        )
+    consumer = consumer or f"{socket.gethostname()}-{os.getpid()}"
+    concurrency = max(1, concurrency or settings.WORKER_CONCURRENCY)
+    stop_event = stop_event or asyncio.Event()
+
+    await ensure_consumer_group(r)
+    logger.info(f"Worker {consumer} started (concurrency {concurrency})")
+
+    slots = asyncio.Semaphore(concurrency)
+    running: set[asyncio.Task] = set()
+    # Refinement and resume counters only exist in workers; the API reports them from Redis
+    metrics_flusher = asyncio.create_task(metrics.flush_periodically(r, settings.METRICS_FLUSH_INTERVAL_SECONDS))
+
+    async def run_and_release(message_id: str, fields: dict):
+        try:
+            await handle_job(r, consumer, message_id, fields, ocr=ocr)
+        except Exception as e:
+            # Leave the entry unacknowledged; it is redelivered after the visibility timeout
+            logger.error(f"Worker {consumer}: Job {fields.get('job_id')} failed unexpectedly: {e}")
+        finally:
+            slots.release()
+
+    while not stop_event.is_set():
+        await slots.acquire()
+        try:
+            job = await _next_job(r, consumer)
+        except Exception as e:
+            slots.release()
+            logger.error(f"Worker {consumer}: Error reading from job queue: {e}")
+            await asyncio.sleep(1)
+            continue
+
+        if job is None:
+            slots.release()
+            continue
+
+        task = asyncio.create_task(run_and_release(*job))
+        running.add(task)
+        task.add_done_callback(running.discard)
+
+    # Let in-flight jobs finish before exiting; anything killed mid-way is redelivered
+    if running:
+        logger.info(f"Worker {consumer}: Waiting for {len(running)} running job(s)")
+        await asyncio.gather(*running, return_exceptions=True)
+    metrics_flusher.cancel()
+    await asyncio.gather(metrics_flusher, return_exceptions=True)
+    logger.info(f"Worker {consumer} stopped")
+
+
+async def _main(concurrency: int | None):
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+    try:
+        await run_worker(concurrency=concurrency, stop_event=stop_event)
+    finally:
+        await close_redis_client()
+        await close_llm_client()
+
+
+def _worker_process(concurrency: int | None):
+    asyncio.run(_main(concurrency))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run ReadEasy OCR workers")
+    parser.add_argument("--processes", type=int, default=int(os.environ.get("WORKER_PROCESSES", 1)),
+                        help="Number of worker processes to start (one event loop each)")
+    parser.add_argument("--concurrency", type=int, default=None,
+                        help="Jobs per process (defaults to WORKER_CONCURRENCY)")
+    args = parser.parse_args()
+
+    if args.processes <= 1:
+        _worker_process(args.concurrency)
+    else:
+        # Spawn fresh interpreters so each process builds its own Redis connections
+        ctx = multiprocessing.get_context("spawn")
+        processes = [ctx.Process(target=_worker_process, args=(args.concurrency,)) for _ in range(args.processes)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()